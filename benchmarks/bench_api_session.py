@@ -0,0 +1,104 @@
+"""
+Micro-benchmark comparing a fresh aiohttp session per !ask (the old behavior)
+against the bot's pooled session from api_utils.create_session.
+
+Run from the repo root:
+    python -m benchmarks.bench_api_session --requests 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+from aiohttp import web
+
+import utilities.api_utils as api_utils
+
+
+async def _stub_ask(request):
+    # Mimics the agent API without doing any work, streams NDJSON tokens when asked to
+    payload = await request.json()
+    latency = request.app["latency"]
+    if latency:
+        await asyncio.sleep(latency)
+    reply = f"echo: {payload['query']}"
+    if not payload.get("stream"):
+        return web.json_response({"reply": reply})
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    for token in reply.split(" "):
+        await response.write(json.dumps({"response": token + " ", "done": False}).encode() + b"\n")
+    await response.write(json.dumps({"response": "", "done": True}).encode() + b"\n")
+    await response.write_eof()
+    return response
+
+
+async def start_stub_server(latency: float = 0.0):
+    """
+    Starts a local stand-in for the /ask/ endpoint and returns (runner, base_url).
+    - latency: Seconds the stub waits before answering, to mimic model time.
+    """
+    app = web.Application()
+    app["latency"] = latency
+    app.router.add_post(api_utils.ENDPOINT, _stub_ask)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def _run(requests: int, concurrency: int, session, logger) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await api_utils.ask(f"question {i}", logger, session=session)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests_per_sec": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def main(requests: int, concurrency: int):
+    logger = logging.getLogger("bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    runner, base_url = await start_stub_server()
+    api_utils.BASE_URL = base_url
+    try:
+        # Old path: a new session (connector, socket, handshake) for every call
+        one_off = await _run(requests, concurrency, None, logger)
+        # New path: one pooled session reused for every call
+        session = api_utils.create_session()
+        try:
+            pooled = await _run(requests, concurrency, session, logger)
+        finally:
+            await session.close()
+    finally:
+        await runner.cleanup()
+
+    print(f"{'':<10} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for name, result in (("one-off", one_off), ("pooled", pooled)):
+        print(f"{name:<10} {result['requests_per_sec']:>10} {result['p50_ms']:>10} {result['p99_ms']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,303 @@
+"""
+Offline benchmark suite for the bot.
+Drives DiscordBot and its cogs with synthetic events from benchmarks.fakes (no gateway,
+no Discord HTTP), a local stub of the /ask/ API and a fake asyncpg pool, and prints one
+JSON document with events/sec, p50/p99 latency and memory per scenario, so results can
+be diffed between releases.
+
+Each scenario runs twice: once for timings, once under tracemalloc for memory, so the
+tracing overhead doesn't skew the latencies.
+
+Run from the repo root:
+    python -m benchmarks.bench_bot --events 2000 --output results.json
+    python -m benchmarks.bench_bot --scenario on_message --scenario ask --concurrency 50
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import discord
+
+import utilities.api_utils as api_utils
+from benchmarks.bench_api_session import start_stub_server
+from benchmarks.fakes import FakeChannel, FakeContext, FakeGuild, FakeMessage, FakePool, FakeUser
+from bots.discordbot import DiscordBot
+from cogs.admin import PurgeFlags
+from utilities.logging_utils import setup_logging, close_logging
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+class BenchBot(DiscordBot):
+    """
+    The real bot, minus the gateway connection. Cogs are loaded by prepare() instead of setup_hook().
+    """
+
+    def __init__(self):
+        # Don't connect, the benchmarks drive the bot themselves
+        super().__init__(autorun=False)
+        # Log every event, results should measure the handlers, not how many the rate limits let through
+        self.log_sampler.configure("user_rate", 0)
+        self.log_sampler.configure("channel_rate", 0)
+
+    async def prepare(self, db_pool, logger_name: str):
+        self.db_pool = db_pool
+        self.logger = setup_logging(db_pool, asyncio.get_running_loop(), logger_name, logging.DEBUG, "logs")
+        self.api_session = api_utils.create_session()
+        await self.load_cogs(("logging", "games", "admin", "agent"))
+
+
+class Scenario:
+    """
+    One workload. setup() runs untimed, step(i) is one timed unit of work and
+    returns how many events it handled, stats() adds scenario specific numbers.
+    """
+    name = ""
+
+    def __init__(self, bot: BenchBot, options):
+        self.bot = bot
+        self.options = options
+        self.guild = FakeGuild()
+        self.channel = FakeChannel(self.guild, latency=options.http_latency)
+        self.users = [FakeUser(name=f"user{i}") for i in range(options.users)]
+        self.guild.members = self.users
+
+    async def setup(self):
+        pass
+
+    async def step(self, i: int) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class OnMessageScenario(Scenario):
+    """
+    Every on_message listener (LoggingCog's included) for a stream of chat messages,
+    called the same way bot.dispatch fans them out.
+    """
+    name = "on_message"
+
+    async def setup(self):
+        self.listeners = self.bot.extra_events.get("on_message", [])
+
+    async def step(self, i):
+        message = FakeMessage(self.channel, self.users[i % len(self.users)], f"message number {i}")
+        await asyncio.gather(*(listener(message) for listener in self.listeners))
+        return 1
+
+    def stats(self):
+        return {"listeners": len(self.listeners)}
+
+
+class AskScenario(Scenario):
+    """
+    AgentCog.query against the stub API. Questions repeat every '--unique-questions'
+    asks so the cache and request coalescing are exercised too.
+    """
+    name = "ask"
+
+    async def setup(self):
+        self.cog = self.bot.get_cog("Agent")
+        # Conversation context makes every question unique, only measure it when asked to
+        self.cog.memory = self.options.agent_memory
+
+    async def step(self, i):
+        ctx = FakeContext(self.bot, self.channel, self.users[i % len(self.users)])
+        question = f"what is question {i % self.options.unique_questions}"
+        await self.cog.query.callback(self.cog, ctx, *question.split())
+        return 1
+
+    def stats(self):
+        return {"cache": self.cog.cache.stats(), "scheduler": self.cog.scheduler.stats(),
+                "memory": self.cog.conversations.stats()}
+
+
+class GamesScenario(Scenario):
+    """
+    GamesCog's coinflip and rps, alternating. The callbacks are called directly,
+    so the coinflip cooldown isn't in the way.
+    """
+    name = "games"
+
+    async def setup(self):
+        self.cog = self.bot.get_cog("Games")
+
+    async def step(self, i):
+        ctx = FakeContext(self.bot, self.channel, self.users[i % len(self.users)])
+        if i % 2:
+            await self.cog.rps.callback(self.cog, ctx, ("rock", "paper", "scissors")[i % 3])
+        else:
+            await self.cog.coinflip.callback(self.cog, ctx)
+        return 1
+
+
+class ClearChannelScenario(Scenario):
+    """
+    AdminCog.clear_channel on channels of '--purge-size' messages spread over 30 days,
+    so both the bulk and the one by one delete paths run. One step is one whole purge,
+    every deleted message counts as an event.
+    """
+    name = "clear_channel"
+
+    async def setup(self):
+        self.cog = self.bot.get_cog("Admin")
+        self.deleted = 0
+        self.bulk_deletes = 0
+
+    async def step(self, i):
+        channel = FakeChannel(self.guild, latency=self.options.http_latency, name=f"purge{i}")
+        channel.fill_history(self.options.purge_size, self.users[i % len(self.users)])
+        ctx = FakeContext(self.bot, channel, self.users[0], "!clear_channel")
+        flags = await PurgeFlags.convert(ctx, "")
+        await self.cog.clear_channel.callback(self.cog, ctx, flags=flags)
+        job = self.cog.purge_jobs[channel.id]
+        await job.task
+        self.deleted += channel.deleted
+        self.bulk_deletes += channel.bulk_deletes
+        return channel.deleted
+
+    def stats(self):
+        return {"deleted": self.deleted, "bulk_deletes": self.bulk_deletes}
+
+
+SCENARIOS = {scenario.name: scenario for scenario in
+             (OnMessageScenario, AskScenario, GamesScenario, ClearChannelScenario)}
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    # Nearest rank, good enough for a few thousand samples
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def _run_scenario(scenario_class, options, trace_memory: bool) -> dict:
+    pool = FakePool(latency=options.db_latency)
+    bot = BenchBot()
+    logger_name = f"bench.{scenario_class.name}.{'memory' if trace_memory else 'timing'}"
+    async with bot:
+        await bot.prepare(pool, logger_name)
+        scenario = scenario_class(bot, options)
+        await scenario.setup()
+        steps = options.purges if scenario_class is ClearChannelScenario else options.events
+        latencies = []
+        events = 0
+        semaphore = asyncio.Semaphore(options.concurrency)
+
+        async def one(i):
+            nonlocal events
+            async with semaphore:
+                started = time.perf_counter()
+                handled = await scenario.step(i)
+                events += handled
+                latencies.append(time.perf_counter() - started)
+
+        if trace_memory:
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(steps)))
+        # Include writing out the queued log rows, that's part of handling the events
+        await close_logging(bot.logger)
+        elapsed = time.perf_counter() - started
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        result = {
+            "steps": steps,
+            "events": events,
+            "elapsed_s": round(elapsed, 3),
+            "db": {"acquires": pool.acquires, "round_trips": pool.round_trips, "rows_written": pool.rows_written},
+            **scenario.stats(),
+        }
+        if trace_memory:
+            result = {"memory_peak_kb": round((peak - baseline) / 1024, 1),
+                      "memory_retained_kb": round((current - baseline) / 1024, 1)}
+        else:
+            latencies.sort()
+            result.update({
+                "events_per_sec": round(events / elapsed, 1) if elapsed else 0.0,
+                "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+                "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+            })
+    # Don't let the next scenario's logger inherit this one's handlers
+    logging.getLogger(logger_name).handlers.clear()
+    return result
+
+
+def _metadata(options) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "discord.py": discord.__version__,
+        "platform": platform.platform(),
+        "options": vars(options),
+    }
+
+
+async def main(options) -> dict:
+    runner, base_url = await start_stub_server(latency=options.api_latency)
+    api_utils.BASE_URL = base_url
+    results = {}
+    try:
+        # The cogs print every log line, keep that out of the results
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for name in options.scenario or SCENARIOS:
+                timing = await _run_scenario(SCENARIOS[name], options, trace_memory=False)
+                memory = await _run_scenario(SCENARIOS[name], options, trace_memory=True)
+                results[name] = {**timing, **memory}
+    finally:
+        await runner.cleanup()
+    if resource is not None:
+        # ru_maxrss is in KiB on Linux
+        max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    else:
+        max_rss_kb = None
+    return {"meta": _metadata(options), "max_rss_kb": max_rss_kb, "scenarios": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run, repeat for several (default: all)")
+    parser.add_argument("--events", type=int, default=2000, help="Steps per scenario")
+    parser.add_argument("--purges", type=int, default=20, help="Purges for the clear_channel scenario")
+    parser.add_argument("--purge-size", type=int, default=500, help="Messages per purged channel")
+    parser.add_argument("--concurrency", type=int, default=20, help="Steps in flight at once")
+    parser.add_argument("--users", type=int, default=50, help="Distinct fake authors")
+    parser.add_argument("--unique-questions", type=int, default=100, help="Distinct !ask questions")
+    parser.add_argument("--http-latency", type=float, default=0.0, help="Seconds per fake Discord HTTP call")
+    parser.add_argument("--db-latency", type=float, default=0.0005, help="Seconds per fake DB round trip")
+    parser.add_argument("--agent-memory", action="store_true", help="Keep conversation memory on for the ask scenario")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Seconds the stub /ask/ API waits")
+    parser.add_argument("--output", help="Write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
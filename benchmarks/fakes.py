@@ -0,0 +1,245 @@
+"""
+In-process stand-ins for the Discord gateway/HTTP objects and the asyncpg pool,
+so the benchmarks can drive the real cogs without a network or a database.
+Only the attributes and coroutines the cogs actually touch are implemented.
+"""
+import asyncio
+import datetime
+import itertools
+
+import discord
+
+_ids = itertools.count(1_000_000_000_000_000_000)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+class FakeUser:
+    def __init__(self, user_id=None, name="user"):
+        self.id = user_id or next_id()
+        self.name = name
+        self.display_name = name
+        self.bot = False
+        self.mention = f"<@{self.id}>"
+        self.mutual_guilds = []
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeSentMessage:
+    """
+    What send() returns, supports the edits and deletes the cogs do on their own messages.
+    """
+
+    def __init__(self, channel, content):
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+        self.edits = 0
+
+    async def edit(self, content=None, **kwargs):
+        await asyncio.sleep(self.channel.latency)
+        self.content = content
+        self.edits += 1
+
+    async def delete(self):
+        await asyncio.sleep(self.channel.latency)
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content, created_at=None):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.pinned = False
+        self.attachments = []
+        self.created_at = created_at or discord.utils.utcnow()
+
+    async def delete(self):
+        await asyncio.sleep(self.channel.latency)
+        self.channel.deleted += 1
+
+
+class FakeGuild:
+    def __init__(self, name="guild", members=()):
+        self.id = next_id()
+        self.name = name
+        self.members = list(members)
+        self.chunked = True
+
+    def get_member(self, user_id):
+        return next((member for member in self.members if member.id == user_id), None)
+
+
+class FakeChannel:
+    """
+    A text channel whose HTTP calls just sleep for 'latency' seconds.
+    """
+
+    def __init__(self, guild=None, latency=0.0, name="general"):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.position = 0
+        self.latency = latency
+        self.sent = []
+        self.history_messages = []
+        self.deleted = 0
+        self.bulk_deletes = 0
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        message = FakeSentMessage(self, content)
+        self.sent.append(message)
+        return message
+
+    def typing(self):
+        return _NoopAsyncContext()
+
+    def fill_history(self, count, author, max_age_days=30.0):
+        """
+        Adds 'count' messages spread evenly over the last 'max_age_days' days, newest first.
+        """
+        now = discord.utils.utcnow()
+        step = datetime.timedelta(days=max_age_days) / max(count, 1)
+        self.history_messages = [FakeMessage(self, author, f"message {i}", created_at=now - step * i)
+                                 for i in range(count)]
+
+    async def history(self, limit=None, before=None, after=None, oldest_first=None):
+        messages = self.history_messages[:limit] if limit else self.history_messages
+        for index, message in enumerate(messages):
+            # Real history fetches pages of 100
+            if index % 100 == 0:
+                await asyncio.sleep(self.latency)
+            yield message
+
+    async def delete_messages(self, messages):
+        await asyncio.sleep(self.latency)
+        self.bulk_deletes += 1
+        self.deleted += len(messages)
+
+
+class FakeContext:
+    """
+    Enough of commands.Context for calling a command callback directly.
+    """
+
+    def __init__(self, bot, channel, author, content=""):
+        self.bot = bot
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.message = FakeMessage(channel, author, content)
+        self.prefix = "!"
+        self.command = None
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self):
+        return _NoopAsyncContext()
+
+
+class _NoopAsyncContext:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    """
+    Accepts the calls database_utils makes and sleeps 'latency' per round trip.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def _round_trip(self):
+        self.pool.round_trips += 1
+        await asyncio.sleep(self.pool.latency)
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        await self._round_trip()
+        self.pool.rows_written += len(records)
+
+    async def executemany(self, query, args):
+        await self._round_trip()
+        self.pool.rows_written += len(args)
+
+    async def execute(self, query, *args):
+        await self._round_trip()
+        return "OK"
+
+    async def fetch(self, query, *args):
+        await self._round_trip()
+        return []
+
+    async def fetchrow(self, query, *args):
+        await self._round_trip()
+        return None
+
+    async def fetchval(self, query, *args):
+        await self._round_trip()
+        return None
+
+    def transaction(self):
+        return _NoopAsyncContext()
+
+
+class FakePool:
+    """
+    Stand-in for asyncpg.Pool, counts acquires, round trips and rows written.
+    Like the real pool it also takes the query methods directly, each one acquiring
+    a connection for the call (database_utils hands anything that isn't an asyncpg.Pool
+    straight through as a connection).
+    """
+    QUERY_METHODS = ("copy_records_to_table", "executemany", "execute", "fetch", "fetchrow", "fetchval")
+
+    def __init__(self, latency=0.0005):
+        self.latency = latency
+        self.acquires = 0
+        self.round_trips = 0
+        self.rows_written = 0
+
+    def acquire(self):
+        self.acquires += 1
+        return _FakeAcquire(self)
+
+    async def close(self):
+        pass
+
+    def __getattr__(self, name):
+        if name not in self.QUERY_METHODS:
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            async with self.acquire() as conn:
+                return await getattr(conn, name)(*args, **kwargs)
+        return call
+
+
+class _FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return FakeConnection(self.pool)
+
+    async def __aexit__(self, *exc):
+        return False
@@ -0,0 +1,212 @@
+"""
+Cluster mode: splits the bot's shards over several worker processes, so gateway
+events are handled on more than one core. A supervisor starts one DiscordBot per
+worker, each owning a contiguous range of shards, and restarts any that crash.
+
+Run from the repo root (or set CLUSTER_WORKERS and use main.py):
+    python -m bots.cluster --workers 4
+    python -m bots.cluster --workers 4 --shards 16
+"""
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import signal
+import time
+from typing import Optional, Sequence
+
+import aiohttp
+from dotenv import load_dotenv
+load_dotenv()
+
+from utilities.config_utils import get_env_int
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+# Discord lets 'max_concurrency' shards identify per window of this many seconds
+IDENTIFY_WINDOW = 5.0
+
+
+def plan_shards(shard_count: int, workers: int) -> list:
+    """
+    Splits shard ids 0..shard_count-1 into contiguous ranges, one per worker.
+    Never plans more workers than shards.
+    """
+    workers = max(1, min(workers, shard_count))
+    base, extra = divmod(shard_count, workers)
+    plan, start = [], 0
+    for worker in range(workers):
+        size = base + (1 if worker < extra else 0)
+        plan.append(list(range(start, start + size)))
+        start += size
+    return plan
+
+
+def fetch_gateway_info(token: str) -> dict:
+    """
+    Asks Discord how many shards it recommends and how many may identify at once.
+    Returns {"shards": int, "max_concurrency": int}.
+    """
+
+    async def fetch():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}) as response:
+                response.raise_for_status()
+                return await response.json()
+
+    data = asyncio.run(fetch())
+    return {"shards": data["shards"], "max_concurrency": data["session_start_limit"]["max_concurrency"]}
+
+
+def _raise_interrupt(signum, frame):
+    # discord.py's run() shuts the bot down cleanly on KeyboardInterrupt, a second signal mustn't cut that short
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def _worker_main(cluster_id: int, cogs: Sequence[str], shard_ids: list, shard_count: int,
+                 env: dict, start_delay: float) -> None:
+    os.environ.update(env)
+    # Ctrl+C reaches the whole process group, let the supervisor decide and pass it on as SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    if start_delay:
+        time.sleep(start_delay)
+    # Imported here so each worker builds its own bot with the environment above
+    from bots.discordbot import DiscordBot
+    DiscordBot(*cogs, shard_ids=shard_ids, shard_count=shard_count, cluster_id=cluster_id)
+
+
+class ClusterSupervisor:
+    """
+    Runs one bot process per shard range and keeps them running.
+    A worker that exits with an error is restarted after a backoff that doubles on
+    every crash (up to 'max_restart_delay') and resets once it has stayed up for
+    'stable_after' seconds. A worker that exits cleanly is left stopped.
+    Every worker opens its own DB pool, when DB_POOL_MAX_TOTAL is set it's split
+    evenly so the whole cluster stays under that many connections.
+    - cogs: Cog names every worker loads.
+    - workers: How many processes to run.
+    - shard_count: Total shards, None to use Discord's recommendation.
+    - restart_delay: Seconds before the first restart of a crashed worker.
+    - max_restart_delay: Cap on the restart backoff.
+    - stable_after: Seconds of uptime after which a worker's backoff resets.
+    """
+
+    def __init__(
+            self,
+            cogs: Sequence[str],
+            workers: int = 2,
+            shard_count: Optional[int] = None,
+            restart_delay: float = 5.0,
+            max_restart_delay: float = 300.0,
+            stable_after: float = 600.0):
+        self.cogs = tuple(cogs)
+        self.workers = max(1, workers)
+        self.shard_count = shard_count
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after
+        self.max_concurrency = 1
+        self.plan = []
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = {} # cluster id -> Process
+        self._started_at = {} # cluster id -> monotonic start time
+        self._backoff = {} # cluster id -> next restart delay
+        self._restart_at = {} # cluster id -> monotonic time to restart a crashed worker
+        self._stopping = False
+
+    def run(self) -> None:
+        """
+        Starts every worker and supervises them until interrupted (Ctrl+C or SIGTERM).
+        """
+        if self.shard_count is None:
+            info = fetch_gateway_info(os.getenv("BOT_TOKEN"))
+            self.shard_count = info["shards"]
+            self.max_concurrency = info["max_concurrency"]
+        self.plan = plan_shards(self.shard_count, self.workers)
+        print(f"[CLUSTER] Running {self.shard_count} shards over {len(self.plan)} workers: "
+              f"{', '.join(f'{ids[0]}-{ids[-1]}' for ids in self.plan)}")
+
+        signal.signal(signal.SIGTERM, _raise_interrupt)
+        signal.signal(signal.SIGINT, _raise_interrupt)
+        # Stagger the first start so workers don't all identify in the same window
+        delay = 0.0
+        for cluster_id, shard_ids in enumerate(self.plan):
+            self._start(cluster_id, start_delay=delay)
+            delay += math.ceil(len(shard_ids) / self.max_concurrency) * IDENTIFY_WINDOW
+        try:
+            self._supervise()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """
+        Asks every worker to shut down and waits for them, killing any that hang.
+        """
+        self._stopping = True
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self._processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+        print("[CLUSTER] All workers stopped.")
+
+    def _start(self, cluster_id: int, start_delay: float = 0.0) -> None:
+        env = {"CLUSTER_ID": str(cluster_id)}
+        pool_total = get_env_int("DB_POOL_MAX_TOTAL", 0)
+        if pool_total:
+            env["DB_POOL_MAX_SIZE"] = str(max(1, pool_total // len(self.plan)))
+        process = self._context.Process(
+            target=_worker_main,
+            args=(cluster_id, self.cogs, self.plan[cluster_id], self.shard_count, env, start_delay),
+            name=f"bot-cluster-{cluster_id}"
+        )
+        process.start()
+        self._processes[cluster_id] = process
+        self._started_at[cluster_id] = time.monotonic() + start_delay
+        print(f"[CLUSTER] Started worker {cluster_id} (pid {process.pid}) for shards {self.plan[cluster_id]}")
+
+    def _supervise(self) -> None:
+        while not self._stopping:
+            now = time.monotonic()
+            for cluster_id, process in list(self._processes.items()):
+                if process.is_alive():
+                    if now - self._started_at[cluster_id] >= self.stable_after:
+                        self._backoff.pop(cluster_id, None)
+                    continue
+                if cluster_id in self._restart_at:
+                    if now >= self._restart_at[cluster_id]:
+                        del self._restart_at[cluster_id]
+                        self._start(cluster_id)
+                    continue
+                if process.exitcode == 0:
+                    # Shut down on purpose, leave it be
+                    continue
+                delay = self._backoff.get(cluster_id, self.restart_delay)
+                self._backoff[cluster_id] = min(delay * 2, self.max_restart_delay)
+                self._restart_at[cluster_id] = now + delay
+                print(f"[CLUSTER] Worker {cluster_id} exited with code {process.exitcode}, "
+                      f"restarting in {delay:.0f}s.")
+            if all(not process.is_alive() and process.exitcode == 0 for process in self._processes.values()):
+                print("[CLUSTER] Every worker shut down cleanly.")
+                return
+            time.sleep(1.0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=get_env_int("CLUSTER_WORKERS", 2),
+                        help="Worker processes to run")
+    parser.add_argument("--shards", type=int, default=get_env_int("SHARD_COUNT", 0) or None,
+                        help="Total shard count (default: Discord's recommendation)")
+    args = parser.parse_args()
+
+    from bots.discordbot import DEFAULT_COGS
+    ClusterSupervisor(DEFAULT_COGS, workers=args.workers, shard_count=args.shards).run()
@@ -3,49 +3,111 @@ import os
 import asyncio
 import asyncpg
 import logging
+import time
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from dotenv import load_dotenv
 load_dotenv()
 
-from utilities.logging_utils import setup_logging
-from cogs.games import GamesCog
-from cogs.general import GeneralCog
-from cogs.logging import LoggingCog
-from cogs.mentor import MentorCog
-from cogs.admin import AdminCog
-from cogs.agent import AgentCog
+from utilities.config_utils import get_env_bool, get_env_int, get_env_float, get_env_str
+from utilities.logging_utils import setup_logging, close_logging
+from utilities.api_utils import BACKEND, create_session
+from utilities.database_utils import create_db_pool, init_db_tables, maintain_log_partitions
+from utilities.member_utils import MemberSync
+from utilities.archive_utils import MessageArchive
+from utilities.analytics_utils import ActivityStats
+from utilities.cache_policy_utils import build_cache_policy, resolve_intents
+from utilities.sampling_utils import LogSampler, parse_sample_rates
+from utilities.cooldown_utils import MemoryCooldownStore, PostgresCooldownStore
+from bots.cluster import ClusterSupervisor
+from utilities.metrics_utils import (COMMAND_LATENCY, COMMANDS, EVENT_DURATION, EXTENSION_LOAD_TIME, GATEWAY_LATENCY,
+                                    start_metrics_server)
+from cogs import EXTENSIONS
+
+
+DEFAULT_COGS = (
+    "general",
+    "games",
+    "logging",
+    "mentor",
+    "admin",
+    "agent"
+)
 
 
 def start_bot():
-    DiscordBot(
-        "general",
-        "games",
-        "logging",
-        "mentor",
-        "admin",
-        "agent"
-    )
-
-
-class DiscordBot(commands.Bot):
-    def __init__(self, *cogs):
+    # CLUSTER_WORKERS > 1 splits the shards over that many processes under a supervisor
+    workers = get_env_int("CLUSTER_WORKERS", 1)
+    if workers > 1:
+        ClusterSupervisor(DEFAULT_COGS, workers=workers, shard_count=get_env_int("SHARD_COUNT", 0) or None).run()
+    else:
+        DiscordBot(*DEFAULT_COGS)
+
+
+class DiscordBot(commands.AutoShardedBot):
+    """
+    The bot. Runs every shard it's given in this process, by default the shard count
+    Discord recommends (or SHARD_COUNT). bots.cluster runs several of these side by side,
+    each with its own shard_ids and cluster_id.
+    - cogs: Names of the cogs to load.
+    - shard_ids: Shards this process owns, None for all of them.
+    - shard_count: Total shards across every process, None to ask Discord.
+    - cluster_id: Which cluster worker this is, None when running on our own.
+    - autorun: Connect straight away (blocking), as the bot always has.
+    """
+
+    def __init__(self, *cogs, shard_ids=None, shard_count=None, cluster_id=None, autorun=True):
         self.db_pool = None
+        self.api_session = None
+        self.member_sync = None
+        self.member_scan = None
+        self.message_archive = None
         self.logger = None
+        self.metrics_runner = None
         self.cogs_list = cogs
+        # Command cooldowns, moved into Postgres in setup_hook when there is a database
+        self.cooldown_store = MemoryCooldownStore()
+        # Lives on the bot so changes made with !log_sampling survive reloading the logging cog
+        self.log_sampler = LogSampler(sample_rates=parse_sample_rates(get_env_str("LOG_SAMPLE_RATES")),
+                                      user_rate=get_env_float("LOG_USER_RATE", 2.0),
+                                      user_burst=get_env_float("LOG_USER_BURST", 10.0),
+                                      channel_rate=get_env_float("LOG_CHANNEL_RATE", 20.0),
+                                      channel_burst=get_env_float("LOG_CHANNEL_BURST", 50.0),
+                                      summary_interval=get_env_float("LOG_SUMMARY_INTERVAL", 10.0))
+        # Live activity counters for !stats, on the bot so a logging cog reload keeps them
+        self.activity_stats = ActivityStats(bucket_seconds=get_env_float("ANALYTICS_BUCKET_SECONDS", 60.0),
+                                            slots=get_env_int("ANALYTICS_SLOTS", 60),
+                                            max_keys=get_env_int("ANALYTICS_MAX_KEYS", 100000),
+                                            flush_interval=get_env_float("ANALYTICS_FLUSH_INTERVAL", 60.0),
+                                            retention_days=get_env_int("ANALYTICS_RETENTION_DAYS", 90))
+        self.cluster_id = cluster_id
         self.prefix = "!"
         description = "A Discord bot that does stuff."
-        # Configure intents here
-        intents = discord.Intents.default()
-        intents.presences = True
-        intents.members = True
-        intents.message_content = True
+        # Only the intents our cogs ask for, plus INTENTS_ENABLE / INTENTS_DISABLE from .env
+        intents = resolve_intents(EXTENSIONS[cog].intents for cog in cogs if cog in EXTENSIONS)
+        cache_policy = build_cache_policy(intents)
+        # A member missing from the cache only means they left when every member of every guild is cached here
+        self.member_cache_complete = (cache_policy["member_cache_flags"].joined
+                                      and cache_policy["chunk_guilds_at_startup"]
+                                      and cluster_id is None)
         # Make sure we are running the Parent init method
+        if shard_count is None:
+            shard_count = get_env_int("SHARD_COUNT", 0) or None
         super().__init__(command_prefix=self.prefix,
                          intents=intents,
-                         description=description)
+                         description=description,
+                         shard_ids=shard_ids,
+                         shard_count=shard_count,
+                         **cache_policy)
         # Run bot through init method after configuring
-        self.run(os.getenv("BOT_TOKEN"))
+        if autorun:
+            self.run(os.getenv("BOT_TOKEN"))
+
+
+    @property
+    def handles_dms(self) -> bool:
+        # Discord delivers every DM to shard 0, only the process owning it should act on DMs
+        return self.shard_ids is None or 0 in self.shard_ids
 
 
     async def setup_hook(self):
@@ -56,7 +118,11 @@ class DiscordBot(commands.Bot):
         if db_url:
             try:
                 # Can't have this in init since it uses async
-                self.db_pool = await asyncpg.create_pool(dsn=db_url)
+                # Every process opens its own pool, sized per process so a cluster stays under the DB's limit
+                max_size = get_env_int("DB_POOL_MAX_SIZE", 10)
+                self.db_pool = await create_db_pool(db_url,
+                                                    min_size=min(get_env_int("DB_POOL_MIN_SIZE", 10), max_size),
+                                                    max_size=max_size)
                 # Set db_connected true so when our logger init's we can display status
                 db_connected = True
             except OSError as e:
@@ -71,7 +137,24 @@ class DiscordBot(commands.Bot):
             # Get a reference to the current async loop
             loop = asyncio.get_running_loop()
             # Init logger
-            self.logger = setup_logging(self.db_pool, loop, __name__, logging.DEBUG, "logs")
+            # Cluster workers log under their own name so every line and DB row says where it came from
+            logger_name = __name__ if self.cluster_id is None else f"{__name__}.cluster{self.cluster_id}"
+            log_file = get_env_str("LOG_FILE")
+            if log_file and self.cluster_id is not None:
+                # One file per worker, rotating files can't be shared between processes
+                root, ext = os.path.splitext(log_file)
+                log_file = f"{root}.cluster{self.cluster_id}{ext}"
+            self.logger = setup_logging(self.db_pool, loop, logger_name, logging.DEBUG, "logs",
+                                        batch_size=get_env_int("LOG_BATCH_SIZE", 500),
+                                        flush_interval=get_env_float("LOG_FLUSH_INTERVAL", 1.0),
+                                        max_queue_size=get_env_int("LOG_QUEUE_SIZE", 10000),
+                                        overflow=get_env_str("LOG_OVERFLOW", "drop_oldest"),
+                                        console=get_env_bool("LOG_CONSOLE", True),
+                                        file_path=log_file,
+                                        file_format=get_env_str("LOG_FILE_FORMAT", "text"),
+                                        file_max_bytes=get_env_int("LOG_FILE_MAX_BYTES", 10 * 1024 * 1024),
+                                        file_backups=get_env_int("LOG_FILE_BACKUPS", 5),
+                                        record_queue_size=get_env_int("LOG_RECORD_QUEUE_SIZE", 10000))
             #
             if db_connected:
                 # Log message if successful
@@ -79,32 +162,166 @@ class DiscordBot(commands.Bot):
         except Exception as e:
             print(f"Failed to configure logger. Error: {e}")
 
-        # From our cogs_list on init, loop through and use case matching to check for cogs
-        for cog in self.cogs_list:
-            match cog:
-                case "general":
-                    await self.add_cog(GeneralCog(self, self.logger))
-                case "games":
-                    await self.add_cog(GamesCog(self, self.logger))
-                case "logging":
-                    await self.add_cog(LoggingCog(self, self.logger))
-                case "mentor":
-                    await self.add_cog(MentorCog(self, self.logger))
-                case "admin":
-                    await self.add_cog(AdminCog(self, self.logger))
-                case "agent":
-                    await self.add_cog(AgentCog(self, self.logger))
-                case _:
-                    # Default case: if no names matches, no cog is added
-                    self.logger.error(f"Cog {cog} not found.")
+        if db_connected:
+            try:
+                await init_db_tables(self.db_pool, partitions_ahead=get_env_int("LOG_PARTITIONS_AHEAD", 3))
+                # Keep future log partitions created and expired ones dropped, one process is enough
+                if not self.cluster_id:
+                    self.maintain_logs.start()
+                # Keep the users table in step with guild members
+                self.member_sync = MemberSync(self.db_pool,
+                                              flush_interval=get_env_float("MEMBER_SYNC_INTERVAL", 5.0),
+                                              chunk_size=get_env_int("MEMBER_SYNC_CHUNK", 5000),
+                                              delete_departed=self.member_cache_complete)
+                self.member_sync.start()
+                # Searchable copy of guild messages for !search
+                if get_env_bool("ARCHIVE_MESSAGES", True):
+                    self.message_archive = MessageArchive(self.db_pool, loop,
+                                                          batch_size=get_env_int("ARCHIVE_BATCH_SIZE", 500),
+                                                          flush_interval=get_env_float("ARCHIVE_FLUSH_INTERVAL", 2.0),
+                                                          max_queue_size=get_env_int("ARCHIVE_QUEUE_SIZE", 20000))
+                    self.message_archive.start()
+                # Write the activity counters out as rollups
+                if get_env_bool("ANALYTICS_ROLLUPS", True):
+                    self.activity_stats.db_pool = self.db_pool
+                # Share cooldowns between shards and processes, and keep them over restarts
+                if get_env_str("COOLDOWN_BACKEND", "postgres") == "postgres":
+                    self.cooldown_store = PostgresCooldownStore(self.db_pool)
+            except Exception as e:
+                self.logger.error(f"Failed to initialize database tables. Error: {e}")
+
+        # Local Prometheus endpoint, off unless METRICS_PORT is set
+        metrics_port = get_env_int("METRICS_PORT", 0)
+        if metrics_port:
+            # Cluster workers each take the next port up
+            metrics_port += self.cluster_id or 0
+            try:
+                self.metrics_runner = await start_metrics_server(get_env_str("METRICS_HOST", "127.0.0.1"), metrics_port)
+            except OSError as e:
+                self.logger.error(f"Failed to start the metrics server. Error: {e}")
+
+        # Rolls up to the database if it has one, otherwise just drops idle counters
+        self.activity_stats.start()
+
+        # One pooled HTTP session for the agent API, shared by every request for the life of the bot
+        self.api_session = create_session()
+
+        # Cogs are extensions, imported only now and loaded side by side
+        await self.load_cogs(self.cogs_list)
+
+
+    async def load_cogs(self, names):
+        """
+        Loads the named cogs concurrently, logging how long each took.
+        A cog that fails to load is logged and skipped, the others still load.
+        """
+        await asyncio.gather(*(self.load_cog(name) for name in names))
+
+
+    async def load_cog(self, name) -> bool:
+        extension = EXTENSIONS.get(name)
+        if extension is None:
+            self.logger.error(f"Cog {name} not found.")
+            return False
+        started = time.perf_counter()
+        try:
+            await self.load_extension(extension.module)
+        except commands.ExtensionError as e:
+            self.logger.error(f"Failed to load cog {name}. Error: {e}")
+            return False
+        elapsed = time.perf_counter() - started
+        EXTENSION_LOAD_TIME.labels(name).set(elapsed)
+        self.logger.debug(f"Loaded cog {name} in {elapsed * 1000:.1f}ms")
+        return True
+
+
+    async def reload_cog(self, name) -> float:
+        """
+        Re-imports a loaded cog's module and swaps the cog in place, the gateway connection stays up.
+        If the new code fails to load, discord.py puts the old version back and the error is raised.
+        Returns how long the reload took in seconds.
+        """
+        started = time.perf_counter()
+        await self.reload_extension(EXTENSIONS[name].module)
+        elapsed = time.perf_counter() - started
+        EXTENSION_LOAD_TIME.labels(name).set(elapsed)
+        self.logger.info(f"Reloaded cog {name} in {elapsed * 1000:.1f}ms")
+        return elapsed
+
+
+    async def invoke(self, ctx):
+        # Time every command, the callback runs inside super().invoke
+        started = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            if ctx.command is not None:
+                cog = ctx.command.cog_name or "none"
+                command = ctx.command.qualified_name
+                COMMAND_LATENCY.labels(cog, command).observe(time.perf_counter() - started)
+                COMMANDS.labels(cog, command, "error" if ctx.command_failed else "ok").inc()
+
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # Every listener runs through here (discord.py internals), so this times each handler separately
+        started = time.perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            EVENT_DURATION.labels(event_name, getattr(coro, "__qualname__", "unknown")).observe(
+                time.perf_counter() - started)
+
+
+    async def on_shard_ready(self, shard_id):
+        # Heartbeat latency is read when metrics are scraped, nothing to update per heartbeat
+        GATEWAY_LATENCY.labels(shard_id).set_function(lambda: self.get_shard(shard_id).latency)
+        self.logger.debug(f"Shard {shard_id} ready")
 
 
     async def on_ready(self):
         # Called when bot is up and running
         self.logger.debug(f"Logged in as {self.user} (ID: {self.user.id})")
+        # Initial member scan, guilds already scanned are skipped when on_ready fires again after a reconnect
+        if self.member_sync is not None:
+            self.member_scan = asyncio.create_task(self.member_sync.scan_guilds(self.guilds))
+
+
+    async def on_guild_join(self, guild):
+        if self.member_sync is not None:
+            await self.member_sync.scan_guilds([guild])
+
+
+    @tasks.loop(hours=1)
+    async def maintain_logs(self):
+        try:
+            await maintain_log_partitions(self.db_pool,
+                                          days_ahead=get_env_int("LOG_PARTITIONS_AHEAD", 3),
+                                          retention_days=get_env_int("LOG_RETENTION_DAYS", 30))
+        except Exception as e:
+            self.logger.error(f"Log partition maintenance failed. Error: {e}")
 
 
     async def close(self):
+        # Stop partition maintenance before the pool goes away
+        self.maintain_logs.cancel()
+        # Write out pending member changes while the pool is still open
+        if self.member_sync is not None:
+            await self.member_sync.close()
+        # Same for messages waiting to be archived
+        if self.message_archive is not None:
+            await self.message_archive.close()
+        # And the activity counted since the last rollup
+        await self.activity_stats.close()
+        # Write out any log rows still waiting in the batch queue while the pool is open
+        await close_logging(self.logger)
+        # Stop serving metrics
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        # Stop probing the agent API if its circuit is open
+        BACKEND.breaker.close()
+        # Release the pooled agent API connections
+        if self.api_session is not None:
+            await self.api_session.close()
         # When the bot closes out, if there is an active connection to db_pool
         if self.db_pool is not None:
             if hasattr(self, "db_pool"):
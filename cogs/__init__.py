@@ -0,0 +1,24 @@
+from typing import NamedTuple
+
+
+class Extension(NamedTuple):
+    """
+    A loadable cog: the module holding its setup(bot) function, and the gateway
+    intents it needs (read before connecting, so the module isn't imported for it).
+    """
+    module: str
+    intents: tuple = ()
+
+
+# Cog name -> extension. Modules are only imported when the bot loads them.
+EXTENSIONS = {
+    # !clear_dm resolves a guild member
+    "general": Extension("cogs.general", intents=("members",)),
+    "games": Extension("cogs.games"),
+    # Member events for the users table and join/leave logs, reactions for the reaction log
+    "logging": Extension("cogs.logging", intents=("members", "guild_reactions", "dm_reactions")),
+    "mentor": Extension("cogs.mentor"),
+    # The purge author: filter resolves a guild member
+    "admin": Extension("cogs.admin", intents=("members",)),
+    "agent": Extension("cogs.agent"),
+}
@@ -1,21 +1,310 @@
+import datetime
+import time
+from typing import Optional
+
 import discord
 from discord.ext import commands
+from cogs import EXTENSIONS
+from utilities.api_utils import BACKEND
+from utilities.cache_policy_utils import cache_report, current_rss_bytes
+from utilities.config_utils import get_env_float, get_env_int
+from utilities.message_utils import send_long_message
+from utilities.purge_utils import PurgeJob, clone_and_delete
+from utilities.sampling_utils import LIMIT_SETTINGS
+
+
+class SnowflakeOrDate(commands.Converter):
+    """
+    Accepts a message id/link or a YYYY-MM-DD date (UTC) as a history bound.
+    """
+
+    async def convert(self, ctx, argument):
+        argument = argument.strip()
+        # Message links end in the message id
+        candidate = argument.rstrip("/").rsplit("/", 1)[-1]
+        if candidate.isdigit():
+            return discord.Object(id=int(candidate))
+        try:
+            return datetime.datetime.strptime(argument, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+        except ValueError:
+            raise commands.BadArgument(f"{argument!r} is not a message id or a YYYY-MM-DD date.")
+
+
+class PurgeFlags(commands.FlagConverter, delimiter=":", prefix=""):
+    # A User, not a Member, so people who already left the guild can be cleaned up after
+    author: Optional[discord.User] = None
+    contains: Optional[str] = None
+    before: Optional[SnowflakeOrDate] = None
+    after: Optional[SnowflakeOrDate] = None
+    limit: Optional[int] = None
+    keep_pinned: bool = False
+
+
+class SearchFlags(commands.FlagConverter, delimiter=":", prefix=""):
+    query: str = commands.flag(positional=True, default="")
+    channel: Optional[discord.TextChannel] = commands.flag(name="in", default=None)
+    author: Optional[discord.User] = commands.flag(name="from", default=None)
+    before: Optional[int] = None # Message id the previous page ended on
+
 
 class AdminCog(commands.Cog, name="Admin"):
     def __init__(self, bot, logger):
         self.bot = bot
         self.logger = logger
+        self.purge_jobs = {} # channel id -> running PurgeJob
+        self.old_delete_delay = get_env_float("PURGE_OLD_DELAY", 0.0) # Extra pause between single deletes
+        self.search_page_size = get_env_int("SEARCH_PAGE_SIZE", 10)
 
     @commands.Cog.listener()
     async def on_ready(self):
         self.logger.debug("Loaded Admin Cog")
 
-    @commands.command(name="clear_channel")
-    async def clear_channel(self, ctx):
+    async def cog_unload(self):
+        # Don't leave purges running against a cog that's gone
+        for job in self.purge_jobs.values():
+            job.cancel()
+
+    @commands.command(name="clear_channel",
+                      help="Delete messages in this channel. "
+                           "Filters: author: @user contains: text before: id/date after: id/date limit: n keep_pinned: yes")
+    @commands.has_permissions(manage_messages=True)
+    async def clear_channel(self, ctx, *, flags: PurgeFlags):
         try:
             if not isinstance(ctx.channel, discord.DMChannel):  # Ensure the command is not executed in a DM channel
-                await ctx.channel.purge(limit=None) # Purge channel
+                existing = self.purge_jobs.get(ctx.channel.id)
+                if existing is not None and existing.running:
+                    await ctx.send("A purge is already running here, use `!clear_channel_stop` to cancel it.")
+                    return
+                status = await ctx.send("Purging channel...")
+                job = PurgeJob(ctx.channel,
+                               check=self._build_check(flags),
+                               before=flags.before,
+                               after=flags.after,
+                               limit=flags.limit,
+                               skip_ids={status.id},
+                               keep_pinned=flags.keep_pinned,
+                               old_delay=self.old_delete_delay,
+                               progress=lambda job: status.edit(content=f"Purging channel... {job.summary()}"))
+                self.purge_jobs[ctx.channel.id] = job
+                job.start()
+                # Report back once it's done, the command itself returns right away
+                job.task.add_done_callback(lambda task: self.bot.loop.create_task(self._purge_done(ctx, job, status)))
             else:
                 await ctx.send("This command cannot be used in direct messages.")
         except Exception as e:
-            self.logger.error(f"Error clearing channel: {e}")
\ No newline at end of file
+            self.logger.error(f"Error clearing channel: {e}")
+
+    @commands.command(name="clear_channel_stop", help="Cancel the running purge in this channel.")
+    @commands.has_permissions(manage_messages=True)
+    async def clear_channel_stop(self, ctx):
+        job = self.purge_jobs.get(ctx.channel.id)
+        if job is None or not job.running:
+            await ctx.send("There is no purge running in this channel.")
+            return
+        job.cancel()
+
+    @commands.command(name="nuke_channel", help="Wipe this channel by recreating it. Pins and webhooks are lost.")
+    @commands.has_permissions(manage_channels=True)
+    async def nuke_channel(self, ctx, confirm: str = None):
+        try:
+            if isinstance(ctx.channel, discord.DMChannel):
+                await ctx.send("This command cannot be used in direct messages.")
+                return
+            if confirm != "confirm":
+                await ctx.send("This deletes and recreates the channel. Run `!nuke_channel confirm` to go ahead.")
+                return
+            new_channel = await clone_and_delete(ctx.channel, reason=f"Channel wipe requested by {ctx.author}")
+            await new_channel.send(f"Channel wiped by {ctx.author.mention}.")
+            self.logger.warning(f"{ctx.author} wiped channel #{new_channel.name}")
+        except Exception as e:
+            self.logger.error(f"Error wiping channel: {e}")
+
+    @commands.command(name="search",
+                      help="Search this server's message archive, newest first. Results are sent by DM. "
+                           "e.g. !search \"exact phrase\" -word in: #channel from: @user")
+    @commands.has_permissions(manage_messages=True)
+    @commands.guild_only()
+    async def search(self, ctx, *, flags: SearchFlags):
+        archive = self.bot.message_archive
+        if archive is None:
+            await ctx.send("The message archive isn't enabled.")
+            return
+        if not flags.query.strip():
+            await ctx.send("Give me something to search for.")
+            return
+        # Only channels the caller could scroll back through themselves
+        readable = [channel.id for channel in (*ctx.guild.channels, *ctx.guild.threads)
+                    if not isinstance(channel, (discord.CategoryChannel, discord.ForumChannel))
+                    and self._can_read_history(channel, ctx.author)]
+        if flags.channel is not None and flags.channel.id not in readable:
+            await ctx.send("You can't read that channel's history.")
+            return
+        try:
+            # One extra row tells us whether there's another page
+            rows = await archive.search(ctx.guild.id, flags.query,
+                                        channel_id=flags.channel.id if flags.channel else None,
+                                        author_id=flags.author.id if flags.author else None,
+                                        before=flags.before,
+                                        limit=self.search_page_size + 1,
+                                        channel_ids=readable)
+        except Exception as e:
+            self.logger.error(f"Error searching the archive: {e}")
+            await ctx.send("The search failed, see the logs.")
+            return
+        if not rows:
+            await ctx.send("No more matches." if flags.before else "No matches.")
+            return
+        lines = []
+        for row in rows[:self.search_page_size]:
+            snippet = discord.utils.escape_mentions(discord.utils.escape_markdown(" ".join(row["content"].split())))
+            if len(snippet) > 150:
+                snippet = snippet[:150] + "…"
+            link = f"https://discord.com/channels/{ctx.guild.id}/{row['channel_id']}/{row['message_id']}"
+            lines.append(f"<t:{int(row['created_at'].timestamp())}:f> **{discord.utils.escape_markdown(row['author_name'])}** "
+                         f"in <#{row['channel_id']}>: {snippet} ([jump]({link}))")
+        if len(rows) > self.search_page_size:
+            # Keyset pagination, the next page starts below the last message shown
+            lines.append(f"\nFor older matches, run the same search with "
+                         f"`before: {rows[self.search_page_size - 1]['message_id']}`")
+        # Results can come from channels the rest of this channel can't see, so they go to the caller only
+        try:
+            await send_long_message(ctx.author, "\n".join(lines))
+        except discord.Forbidden:
+            await ctx.send("I can't DM you the results, allow direct messages from this server and try again.")
+            return
+        await ctx.send(f"Sent {min(len(rows), self.search_page_size)} result(s) to your DMs.")
+
+    @commands.command(name="cache_report", help="Show the bot's intents, cache settings and what each cache costs.")
+    @commands.is_owner()
+    async def cache_report(self, ctx):
+        try:
+            intents = [name for name, enabled in self.bot.intents if enabled]
+            member_cache = [name for name, enabled in self.bot._connection.member_cache_flags if enabled]
+            lines = [
+                f"**Intents**: {', '.join(intents)}",
+                f"**Member cache**: {', '.join(member_cache) or 'none'}",
+                f"**Max messages**: {self.bot._connection.max_messages}",
+                f"**Chunk guilds at startup**: {self.bot._connection._chunk_guilds}",
+            ]
+            for name, cache in cache_report(self.bot).items():
+                lines.append(f"**{name}**: {cache['count']} (~{cache['approx_bytes'] / 1024:.0f} KiB)")
+            rss = current_rss_bytes()
+            if rss is not None:
+                lines.append(f"**Resident memory**: {rss / 1024 / 1024:.1f} MiB")
+            await ctx.send("\n".join(lines))
+        except Exception as e:
+            self.logger.error(f"Error building cache report: {e}")
+
+    @commands.command(name="agent_health", help="Show the agent API's circuit breaker, retries and deadline.")
+    @commands.is_owner()
+    async def agent_health(self, ctx):
+        status = BACKEND.status()
+        budget = status.pop("budget")
+        lines = [f"**{name}**: {value}" for name, value in status.items() if value is not None]
+        lines.append(f"**retry budget**: {budget['retries']} retries for {budget['requests']} requests "
+                     f"in the last {BACKEND.budget.window}s, {budget['refused']} refused")
+        await ctx.send("\n".join(lines))
+
+    @commands.command(name="reload", help="Reload (or load) a cog from disk without reconnecting, e.g. !reload agent")
+    @commands.is_owner()
+    async def reload(self, ctx, name: str):
+        name = name.lower()
+        if name not in EXTENSIONS:
+            await ctx.send(f"Unknown cog `{name}`. Cogs: {', '.join(EXTENSIONS)}")
+            return
+        try:
+            verb = "Reloaded"
+            if EXTENSIONS[name].module in self.bot.extensions:
+                elapsed = await self.bot.reload_cog(name)
+            else:
+                verb = "Loaded"
+                started = time.perf_counter()
+                if not await self.bot.load_cog(name):
+                    await ctx.send(f"Failed to load `{name}`, see the logs.")
+                    return
+                elapsed = time.perf_counter() - started
+            await ctx.send(f"{verb} `{name}` in {elapsed * 1000:.0f}ms.")
+        except commands.ExtensionError as e:
+            # The previous version is still loaded
+            self.logger.error(f"Error reloading cog {name}: {e}")
+            await ctx.send(f"Reload of `{name}` failed, the old version is still running: {e}")
+
+    @commands.command(name="unload", help="Unload a cog until the next !reload or restart.")
+    @commands.is_owner()
+    async def unload(self, ctx, name: str):
+        name = name.lower()
+        if name == "admin":
+            await ctx.send("The admin cog can't unload itself, use `!reload admin` instead.")
+            return
+        extension = EXTENSIONS.get(name)
+        if extension is None or extension.module not in self.bot.extensions:
+            await ctx.send(f"`{name}` isn't loaded.")
+            return
+        await self.bot.unload_extension(extension.module)
+        self.logger.info(f"Unloaded cog {name}")
+        await ctx.send(f"Unloaded `{name}`.")
+
+    @commands.command(name="log_sampling",
+                      help="Show or change log sampling, e.g. !log_sampling message 0.2 or !log_sampling user_rate 1. "
+                           f"Settings: {', '.join(LIMIT_SETTINGS)}, or an event name for its sample rate.")
+    @commands.is_owner()
+    async def log_sampling(self, ctx, name: str = None, value: float = None):
+        sampler = self.bot.log_sampler
+        if name is not None:
+            if value is None:
+                await ctx.send(f"Give a value for `{name}`.")
+                return
+            try:
+                sampler.configure(name, value)
+            except ValueError as e:
+                await ctx.send(str(e))
+                return
+            self.logger.info(f"{ctx.author} set log sampling {name} to {value}")
+        settings = sampler.settings()
+        rates = settings.pop("sample_rates")
+        lines = [f"**{setting}**: {value:g}" for setting, value in settings.items()]
+        lines.append(f"**sample rates**: {', '.join(f'{event}={rate:g}' for event, rate in rates.items()) or 'all 1'}")
+        await ctx.send("\n".join(lines))
+
+    async def _purge_done(self, ctx, job, status):
+        if self.purge_jobs.get(ctx.channel.id) is job:
+            del self.purge_jobs[ctx.channel.id]
+        if job.task.cancelled():
+            result = f"Purge cancelled. {job.summary()}"
+        elif job.task.exception() is not None:
+            result = f"Purge stopped by an error. {job.summary()}"
+            self.logger.error(f"Error clearing channel: {job.task.exception()}")
+        else:
+            result = f"Purge finished. {job.summary()}"
+        self.logger.info(f"#{ctx.channel} {result}")
+        try:
+            await status.edit(content=result)
+        except discord.HTTPException:
+            pass
+
+    @staticmethod
+    def _can_read_history(channel, member: discord.Member) -> bool:
+        permissions = channel.permissions_for(member)
+        if not permissions.read_message_history:
+            return False
+        # Threads take their permissions from the parent, a private one also needs membership or manage_threads
+        if isinstance(channel, discord.Thread) and channel.is_private():
+            return (permissions.manage_threads or channel.owner_id == member.id
+                    or any(thread_member.id == member.id for thread_member in channel.members))
+        return True
+
+    @staticmethod
+    def _build_check(flags):
+        checks = []
+        if flags.author is not None:
+            checks.append(lambda message: message.author.id == flags.author.id)
+        if flags.contains:
+            needle = flags.contains.casefold()
+            checks.append(lambda message: needle in message.content.casefold())
+        if not checks:
+            return None
+        return lambda message: all(check(message) for check in checks)
+
+
+async def setup(bot):
+    await bot.add_cog(AdminCog(bot, bot.logger))
@@ -1,39 +1,207 @@
+import math
+
 import discord
 from discord.ext import commands
-from utilities.api_utils import ask
+from utilities.api_utils import BACKEND, ask, ask_stream
+from utilities.cache_utils import ResponseCache
+from utilities.config_utils import get_env_bool, get_env_float, get_env_int
+from utilities.conversation_utils import ASSISTANT, ConversationStore, context_digest
+from utilities.cooldown_utils import cooldown
+from utilities.message_utils import StreamingMessage, QueuePositionMessage, send_long_message
+from utilities.scheduler_utils import FairScheduler, ShedError, SupersededError
 
 class AgentCog(commands.Cog, name="Agent"):
-    def __init__(self, bot, logger):
+    def __init__(self, bot, logger, session=None):
         self.bot = bot
         self.logger = logger
+        self.session = session # Pooled aiohttp session owned by the bot
+        self.streaming = get_env_bool("AGENT_STREAMING", True)
+        self.edit_interval = get_env_float("AGENT_EDIT_INTERVAL", 1.0) # Seconds between message edits
+        self.file_threshold = get_env_int("AGENT_FILE_THRESHOLD", 6000) # Longer replies are sent as a file
+        # Identical questions share one upstream call, and repeats within the TTL are answered from cache
+        self.cache = ResponseCache(
+            ttl=get_env_float("AGENT_CACHE_TTL", 300.0),
+            max_entries=get_env_int("AGENT_CACHE_SIZE", 1024),
+            max_bytes=get_env_int("AGENT_CACHE_BYTES", 4 * 1024 * 1024),
+            db_pool=bot.db_pool if get_env_bool("AGENT_CACHE_DB", False) else None
+        )
+        # Only a few questions reach the GPU box at once, the rest wait their turn fairly
+        self.scheduler = FairScheduler(
+            max_in_flight=get_env_int("AGENT_MAX_IN_FLIGHT", 2),
+            max_wait=get_env_float("AGENT_QUEUE_TIMEOUT", 120.0),
+            max_queue=get_env_int("AGENT_QUEUE_SIZE", 100)
+        )
+        # Recent turns per user and channel, prepended to new questions so follow-ups make sense
+        self.memory = get_env_bool("AGENT_MEMORY", True)
+        self.conversations = ConversationStore(
+            max_tokens=get_env_int("AGENT_MEMORY_TOKENS", 1500),
+            max_turns=get_env_int("AGENT_MEMORY_TURNS", 20),
+            max_conversations=get_env_int("AGENT_MEMORY_CONVERSATIONS", 1000),
+            idle_ttl=get_env_float("AGENT_MEMORY_IDLE", 3600.0),
+            summarizer=self._summarize if get_env_bool("AGENT_MEMORY_SUMMARIZE", False) else None,
+            db_pool=bot.db_pool if get_env_bool("AGENT_MEMORY_DB", False) else None
+        )
 
     @commands.Cog.listener()
     async def on_ready(self):
         self.logger.debug("Loaded Agent Cog")
 
     @commands.command(name="ask", help="Query the agent with a question.")
+    # Read when the cog is (re)loaded
+    @cooldown(get_env_int("AGENT_ASK_RATE", 5), get_env_float("AGENT_ASK_PER", 60.0), commands.BucketType.user)
     async def query(self, ctx, *query: str):
         try:
             if not query:
                 await ctx.send("Please provide a question to ask.")
                 return
             query_text = " ".join(query)
+            context = ""
+            if self.memory:
+                conversation_key = self.conversations.make_key(ctx.author.id, ctx.channel.id)
+                context = self.conversations.render(await self.conversations.get(conversation_key))
+            prompt = self.conversations.build_prompt(context, query_text)
             # Show typing indicator while processing
             async with ctx.typing():
-                response = await ask(query_text, self.logger, show_thoughts=False)
-                if response:
-                    if isinstance(response, dict):
-                        if "response" in response:
-                            await ctx.send(response["response"])
-                        elif "error" in response:
-                            await ctx.send(f"Error: {response['error']}")
-                        else:
-                            await ctx.send(str(response))
-                    else:
-                        await ctx.send(str(response))
-                else:
-                    await ctx.send("Sorry, I didn't get a response from the API.")
+                response, source = await self.cache.get_or_fetch(
+                    query_text, False, lambda: self._fetch_reply(ctx, prompt), context=context_digest(context)
+                )
+                # On a miss the reply was already sent while fetching, otherwise send the shared one
+                if source != "miss":
+                    await self._send_reply(ctx, response)
+            if self.memory and isinstance(response, dict) and "response" in response and "error" not in response:
+                await self.conversations.add_exchange(conversation_key, query_text, str(response["response"]))
+        except SupersededError:
+            # The user asked something newer, that request answers them instead
+            pass
+        except ShedError as e:
+            await ctx.send(f"The agent is too busy right now, please try again later. ({e})")
         except Exception as e:
             self.logger.error(f"Error querying: {e}")
             await ctx.send(f"An error occurred: {str(e)}")
 
+    @commands.command(name="forget", help="Make the agent forget your conversation in this channel.")
+    async def forget(self, ctx):
+        await self.conversations.reset(self.conversations.make_key(ctx.author.id, ctx.channel.id))
+        await ctx.send("Done, your next question starts a new conversation.")
+
+    @commands.command(name="ask_stats", help="Show agent response cache and queue statistics.")
+    async def ask_stats(self, ctx):
+        stats = {**self.cache.stats(), **{f"queue_{name}": value for name, value in self.scheduler.stats().items()},
+                 **{f"memory_{name}": value for name, value in self.conversations.stats().items()}}
+        await ctx.send("\n".join(f"**{name}**: {value}" for name, value in stats.items()))
+
+    async def _fetch_reply(self, ctx, query_text) -> dict:
+        retry_after = BACKEND.breaker.retry_after
+        if retry_after is not None:
+            # Known to be down, answer now instead of queueing for it
+            response = {"error": f"The agent is unavailable right now, try again in {math.ceil(retry_after) or 1}s."}
+            await self._send_reply(ctx, response)
+            return response
+        # Wait for a slot in the scheduler, telling the user where they are in line
+        notice = QueuePositionMessage(ctx)
+        guild_key = ctx.guild.id if ctx.guild else None
+        try:
+            return await self.scheduler.submit(ctx.author.id, guild_key,
+                                               lambda: self._run_reply(ctx, query_text),
+                                               on_position=notice.update)
+        finally:
+            await notice.close()
+
+    async def _run_reply(self, ctx, query_text) -> dict:
+        # Ask the API, send the reply as it comes in, and return it so it can be cached and shared
+        if self.streaming:
+            return await self._stream_reply(ctx, query_text)
+        response = await ask(query_text, self.logger, show_thoughts=False, session=self.session)
+        try:
+            await self._send_reply(ctx, response)
+        except discord.HTTPException as e:
+            # Still return (and cache) the reply, asking again would only redo the generation
+            self.logger.error(f"Error sending agent reply: {e}")
+        return response
+
+    async def _stream_reply(self, ctx, query_text) -> dict:
+        # Edit a single message as tokens arrive instead of waiting for the whole generation
+        stream = StreamingMessage(ctx, min_interval=self.edit_interval)
+        parts = [] # Everything generated, kept apart from what Discord managed to show
+        length = 0
+        as_file = False # Past file_threshold, the rest is only collected and sent as a file at the end
+        shown = True # False once Discord refused an edit, the reply is still returned and cached
+        error = None
+        try:
+            async for chunk in ask_stream(query_text, self.logger, show_thoughts=False, session=self.session):
+                if chunk.pop("whole", False) or ("error" in chunk and not parts):
+                    # A whole reply from a backend that doesn't stream, or an error before any text,
+                    # goes through the one-shot formatting (split or sent as a file)
+                    try:
+                        await self._send_reply(ctx, chunk)
+                    except discord.HTTPException as e:
+                        self.logger.error(f"Error sending agent reply: {e}")
+                    return chunk
+                if isinstance(chunk.get("response"), str):
+                    parts.append(chunk["response"])
+                    length += len(chunk["response"])
+                    if as_file or not shown:
+                        continue
+                    if length > self.file_threshold:
+                        as_file = True
+                        delta = "\n\n… the full reply follows as a file."
+                    else:
+                        delta = chunk["response"]
+                elif "error" in chunk:
+                    error = chunk["error"]
+                    if not shown:
+                        continue
+                    delta = f"\n\nError: {error}"
+                else:
+                    continue
+                try:
+                    await stream.append(delta)
+                except discord.HTTPException as e:
+                    self.logger.error(f"Error streaming agent reply: {e}")
+                    shown = False
+        finally:
+            try:
+                await stream.finish()
+            except discord.HTTPException as e:
+                # The background editor failed, what was generated is still returned below
+                self.logger.error(f"Error streaming agent reply: {e}")
+        text = "".join(parts)
+        if not text and error is None:
+            await ctx.send("Sorry, I didn't get a response from the API.")
+            return {}
+        if as_file and shown:
+            try:
+                await send_long_message(ctx, text, file_threshold=self.file_threshold)
+            except discord.HTTPException as e:
+                self.logger.error(f"Error sending agent reply: {e}")
+        # A reply cut short by an error isn't worth caching
+        return {"error": error} if error else {"response": text}
+
+    async def _summarize(self, summary: str, turns: list) -> str:
+        # Summarizer hook for the conversation store, the agent condenses turns that fell out of the budget
+        lines = "\n".join(f"{'Assistant' if role == ASSISTANT else 'User'}: {text}" for role, text in turns)
+        prompt = ("Summarize this conversation in a few sentences, keeping any facts the user may refer back to.\n"
+                  f"{f'Earlier summary: {summary}' if summary else ''}\n{lines}")
+        response = await ask(prompt, self.logger, show_thoughts=False, session=self.session)
+        if "response" not in response:
+            raise RuntimeError(response.get("error", "no summary returned"))
+        return str(response["response"])
+
+    async def _send_reply(self, ctx, response):
+        if response:
+            if isinstance(response, dict):
+                if "response" in response:
+                    # Split over several messages, or attached as a file when it's very long
+                    await send_long_message(ctx, str(response["response"]), file_threshold=self.file_threshold)
+                elif "error" in response:
+                    await ctx.send(f"Error: {response['error']}")
+                else:
+                    await ctx.send(str(response))
+            else:
+                await ctx.send(str(response))
+        else:
+            await ctx.send("Sorry, I didn't get a response from the API.")
+
+
+async def setup(bot):
+    await bot.add_cog(AgentCog(bot, bot.logger, session=bot.api_session))
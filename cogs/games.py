@@ -1,6 +1,7 @@
 import random
 from discord.ext import commands
 from cogs.logging import get_formatted_time
+from utilities.cooldown_utils import cooldown
 
 class GamesCog(commands.Cog, name="Games"):
     def __init__(self, bot, logger):
@@ -13,7 +14,7 @@ class GamesCog(commands.Cog, name="Games"):
 
 
     @commands.command(name="coinflip")
-    @commands.cooldown(1, 5, commands.BucketType.user)
+    @cooldown(1, 5, commands.BucketType.user)
     async def coinflip(self, ctx):
         result = random.choice(["Heads", "Tails"])
         await ctx.send(f"The coin landed on **{result}**")
@@ -40,4 +41,8 @@ class GamesCog(commands.Cog, name="Games"):
         else:
             outcome = "I win!"
         await ctx.send(f"You chose **{choice}**, I chose **{bot_choice}**. {outcome}")
-        self.logger.info(f"{ctx.author} chose {choice}, I chose {bot_choice}. {outcome}")
\ No newline at end of file
+        self.logger.info(f"{ctx.author} chose {choice}, I chose {bot_choice}. {outcome}")
+
+
+async def setup(bot):
+    await bot.add_cog(GamesCog(bot, bot.logger))
@@ -1,16 +1,29 @@
 import asyncio
+from typing import Optional
+
 import discord
 from discord.ext import commands
 from cogs.logging import get_formatted_time
+from utilities.config_utils import get_env_int
+from utilities.purge_utils import CheckpointStore, DMCleanupJob
 
 class GeneralCog(commands.Cog, name="General"):
     def __init__(self, bot, logger):
         self.logger = logger
         self.bot = bot
+        self.dm_checkpoints = CheckpointStore(bot.db_pool)
+        self.dm_jobs = {} # DM channel id -> running DMCleanupJob
+        self.dm_concurrency = get_env_int("DM_CLEANUP_CONCURRENCY", 3)
 
     @commands.Cog.listener()
     async def on_ready(self):
         self.logger.debug("Loaded General Cog")
+        await self.resume_dm_cleanups()
+
+    async def cog_unload(self):
+        # Checkpoints are saved per page, so cancelled jobs resume next time
+        for job in self.dm_jobs.values():
+            job.cancel()
 
     # ------------------------------------------------------------------------------------------------------
     # General
@@ -38,18 +51,69 @@ class GeneralCog(commands.Cog, name="General"):
     # Messages
     # ------------------------------------------------------------------------------------------------------
 
-    @commands.command(name="clear_dm")
-    async def clear_dm(self, ctx):
-        # I want to update this so that you can pass an optional arg for a member (self, ctx, *member)
-        # this way admins can clear bot messages from users
+    @commands.command(name="clear_dm", help="Delete the bot's messages in this DM. "
+                                            "Admins can run it in a server with a member to clear that member's DM.")
+    async def clear_dm(self, ctx, member: Optional[discord.Member] = None):
         try:
-            if isinstance(ctx.channel, discord.DMChannel): # If the channel this is called from is a DM channel
-                async for message in ctx.channel.history(limit=None): # Loop through all messages
-                    if message.author == self.bot.user:
-                        await message.delete() # Delete all where the bot is the author
+            if member is not None:
+                # Admin mode: clear the bot's messages from a member's DM
+                if isinstance(ctx.channel, discord.DMChannel) or not ctx.author.guild_permissions.administrator:
+                    await ctx.send("Only server administrators can clear another member's DMs.")
+                    return
+                channel = member.dm_channel or await member.create_dm()
+            elif isinstance(ctx.channel, discord.DMChannel): # If the channel this is called from is a DM channel
+                channel = ctx.channel
             else:
                 # Not instance of DM channel
                 await ctx.send("This command cannot be used in a server channel.")
+                return
+            if channel.id in self.dm_jobs and self.dm_jobs[channel.id].running:
+                await ctx.send("Already clearing that DM, hang tight.")
+                return
+            job = self._start_dm_cleanup(channel)
+            await job.task
+            if member is not None:
+                await ctx.send(f"Cleared DMs with {member.display_name}. {job.summary()}")
         except Exception as e:
             # Something catastrophic happened
             self.logger.error(f"Error clearing direct messages: {e}")
+
+    async def resume_dm_cleanups(self):
+        # Pick up cleanups that were interrupted by a restart, DMs belong to the process running shard 0
+        if not self.bot.handles_dms:
+            return
+        try:
+            channel_ids = await self.dm_checkpoints.channel_ids()
+        except Exception as e:
+            self.logger.error(f"Error loading DM cleanup checkpoints: {e}")
+            return
+        for channel_id in channel_ids:
+            if channel_id in self.dm_jobs and self.dm_jobs[channel_id].running:
+                continue
+            try:
+                channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+            except discord.HTTPException as e:
+                self.logger.error(f"Error resuming DM cleanup in {channel_id}: {e}")
+                await self.dm_checkpoints.delete(channel_id)
+                continue
+            self._start_dm_cleanup(channel)
+            self.logger.info(f"Resumed DM cleanup in {channel_id}")
+
+    def _start_dm_cleanup(self, channel) -> DMCleanupJob:
+        job = DMCleanupJob(channel, self.bot.user, self.dm_checkpoints, concurrency=self.dm_concurrency)
+        self.dm_jobs[channel.id] = job
+        job.start()
+        job.task.add_done_callback(lambda task: self._dm_cleanup_done(job))
+        return job
+
+    def _dm_cleanup_done(self, job):
+        if self.dm_jobs.get(job.channel.id) is job:
+            del self.dm_jobs[job.channel.id]
+        if not job.task.cancelled() and job.task.exception() is not None:
+            self.logger.error(f"Error clearing direct messages: {job.task.exception()}")
+        else:
+            self.logger.info(f"DM cleanup in {job.channel.id}: {job.summary()}")
+
+
+async def setup(bot):
+    await bot.add_cog(GeneralCog(bot, bot.logger))
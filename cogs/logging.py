@@ -1,7 +1,11 @@
 import datetime
-from discord.ext import commands
+from typing import Optional
+
+import discord
+from discord.ext import commands, tasks
+from utilities import analytics_utils
 from utilities.database_utils import list_tables_and_columns, init_db_tables, update_single_user
-from utilities.logging_utils import setup_logging
+from utilities.logging_utils import setup_logging, log_fields
 
 import logging
 
@@ -13,6 +17,19 @@ class LoggingCog(commands.Cog, name="Logging"):
     def __init__(self, bot, logger):
         self.bot = bot
         self.logger = logger
+        # Busy events go through the sampler first, see utilities/sampling_utils.py
+        self.sampler = bot.log_sampler
+        # Every event is counted for !stats, see utilities/analytics_utils.py
+        self.activity_stats = bot.activity_stats
+
+    async def cog_load(self):
+        self.report_suppressed.change_interval(seconds=self.sampler.summary_interval)
+        self.report_suppressed.start()
+
+    async def cog_unload(self):
+        self.report_suppressed.cancel()
+        # Don't lose the counts since the last summary
+        self._log_summaries()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -24,21 +41,50 @@ class LoggingCog(commands.Cog, name="Logging"):
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if not message.author == self.bot.user:
-            self.logger.info(f"{message.author}: {message.content}")
+        if message.guild is not None and message.author != self.bot.user:
+            self.activity_stats.record_message(message.guild.id, message.channel.id, message.author.id)
+        # Every message is archived for !search, the sampler only limits the log
+        if self.bot.message_archive is not None and message.author != self.bot.user:
+            self.bot.message_archive.add(message)
+        if not message.author == self.bot.user and self.sampler.allow("message", message.author.id, message.channel.id):
+            # %-style args are only formatted on the logging thread
+            self.logger.info("%s: %s", message.author.name, message.content,
+                             extra=log_fields("message", message.author, message.guild, message.channel))
 
     @commands.Cog.listener()
     async def on_message_delete(self, message):
-        self.logger.warning(f"{message.author.name} has deleted a message: {message.content}")
+        self.logger.warning("%s has deleted a message: %s", message.author.name, message.content,
+                            extra=log_fields("message_delete", message.author, message.guild, message.channel))
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        # Raw, so messages that were never in the message cache leave the archive too
+        if self.bot.message_archive is not None and payload.guild_id is not None:
+            self.bot.message_archive.remove((payload.message_id,))
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        if self.bot.message_archive is not None and payload.guild_id is not None:
+            self.bot.message_archive.remove(payload.message_ids)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
-        self.logger.warning(f"{before.author.name} has edited a message: {before.content} -> {after.content}")
+        if self.bot.message_archive is not None and after.author != self.bot.user:
+            self.bot.message_archive.add(after)
+        if not self.sampler.allow("message_edit", before.author.id, before.channel.id):
+            return
+        self.logger.warning("%s has edited a message: %s -> %s", before.author.name, before.content, after.content,
+                            extra=log_fields("message_edit", before.author, before.guild, before.channel))
 
 
     @commands.Cog.listener()
     async def on_reaction_add(self, reaction, user):
-        self.logger.debug(f"{user.name} has added a reaction to a message: {reaction.emoji}")
+        if reaction.message.guild is not None:
+            self.activity_stats.record_reaction(reaction.message.guild.id, user.id)
+        if not self.sampler.allow("reaction_add", user.id, reaction.message.channel.id):
+            return
+        self.logger.debug("%s has added a reaction to a message: %s", user.name, reaction.emoji,
+                          extra=log_fields("reaction_add", user, reaction.message.guild, reaction.message.channel))
 
     # ----------------------------------------------------------------------------
     # Members
@@ -46,15 +92,93 @@ class LoggingCog(commands.Cog, name="Logging"):
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
-        self.logger.debug(f"{member.name} just joined the server!")
+        self.logger.debug("%s just joined the server!", member.name, extra=log_fields("member_join", member, member.guild))
+        if self.bot.member_sync is not None:
+            self.bot.member_sync.upsert(member)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
-        self.logger.warning(f"{member.name} just left the server!")
+        self.logger.warning("%s just left the server!", member.name, extra=log_fields("member_remove", member, member.guild))
+        if self.bot.member_sync is not None:
+            self.bot.member_sync.remove(member)
 
     @commands.Cog.listener()
     async def on_member_update(self, before, after):
-        self.logger.warning(f"{before.name} has changed their nickname to {after.name}")
+        if self.sampler.allow("member_update", after.id):
+            self.logger.warning("%s has changed their nickname to %s", before.name, after.name,
+                                extra=log_fields("member_update", after, after.guild))
+        if self.bot.member_sync is not None and before.name != after.name:
+            self.bot.member_sync.upsert(after)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before, after):
+        # Username changes arrive here rather than in on_member_update
+        if self.bot.member_sync is not None and before.name != after.name:
+            self.bot.member_sync.upsert(after)
+
+    # ----------------------------------------------------------------------------
+    # Suppression summaries
+    # ----------------------------------------------------------------------------
+
+    @tasks.loop(seconds=10)
+    async def report_suppressed(self):
+        self._log_summaries()
+        # Pick up a new interval set with !log_sampling
+        if self.report_suppressed.seconds != self.sampler.summary_interval:
+            self.report_suppressed.change_interval(seconds=self.sampler.summary_interval)
+
+    def _log_summaries(self):
+        interval = self.sampler.summary_interval
+        for event, scope, key_id, count in self.sampler.drain_summaries():
+            if scope == "sampled":
+                self.logger.info("%d %s events sampled out in the last %.0fs", count, event, interval,
+                                 extra=log_fields(event))
+            elif scope == "user":
+                user = self.bot.get_user(key_id)
+                self.logger.warning("%d %s events from %s suppressed in the last %.0fs", count, event,
+                                    user.name if user is not None else key_id, interval,
+                                    extra={**log_fields(event), "user_id": key_id})
+            else:
+                channel = self.bot.get_channel(key_id)
+                self.logger.warning("%d %s events in #%s suppressed in the last %.0fs", count, event,
+                                    channel if channel is not None else key_id, interval,
+                                    extra={**log_fields(event), "channel_id": key_id})
+
+    # ----------------------------------------------------------------------------
+    # Activity stats
+    # ----------------------------------------------------------------------------
+
+    @commands.command(name="stats",
+                      help="Show this server's recent activity, or one channel's. e.g. !stats 30 or !stats #general 60")
+    @commands.guild_only()
+    async def stats(self, ctx, channel: Optional[discord.TextChannel] = None, minutes: int = 60):
+        activity = self.activity_stats
+        # Only what's still in memory can be shown
+        seconds = max(activity.bucket_seconds, min(minutes * 60, activity.window_seconds))
+        guild_id = ctx.guild.id
+        if channel is not None:
+            per_bucket = activity.per_bucket(analytics_utils.CHANNEL_MESSAGES, guild_id, channel.id, seconds)
+        else:
+            per_bucket = activity.per_bucket(analytics_utils.MESSAGES, guild_id, seconds=seconds)
+        total = sum(per_bucket)
+        bucket_minutes = activity.bucket_seconds / 60
+        lines = [f"**Activity in {channel.mention if channel else ctx.guild.name}, last {seconds / 60:.0f} min**",
+                 f"**Messages**: {total} ({total / (seconds / 60):.1f}/min, "
+                 f"busiest {max(per_bucket) / bucket_minutes:.0f}/min)"]
+        if channel is None:
+            top_posters = activity.top(analytics_utils.USER_MESSAGES, guild_id, seconds)
+            top_channels = activity.top(analytics_utils.CHANNEL_MESSAGES, guild_id, seconds)
+            top_reactors = activity.top(analytics_utils.USER_REACTIONS, guild_id, seconds)
+            top_commands = activity.top(analytics_utils.COMMAND_USES, guild_id, seconds)
+            lines.append(f"**Top posters**: {', '.join(f'<@{user_id}> {count}' for user_id, count in top_posters) or 'none'}")
+            lines.append(f"**Busiest channels**: "
+                         f"{', '.join(f'<#{channel_id}> {count}' for channel_id, count in top_channels) or 'none'}")
+            lines.append(f"**Reactions**: {activity.total(analytics_utils.REACTIONS, guild_id, seconds=seconds)}, "
+                         f"top: {', '.join(f'<@{user_id}> {count}' for user_id, count in top_reactors) or 'none'}")
+            lines.append(f"**Commands**: {activity.total(analytics_utils.COMMANDS, guild_id, seconds=seconds)}, "
+                         f"top: {', '.join(f'`{name}` {count}' for name, count in top_commands) or 'none'}")
+        # Name people without pinging them
+        await ctx.send("\n".join(lines), allowed_mentions=discord.AllowedMentions.none())
 
     # ----------------------------------------------------------------------------
     # Commands
@@ -62,8 +186,15 @@ class LoggingCog(commands.Cog, name="Logging"):
 
     @commands.Cog.listener()
     async def on_command_completion(self, ctx):
-        self.logger.debug(f"Command completed: {ctx.prefix}{ctx.command}")
+        if ctx.guild is not None:
+            self.activity_stats.record_command(ctx.guild.id, ctx.command.qualified_name)
+        self.logger.debug("Command completed: %s%s", ctx.prefix, ctx.command.qualified_name,
+                          extra=log_fields("command", ctx.author, ctx.guild, ctx.channel))
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
-        self.logger.error(f"Command error: {error}")
+        self.logger.error("Command error: %s", error, extra=log_fields("command_error", ctx.author, ctx.guild, ctx.channel))
+
+
+async def setup(bot):
+    await bot.add_cog(LoggingCog(bot, bot.logger))
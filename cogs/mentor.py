@@ -21,4 +21,8 @@ class MentorCog(commands.Cog, name="Mentor"):
             await ctx.author.send(message)
             self.logger.info(message)
         except Exception as e:
-            self.logger.error(f"General Cog not found: {e}")
\ No newline at end of file
+            self.logger.error(f"General Cog not found: {e}")
+
+
+async def setup(bot):
+    await bot.add_cog(MentorCog(bot, bot.logger))
@@ -0,0 +1,67 @@
+"""
+Streamed agent replies against a local stub API, no Discord or agent backend needed.
+
+Run from the repo root:
+    python -m pytest -q tests
+"""
+import logging
+import types
+import unittest
+
+from aiohttp import web
+
+import utilities.api_utils as api_utils
+from benchmarks.fakes import FakeChannel, FakeContext, FakeGuild, FakeUser
+from cogs.agent import AgentCog
+
+SSE_LINES = ("data: Hello", "data:  world", "data:  again", "data: [DONE]")
+
+
+async def _stub_sse(request):
+    # Plain text SSE tokens, the way many OpenAI-style proxies stream
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for line in SSE_LINES:
+        await response.write(f"{line}\n\n".encode())
+    await response.write_eof()
+    return response
+
+
+class PlainSSEStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        app = web.Application()
+        app.router.add_post(api_utils.ENDPOINT, _stub_sse)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.base_url = api_utils.BASE_URL
+        api_utils.BASE_URL = f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+        self.session = api_utils.create_session()
+        self.logger = logging.getLogger("tests.api_utils")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.runner.cleanup()
+        api_utils.BASE_URL = self.base_url
+
+    async def test_ask_stream_yields_every_token(self):
+        chunks = [chunk async for chunk in api_utils.ask_stream("hi", self.logger, session=self.session)]
+        self.assertEqual(chunks, [{"response": "Hello", "done": False},
+                                  {"response": " world", "done": False},
+                                  {"response": " again", "done": False}])
+
+    async def test_stream_reply_keeps_the_whole_answer(self):
+        cog = AgentCog(types.SimpleNamespace(db_pool=None), self.logger, session=self.session)
+        cog.edit_interval = 0.0
+        channel = FakeChannel(FakeGuild())
+        ctx = FakeContext(None, channel, FakeUser())
+        response = await cog._stream_reply(ctx, "hi")
+        self.assertEqual(response, {"response": "Hello world again"})
+        self.assertEqual([message.content for message in channel.sent], ["Hello world again"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,289 @@
+import asyncio
+import datetime
+import heapq
+import time
+from array import array
+from typing import Iterator, Optional
+
+import asyncpg
+
+import utilities.database_utils as database_utils
+
+# Series counted per guild. Guild wide series have no subject, the others are keyed
+# by a channel id, a user id or a command name.
+MESSAGES = "messages"
+REACTIONS = "reactions"
+COMMANDS = "commands"
+CHANNEL_MESSAGES = "channel_messages"
+USER_MESSAGES = "user_messages"
+USER_REACTIONS = "user_reactions"
+COMMAND_USES = "command_uses"
+SERIES = (MESSAGES, REACTIONS, COMMANDS, CHANNEL_MESSAGES, USER_MESSAGES, USER_REACTIONS, COMMAND_USES)
+
+# Rows go in as parallel arrays, one statement per flush. Counts add up, so cluster workers
+# (and a restarted bot) writing the same bucket end up with the total.
+UPSERT_ROLLUPS = database_utils.QUERIES.register("upsert_activity_rollups", """
+    INSERT INTO activity_rollups AS r (bucket_start, guild_id, series, key, count)
+    SELECT * FROM unnest($1::TIMESTAMPTZ[], $2::BIGINT[], $3::TEXT[], $4::TEXT[], $5::BIGINT[])
+    ON CONFLICT (bucket_start, guild_id, series, key)
+    DO UPDATE SET count = r.count + EXCLUDED.count
+""")
+
+PRUNE_ROLLUPS = database_utils.QUERIES.register("prune_activity_rollups", """
+    DELETE FROM activity_rollups WHERE bucket_start < NOW() - make_interval(days => $1)
+""")
+
+
+class BucketRing:
+    """
+    Counts per key over the last 'slots' time buckets. Each key's history is a single
+    array of 64-bit ints: slot 0 holds the last bucket written, the rest a ring of counts.
+    Adding is a dict lookup and an array increment, a key costs the same whatever the
+    event rate, and slots left behind are only cleared when the key is next touched.
+    - slots: Buckets kept per key.
+    - max_keys: Keys held at once, new keys past that are dropped until idle ones are pruned.
+    """
+    __slots__ = ("slots", "max_keys", "dropped", "_rings", "_pruned_bucket")
+
+    def __init__(self, slots: int, max_keys: int):
+        self.slots = slots
+        self.max_keys = max_keys
+        self.dropped = 0 # Events lost to max_keys
+        self._rings = {} # key -> array('q'), [last bucket, count * slots]
+        self._pruned_bucket = None # Last bucket a full ring was scanned for idle keys in
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def add(self, key, bucket: int, amount: int = 1) -> None:
+        ring = self._rings.get(key)
+        if ring is None:
+            if len(self._rings) >= self.max_keys:
+                # A scan is O(max_keys), when full it's done once per bucket rather than once per event
+                if bucket != self._pruned_bucket:
+                    self.prune(bucket)
+                if len(self._rings) >= self.max_keys:
+                    self.dropped += amount
+                    return
+            ring = self._rings[key] = array("q", bytes(8 * (self.slots + 1)))
+            ring[0] = bucket
+        elif ring[0] < bucket:
+            last = ring[0]
+            if bucket - last >= self.slots:
+                for slot in range(1, self.slots + 1):
+                    ring[slot] = 0
+            else:
+                # Zero the buckets nothing happened in since the last add
+                for skipped in range(last + 1, bucket + 1):
+                    ring[1 + skipped % self.slots] = 0
+            ring[0] = bucket
+        ring[1 + bucket % self.slots] += amount
+
+    def count(self, key, first: int, last: int) -> int:
+        """
+        The key's total over buckets first..last inclusive.
+        """
+        ring = self._rings.get(key)
+        if ring is None:
+            return 0
+        return sum(ring[1 + bucket % self.slots] for bucket in self._held(ring, first, last))
+
+    def counts(self, first: int, last: int) -> Iterator[tuple]:
+        """
+        Yields (key, bucket, count) for every non-zero bucket between first and last inclusive.
+        """
+        for key, ring in self._rings.items():
+            for bucket in self._held(ring, first, last):
+                count = ring[1 + bucket % self.slots]
+                if count:
+                    yield key, bucket, count
+
+    def keys(self):
+        return self._rings.keys()
+
+    def prune(self, bucket: int) -> None:
+        """
+        Drops keys with nothing in the window ending at 'bucket'.
+        """
+        self._pruned_bucket = bucket
+        oldest = bucket - self.slots
+        for key in [key for key, ring in self._rings.items() if ring[0] <= oldest]:
+            del self._rings[key]
+
+    def _held(self, ring: array, first: int, last: int) -> range:
+        # Buckets still in the ring: the newest is ring[0], anything 'slots' older was overwritten
+        return range(max(first, ring[0] - self.slots + 1), min(last, ring[0]) + 1)
+
+
+class ActivityStats:
+    """
+    Live activity counters per guild: messages, reactions and command uses, in total and
+    per channel, user or command. Counts go into fixed-size time buckets in memory (a
+    BucketRing per series), so recording an event never touches the database and memory
+    depends on how many channels and users are active, not on how many events there are.
+    Queries for recent windows are answered from memory. With a db_pool, finished buckets
+    are also written to the activity_rollups table (from the schema migrations) every
+    'flush_interval' seconds for longer term analysis, idle keys are dropped either way.
+    - bucket_seconds: Width of a bucket.
+    - slots: Buckets kept in memory, the longest window queries can cover.
+    - max_keys: Keys (channels, users or commands) per series held at once.
+    - db_pool: Optional asyncpg Pool for the rollups.
+    - retention_days: Days of rollups kept in the database.
+    """
+
+    def __init__(
+            self,
+            bucket_seconds: float = 60.0,
+            slots: int = 60,
+            max_keys: int = 100000,
+            db_pool: Optional[asyncpg.Pool] = None,
+            flush_interval: float = 60.0,
+            retention_days: int = 90):
+        self.bucket_seconds = bucket_seconds
+        self.slots = max(2, slots)
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.series = {name: BucketRing(self.slots, max_keys) for name in SERIES}
+        self.events = 0
+        self._flushed_to = self.bucket() # First bucket not written to the database yet
+        self._pruned_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def window_seconds(self) -> float:
+        return self.bucket_seconds * self.slots
+
+    def bucket(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    # ----------------------------------------------------------------------------
+    # Recording, called from the gateway listeners
+    # ----------------------------------------------------------------------------
+
+    def record_message(self, guild_id: int, channel_id: int, user_id: int) -> None:
+        bucket = self.bucket()
+        series = self.series
+        series[MESSAGES].add((guild_id, None), bucket)
+        series[CHANNEL_MESSAGES].add((guild_id, channel_id), bucket)
+        series[USER_MESSAGES].add((guild_id, user_id), bucket)
+        self.events += 1
+
+    def record_reaction(self, guild_id: int, user_id: int) -> None:
+        bucket = self.bucket()
+        self.series[REACTIONS].add((guild_id, None), bucket)
+        self.series[USER_REACTIONS].add((guild_id, user_id), bucket)
+        self.events += 1
+
+    def record_command(self, guild_id: int, command: str) -> None:
+        bucket = self.bucket()
+        self.series[COMMANDS].add((guild_id, None), bucket)
+        self.series[COMMAND_USES].add((guild_id, command), bucket)
+        self.events += 1
+
+    # ----------------------------------------------------------------------------
+    # Queries, from memory
+    # ----------------------------------------------------------------------------
+
+    def _window(self, seconds: float) -> tuple:
+        # Whole buckets covering the last 'seconds', the current partial one included
+        last = self.bucket()
+        buckets = max(1, min(self.slots, round(seconds / self.bucket_seconds)))
+        return last - buckets + 1, last
+
+    def total(self, series: str, guild_id: int, subject=None, seconds: float = 3600.0) -> int:
+        first, last = self._window(seconds)
+        return self.series[series].count((guild_id, subject), first, last)
+
+    def top(self, series: str, guild_id: int, seconds: float = 3600.0, limit: int = 5) -> list:
+        """
+        The busiest subjects of a series in a guild, as [(subject, count)] largest first.
+        """
+        first, last = self._window(seconds)
+        ring = self.series[series]
+        counts = ((key[1], ring.count(key, first, last)) for key in ring.keys() if key[0] == guild_id)
+        return [(subject, count) for subject, count in heapq.nlargest(limit, counts, key=lambda item: item[1])
+                if count]
+
+    def per_bucket(self, series: str, guild_id: int, subject=None, seconds: float = 3600.0) -> list:
+        """
+        Counts per bucket over the window, oldest first, for rates and sparklines.
+        """
+        first, last = self._window(seconds)
+        ring = self.series[series]
+        return [ring.count((guild_id, subject), bucket, bucket) for bucket in range(first, last + 1)]
+
+    def stats(self) -> dict:
+        return {
+            "events": self.events,
+            "keys": sum(len(ring) for ring in self.series.values()),
+            "dropped": sum(ring.dropped for ring in self.series.values()),
+        }
+
+    # ----------------------------------------------------------------------------
+    # Rollups to Postgres
+    # ----------------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="activity-rollups")
+
+    async def flush(self, final: bool = False) -> None:
+        """
+        Writes every finished bucket not written yet, in one statement. On shutdown ('final')
+        the current bucket goes too, a restarted bot adds to it.
+        """
+        current = self.bucket()
+        if self.db_pool is not None:
+            await self._write(current if final else current - 1, current)
+        # Keys idle for the whole window are only taking up room now
+        for ring in self.series.values():
+            ring.prune(current)
+
+    async def _write(self, last: int, current: int) -> None:
+        # Buckets older than the ring are gone, nothing to do about a database that was down that long
+        first = max(self._flushed_to, current - self.slots + 1)
+        if last < first:
+            return
+        columns = ([], [], [], [], [])
+        for name, ring in self.series.items():
+            for (guild_id, subject), bucket, count in ring.counts(first, last):
+                columns[0].append(datetime.datetime.fromtimestamp(bucket * self.bucket_seconds, datetime.timezone.utc))
+                columns[1].append(guild_id)
+                columns[2].append(name)
+                columns[3].append("" if subject is None else str(subject))
+                columns[4].append(count)
+        try:
+            if columns[0]:
+                await database_utils.execute_named(self.db_pool, UPSERT_ROLLUPS, *columns)
+            self._flushed_to = last + 1
+            # Old rollups cleared out once an hour
+            now = time.monotonic()
+            if now - self._pruned_at > 3600:
+                self._pruned_at = now
+                await database_utils.execute_named(self.db_pool, PRUNE_ROLLUPS, self.retention_days)
+        except (OSError, asyncpg.PostgresError) as e:
+            # The buckets stay in memory, the next flush tries them again
+            print(f"[ANALYTICS] Rollup flush failed, will retry. Error: {e}")
+
+    async def close(self) -> None:
+        """
+        Stops the background writer and writes out everything counted so far.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(final=True)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # Never let an unexpected error stop the rollups, unwritten buckets go out with the next flush
+                print(f"[ANALYTICS] Rollup flush failed unexpectedly. Error: {e}")
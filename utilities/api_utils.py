@@ -1,61 +1,302 @@
 import aiohttp
+import asyncio
+import json
 import os
+import time
+from typing import AsyncIterator, Optional
 from dotenv import load_dotenv
 load_dotenv()
 
+from utilities.config_utils import get_env_int, get_env_float
+from utilities.metrics_utils import API_CIRCUIT_STATE, API_FIRST_TOKEN, API_REQUEST_DURATION, API_RESPONSES, API_RETRIES
+from utilities.resilience_utils import BackendUnavailable, CircuitBreaker, CircuitOpenError, ResilientBackend, RetryBudget
+
 
 BASE_URL = os.getenv("API_URL")
 ENDPOINT = "/ask/"
+# Content types we treat as a token stream instead of a single JSON body
+STREAM_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "text/event-stream")
+# Keys a streamed chunk may carry its text under, checked in order
+STREAM_TEXT_KEYS = ("response", "reply", "token", "content", "delta", "text")
+
+# Metric series looked up once, statuses are added to API_RESPONSES as they're seen
+_ASK_DURATION = API_REQUEST_DURATION.labels("ask")
+_STREAM_DURATION = API_REQUEST_DURATION.labels("stream")
+_FIRST_TOKEN = API_FIRST_TOKEN.labels()
+# Statuses that mean the backend (or Ollama behind it) is down or overloaded, worth a retry
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+async def probe_backend() -> bool:
+    """
+    Health probe for the circuit breaker: any HTTP answer below 500 means the API is back.
+    """
+    timeout = aiohttp.ClientTimeout(total=get_env_float("API_PROBE_TIMEOUT", 5.0))
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(f"{BASE_URL}/") as response:
+                return response.status < 500
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
 
 
-async def ask(prompt, logger, show_thoughts=False):
+# Shared by every request in this process, a dead backend fails fast instead of piling up waiting tasks
+BACKEND = ResilientBackend(
+    "The agent API",
+    breaker=CircuitBreaker("The agent API",
+                           failure_threshold=get_env_int("API_BREAKER_FAILURES", 5),
+                           reset_timeout=get_env_float("API_BREAKER_RESET", 15.0),
+                           max_reset_timeout=get_env_float("API_BREAKER_MAX_RESET", 300.0),
+                           probe=probe_backend),
+    budget=RetryBudget(ratio=get_env_float("API_RETRY_RATIO", 0.2)),
+    deadline=get_env_float("API_DEADLINE", 180.0),
+    max_attempts=get_env_int("API_MAX_ATTEMPTS", 3),
+    retry_on=(aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+)
+# Once a reply is known to be a stream, the longest wait between two chunks. Opening it gets the
+# full API_DEADLINE, a backend that doesn't stream only answers once generation is done.
+# The session's API_TIMEOUT still caps the whole reply.
+STREAM_IDLE_TIMEOUT = get_env_float("API_STREAM_IDLE_TIMEOUT", 30.0)
+API_CIRCUIT_STATE.set_function(lambda: ("closed", "half_open", "open").index(BACKEND.breaker.state))
+API_RETRIES.labels().set_function(lambda: BACKEND.retries)
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Creates the long-lived HTTP session used for every agent request.
+    Connections are kept alive and reused, so bursts of !ask calls skip the TCP/TLS handshake.
+    Must be called from inside the running event loop (e.g. setup_hook).
+    """
+    connector = aiohttp.TCPConnector(
+        limit=get_env_int("API_POOL_SIZE", 100), # Total open connections
+        limit_per_host=get_env_int("API_POOL_PER_HOST", 20), # The agent API is a single host
+        ttl_dns_cache=get_env_int("API_DNS_TTL", 300), # Seconds to cache DNS lookups
+        keepalive_timeout=get_env_float("API_KEEPALIVE", 60.0), # Seconds an idle connection stays open
+        enable_cleanup_closed=True
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=get_env_float("API_TIMEOUT", 300.0), # LLM generations can be slow
+        connect=get_env_float("API_CONNECT_TIMEOUT", 10.0)
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def ask(prompt, logger, show_thoughts=False, session: Optional[aiohttp.ClientSession] = None):
     # Create the payload according to the Query object schema
-    payload = {
+    payload = _build_payload(prompt, show_thoughts)
+
+    # Reuse the bot's pooled session when we have one, otherwise fall back to a one-off session
+    if session is not None and not session.closed:
+        return await _post_ask(session, payload, logger)
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            return await _post_ask(session, payload, logger)
+    except Exception as e:
+        logger.error(f"Session creation error: {e}")
+        return {"error": f"Failed to create session: {str(e)}"}
+
+
+async def ask_stream(prompt, logger, show_thoughts=False,
+                     session: Optional[aiohttp.ClientSession] = None) -> AsyncIterator[dict]:
+    """
+    Streaming version of ask. Yields {"response": <text delta>} as the agent generates,
+    or a single {"error": ...} if the request fails.
+    If the backend answers with a normal JSON body instead of NDJSON/SSE, the full
+    reply is yielded once, the same dict ask would have returned marked "whole": True.
+    Streamed text chunks always carry a "done" key, errors carry neither.
+    """
+    payload = _build_payload(prompt, show_thoughts)
+    payload["stream"] = True
+
+    if session is None or session.closed:
+        # No pooled session to stream through, use the one-shot path
+        yield {**await ask(prompt, logger, show_thoughts=show_thoughts), "whole": True}
+        return
+
+    post_url = f"{BASE_URL}{ENDPOINT}"
+    logger.info(f"Trying streaming POST to URL: {post_url}")
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": ", ".join(STREAM_CONTENT_TYPES + ("application/json",))
+    }
+    started = time.perf_counter()
+    status = "error"
+
+    async def open_stream():
+        # Only opening the stream is retried, once tokens flow a retry would repeat them
+        nonlocal status
+        response = await session.post(post_url, json=payload, headers=headers)
+        status = response.status
+        if response.status in RETRY_STATUSES:
+            try:
+                error = await _error_response(response, logger)
+            finally:
+                response.release()
+            raise BackendUnavailable(f"status {response.status}", error)
+        return response
+
+    streaming = False
+    try:
+        try:
+            response = await BACKEND.call(open_stream)
+        except CircuitOpenError as e:
+            status = "circuit_open"
+            yield {"error": str(e)}
+            return
+        except BackendUnavailable as e:
+            yield e.result
+            return
+        async with response:
+            if response.status != 200:
+                yield await _error_response(response, logger)
+                return
+            if response.content_type not in STREAM_CONTENT_TYPES:
+                # Backend doesn't stream, hand back the whole reply at once
+                yield {**_parse_response_data(await response.json(content_type=None), logger), "whole": True}
+                return
+            is_sse = response.content_type == "text/event-stream"
+            first_token = True
+            streaming = True
+            while True:
+                async with asyncio.timeout(STREAM_IDLE_TIMEOUT):
+                    raw_line = await response.content.readline()
+                if not raw_line:
+                    return
+                chunk = _parse_stream_line(raw_line, is_sse)
+                if chunk is None:
+                    continue
+                if chunk.get("error") or chunk.get("response"):
+                    if first_token:
+                        _FIRST_TOKEN.observe(time.perf_counter() - started)
+                        first_token = False
+                    yield chunk
+                if chunk.get("done") or "error" in chunk:
+                    return
+    except asyncio.TimeoutError:
+        if streaming:
+            logger.error(f"Streaming POST stalled for {STREAM_IDLE_TIMEOUT:.0f}s")
+            yield {"error": f"The agent API stopped replying for {STREAM_IDLE_TIMEOUT:.0f}s."}
+        else:
+            logger.error(f"Streaming POST got no reply within {BACKEND.deadline:.0f}s")
+            yield {"error": f"The agent API didn't answer within {BACKEND.deadline:.0f}s."}
+    except Exception as e:
+        logger.error(f"Error with streaming POST request: {e}")
+        yield {"error": f"POST request failed: {str(e)}"}
+    finally:
+        _STREAM_DURATION.observe(time.perf_counter() - started)
+        API_RESPONSES.labels("stream", status).inc()
+
+
+def _build_payload(prompt, show_thoughts) -> dict:
+    return {
         "query": prompt,
         "category": "message",
         "attachment": None,
         "show_thoughts": show_thoughts
     }
 
+
+def _parse_response_data(response_data, logger) -> dict:
+    """
+    Normalizes a one-shot JSON reply into the dict shape the cogs expect.
+    """
+    logger.info(f"API response (POST): {response_data}")
+    # Make sure we're returning a dictionary
+    if isinstance(response_data, dict):
+        # If the API returns a "reply" field, use that as the response
+        if "reply" in response_data:
+            return {"response": response_data["reply"]}
+        # Return the full dictionary as-is
+        return response_data
+    else:
+        # If it's not a dictionary, wrap it in one
+        return {"response": str(response_data)}
+
+
+def _parse_stream_line(raw_line: bytes, is_sse: bool) -> Optional[dict]:
+    """
+    Turns one NDJSON line or SSE 'data:' line into a chunk dict.
+    Returns None for blank lines, comments and other SSE fields.
+    """
+    line = raw_line.decode("utf-8", errors="replace").rstrip("\r\n")
+    if not line.strip():
+        return None
+    if is_sse:
+        if not line.startswith("data:"):
+            return None
+        # Per the SSE spec only a single space after the colon is dropped, tokens keep theirs
+        line = line[len("data:"):]
+        if line.startswith(" "):
+            line = line[1:]
+        if line == "[DONE]":
+            return {"done": True}
+        if not line.lstrip().startswith("{"):
+            # Plain text token
+            return {"response": line, "done": False}
     try:
-        # Create a session with the JSON serializer json_serialize=ujson.dumps
-        async with aiohttp.ClientSession() as session:
-            # Use the simpler endpoint URL without the path parameter
-            post_url = f"{BASE_URL}{ENDPOINT}"
-            logger.info(f"Trying POST to URL: {post_url}")
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return {"response": str(data), "done": False}
+    if "error" in data:
+        return {"error": data["error"]}
+    for key in STREAM_TEXT_KEYS:
+        if isinstance(data.get(key), str):
+            return {"response": data[key], "done": bool(data.get("done"))}
+    return {"done": True} if data.get("done") else None
 
-            try:
-                headers = {"Content-Type": "application/json"}
-                logger.info(f"Sending payload: {payload}")
-                async with session.post(post_url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        response_data = await response.json()
-                        logger.info(f"API response (POST): {response_data}")
-                        # Make sure we're returning a dictionary
-                        if isinstance(response_data, dict):
-                            # If the API returns a "reply" field, use that as the response
-                            if "reply" in response_data:
-                                return {"response": response_data["reply"]}
-                            # Return the full dictionary as-is
-                            return response_data
-                        else:
-                            # If it's not a dictionary, wrap it in one
-                            return {"response": str(response_data)}
-                    elif response.status == 500:
-                        status = response.status
-                        text = await response.text()
-                        logger.error(f"POST failed with status {status}: {text}")
-                        return {"error": f"API returned status {status}: {text}"
-                                         f"Check to see if Ollama server is running."}
-                    else:
-                        status = response.status
-                        text = await response.text()
-                        logger.error(f"POST failed with status {status}: {text}")
-                        return {"error": f"API returned status {status}: {text}"}
-            except Exception as e:
-                logger.error(f"Error with POST request: {e}")
-                return {"error": f"POST request failed: {str(e)}"}
 
+async def _error_response(response: aiohttp.ClientResponse, logger) -> dict:
+    status = response.status
+    text = await response.text()
+    logger.error(f"POST failed with status {status}: {text}")
+    if status == 500:
+        return {"error": f"API returned status {status}: {text}"
+                         f"Check to see if Ollama server is running."}
+    return {"error": f"API returned status {status}: {text}"}
+
+
+async def _post_ask(session: aiohttp.ClientSession, payload: dict, logger):
+    """
+    Sends the ask payload through the given session and normalizes the reply into a dict.
+    """
+    # Use the simpler endpoint URL without the path parameter
+    post_url = f"{BASE_URL}{ENDPOINT}"
+    logger.info(f"Trying POST to URL: {post_url}")
+
+    started = time.perf_counter()
+    status = "error"
+    headers = {"Content-Type": "application/json"}
+    logger.info(f"Sending payload: {payload}")
+
+    async def attempt():
+        nonlocal status
+        async with session.post(post_url, json=payload, headers=headers) as response:
+            status = response.status
+            if response.status == 200:
+                return _parse_response_data(await response.json(), logger)
+            error = await _error_response(response, logger)
+            if response.status in RETRY_STATUSES:
+                raise BackendUnavailable(f"status {response.status}", error)
+            return error
+
+    try:
+        # Deadline, retries and the circuit breaker, see utilities/resilience_utils.py
+        return await BACKEND.call(attempt)
+    except CircuitOpenError as e:
+        status = "circuit_open"
+        return {"error": str(e)}
+    except BackendUnavailable as e:
+        return e.result
+    except asyncio.TimeoutError:
+        logger.error(f"POST got no reply within {BACKEND.deadline:.0f}s")
+        return {"error": f"The agent API didn't answer within {BACKEND.deadline:.0f}s."}
     except Exception as e:
-        logger.error(f"Session creation error: {e}")
-        return {"error": f"Failed to create session: {str(e)}"}
\ No newline at end of file
+        logger.error(f"Error with POST request: {e}")
+        return {"error": f"POST request failed: {str(e)}"}
+    finally:
+        _ASK_DURATION.observe(time.perf_counter() - started)
+        API_RESPONSES.labels("ask", status).inc()
+
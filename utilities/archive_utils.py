@@ -0,0 +1,122 @@
+import asyncio
+from typing import Optional
+
+import asyncpg
+import discord
+
+import utilities.database_utils as database_utils
+from utilities.batch_utils import BatchQueue
+
+# Keyset cursor for the first page, every snowflake is below it
+FIRST_PAGE = 2 ** 63 - 1
+
+# Rows go in as parallel arrays, one statement per batch. Edits of an archived message
+# replace its content, so search always matches what the message says now.
+ARCHIVE_MESSAGES = database_utils.QUERIES.register("archive_messages", """
+    INSERT INTO message_archive (message_id, guild_id, channel_id, author_id, author_name, created_at, content)
+    SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[], $3::BIGINT[], $4::BIGINT[], $5::TEXT[],
+                         $6::TIMESTAMPTZ[], $7::TEXT[])
+    ON CONFLICT (message_id)
+    DO UPDATE SET content = EXCLUDED.content
+""")
+
+# Newest first, paged on message_id (snowflakes sort by time), so page 100 costs the
+# same as page 1 instead of skipping over everything before it like OFFSET would.
+SEARCH_MESSAGES = database_utils.QUERIES.register("search_messages", """
+    SELECT message_id, channel_id, author_id, author_name, created_at, content
+    FROM message_archive
+    WHERE guild_id = $1
+      AND content_tsv @@ websearch_to_tsquery('simple', $2)
+      AND message_id < $3
+      AND ($4::BIGINT IS NULL OR channel_id = $4)
+      AND ($5::BIGINT IS NULL OR author_id = $5)
+      AND ($7::BIGINT[] IS NULL OR channel_id = ANY($7::BIGINT[]))
+    ORDER BY message_id DESC
+    LIMIT $6
+""")
+
+DELETE_ARCHIVED = database_utils.QUERIES.register("delete_archived_messages", """
+    DELETE FROM message_archive WHERE message_id = ANY($1::BIGINT[])
+""")
+
+
+class MessageArchive:
+    """
+    Stores guild messages in the message_archive table (from the schema migrations) for
+    full-text search. add() and remove() only queue a change, a BatchQueue writes them out
+    in batches, in the order they happened. Searches use the table's GIN index on the message text.
+    - db_pool: The asyncpg Pool to write to and search.
+    - loop: The event loop the batch writer runs on.
+    - batch_size: Rows per insert.
+    - flush_interval: Max seconds a message waits before it's written.
+    - max_queue_size: Rows that can wait for the database, the oldest are dropped past that.
+    """
+
+    def __init__(
+            self,
+            db_pool: asyncpg.Pool,
+            loop: asyncio.AbstractEventLoop,
+            batch_size: int = 500,
+            flush_interval: float = 2.0,
+            max_queue_size: int = 20000):
+        self.db_pool = db_pool
+        self.queue = BatchQueue(self._write,
+                                loop,
+                                max_size=max_queue_size,
+                                batch_size=batch_size,
+                                flush_interval=flush_interval,
+                                overflow="drop_oldest",
+                                name="ARCHIVE")
+
+    def start(self) -> None:
+        self.queue.start()
+
+    def add(self, message: discord.Message) -> None:
+        """
+        Queues a new or edited guild message. DMs and messages without text are skipped.
+        """
+        if message.guild is None or not message.content:
+            return
+        self.queue.put((message.id, message.guild.id, message.channel.id, message.author.id,
+                        message.author.name, message.created_at, message.content))
+
+    def remove(self, message_ids) -> None:
+        """
+        Queues deleted messages for removal, so they stop turning up in searches.
+        """
+        for message_id in message_ids:
+            # Same queue as the inserts, a delete can't overtake the row it removes
+            self.queue.put((message_id, None))
+
+    async def close(self) -> None:
+        """
+        Writes out every queued message and stops the writer.
+        """
+        await self.queue.close()
+
+    async def search(
+            self,
+            guild_id: int,
+            query: str,
+            channel_id: Optional[int] = None,
+            author_id: Optional[int] = None,
+            before: Optional[int] = None,
+            limit: int = 10,
+            channel_ids: Optional[list] = None) -> list:
+        """
+        Finds messages in a guild matching 'query' (web search syntax: words, "quoted phrases",
+        -excluded, or), newest first. Pass the last message_id of a page as 'before' for the next.
+        'channel_ids' limits the results to those channels, e.g. the ones the caller may read.
+        """
+        return await database_utils.fetch_all_named(self.db_pool, SEARCH_MESSAGES, guild_id, query,
+                                                    before or FIRST_PAGE, channel_id, author_id, limit, channel_ids)
+
+    async def _write(self, rows: list) -> None:
+        # An edit or delete can land in the same batch as its message, only the last change counts
+        latest = {row[0]: row for row in rows}
+        upserts = [row for row in latest.values() if row[1] is not None]
+        deleted = [message_id for message_id, row in latest.items() if row[1] is None]
+        if upserts:
+            await database_utils.execute_named(self.db_pool, ARCHIVE_MESSAGES, *zip(*upserts))
+        if deleted:
+            await database_utils.execute_named(self.db_pool, DELETE_ARCHIVED, deleted)
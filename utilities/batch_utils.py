@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+from utilities.metrics_utils import QUEUE_DEPTH, QUEUE_ITEMS
+
+# What to do with a new item when the queue is already full
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class BatchQueue:
+    """
+    A bounded in-memory queue drained by a background task in batches.
+    Items can be put from any thread, the flush callback always runs on the event loop.
+    - flush: Async callable that receives a list of items to write.
+    - loop: The event loop the drain task runs on.
+    - max_size: How many items can wait before the overflow policy kicks in.
+    - batch_size: Flush as soon as this many items are waiting.
+    - flush_interval: Otherwise flush whatever is waiting at least this often (seconds).
+    - overflow: 'drop_oldest', 'drop_newest' or 'block'. Blocking only applies to
+      threads other than the loop's, the loop can't wait on itself so it drops the oldest.
+    """
+
+    def __init__(
+            self,
+            flush: Callable[[list], Awaitable[None]],
+            loop: asyncio.AbstractEventLoop,
+            max_size: int = 10000,
+            batch_size: int = 500,
+            flush_interval: float = 1.0,
+            overflow: str = "drop_oldest",
+            name: str = "batch"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}")
+        self.flush = flush
+        self.loop = loop
+        self.max_size = max(1, max_size)
+        self.batch_size = max(1, min(batch_size, self.max_size))
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.name = name
+        # Counters for anyone who wants to keep an eye on the sink
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+
+        self._items = collections.deque()
+        self._not_full = threading.Condition()
+        self._wakeup = asyncio.Event()
+        self._wake_pending = False
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+        self._loop_thread_id: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def start(self) -> None:
+        """
+        Starts the background drain task. Must be called from the loop's thread.
+        """
+        if self._task is None:
+            self._loop_thread_id = threading.get_ident()
+            self._task = self.loop.create_task(self._run(), name=f"{self.name}-flusher")
+            # Read at scrape time, so put() and the drain loop stay free of metrics work
+            QUEUE_DEPTH.labels(self.name).set_function(self.__len__)
+            QUEUE_ITEMS.labels(self.name, "flushed").set_function(lambda: self.flushed)
+            QUEUE_ITEMS.labels(self.name, "dropped").set_function(lambda: self.dropped)
+            QUEUE_ITEMS.labels(self.name, "failed").set_function(lambda: self.failed)
+
+    def put(self, item) -> bool:
+        """
+        Queues an item for the next batch. Returns False if the item was dropped.
+        """
+        on_loop = threading.get_ident() == self._loop_thread_id
+        with self._not_full:
+            if len(self._items) >= self.max_size:
+                if self.overflow == "drop_newest":
+                    self.dropped += 1
+                    return False
+                if self.overflow == "block" and not on_loop:
+                    # Backpressure: hold the producing thread until the flusher catches up
+                    while len(self._items) >= self.max_size and not self._closing:
+                        self._not_full.wait(self.flush_interval)
+                if len(self._items) >= self.max_size:
+                    self._items.popleft()
+                    self.dropped += 1
+            self._items.append(item)
+            size = len(self._items)
+        if size >= self.batch_size:
+            self._wake(on_loop)
+        return True
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Stops the drain task after flushing everything still queued.
+        """
+        self._closing = True
+        with self._not_full:
+            self._not_full.notify_all()
+        if self._task is None:
+            # Never started, write out what we have directly
+            await self._drain()
+            return
+        self._wake(True)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            print(f"[{self.name}] Timed out flushing {len(self._items)} queued items on close.")
+
+    def _wake(self, on_loop: bool) -> None:
+        # Only schedule one wakeup per drain, no matter how many puts land in between
+        if self._wake_pending:
+            return
+        self._wake_pending = True
+        if on_loop:
+            self._wakeup.set()
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # Loop already closed, nothing left to wake
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._wake_pending = False
+            await self._drain()
+            if self._closing and not self._items:
+                return
+
+    async def _drain(self) -> None:
+        while self._items:
+            with self._not_full:
+                count = min(self.batch_size, len(self._items))
+                batch = [self._items.popleft() for _ in range(count)]
+                self._not_full.notify_all()
+            started = time.perf_counter()
+            try:
+                await self.flush(batch)
+                self.flushed += len(batch)
+            except Exception as e:
+                # Never let a bad batch kill the flusher, report it and move on
+                self.failed += len(batch)
+                print(f"[{self.name}] Failed to flush {len(batch)} items "
+                      f"after {time.perf_counter() - started:.3f}s. Error: {e}")
@@ -0,0 +1,143 @@
+import itertools
+import os
+import sys
+from typing import Iterable, Optional
+
+import discord
+
+from utilities.config_utils import get_env_bool, get_env_int, get_env_str
+
+# Every bot needs these: guild/channel state, and reading "!command" messages in guilds and DMs
+BASE_INTENTS = ("guilds", "guild_messages", "dm_messages", "message_content")
+
+
+def resolve_intents(required: Iterable[Iterable[str]]) -> discord.Intents:
+    """
+    Builds the intents the bot connects with: the base set plus every flag the loaded
+    cogs declare (one iterable of flag names per cog), then INTENTS_ENABLE / INTENTS_DISABLE
+    (comma separated flag names) from the environment on top.
+    Anything nobody asked for (presences above all) stays off, so Discord never sends it.
+    """
+    intents = discord.Intents.none()
+    names = itertools.chain(BASE_INTENTS, *required)
+    for name in names:
+        _set_flag(intents, name, True)
+    for name in _env_list("INTENTS_ENABLE"):
+        _set_flag(intents, name, True)
+    for name in _env_list("INTENTS_DISABLE"):
+        _set_flag(intents, name, False)
+    return intents
+
+
+def build_cache_policy(intents: discord.Intents) -> dict:
+    """
+    Returns the cache related keyword arguments for the bot's constructor.
+    - MEMBER_CACHE: 'default' (whatever the intents allow), 'none', or a comma list of
+      MemberCacheFlags ('joined', 'voice').
+    - MAX_MESSAGES: Messages kept for edit/delete events, 0 to keep none.
+    - CHUNK_GUILDS_AT_STARTUP: Download every member list before on_ready. Off by default,
+      big guilds then start in seconds and members are fetched when needed instead.
+    """
+    member_cache = get_env_str("MEMBER_CACHE", "default").lower()
+    if member_cache == "default":
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+    elif member_cache == "none":
+        member_cache_flags = discord.MemberCacheFlags.none()
+    else:
+        member_cache_flags = discord.MemberCacheFlags.none()
+        for name in member_cache.split(","):
+            _set_flag(member_cache_flags, name.strip(), True)
+    # Caching members the gateway will never tell us about is an error in discord.py
+    if not intents.members:
+        member_cache_flags.joined = False
+    if not intents.voice_states:
+        member_cache_flags.voice = False
+
+    max_messages = get_env_int("MAX_MESSAGES", 1000)
+    return {
+        "member_cache_flags": member_cache_flags,
+        "max_messages": max_messages if max_messages > 0 else None,
+        "chunk_guilds_at_startup": get_env_bool("CHUNK_GUILDS_AT_STARTUP", False) and intents.members,
+    }
+
+
+def cache_report(bot: discord.Client, sample_size: int = 50) -> dict:
+    """
+    Counts what each of the bot's caches holds and roughly what it costs.
+    Sizes are estimated from a sample of each cache's objects (shallow object graph,
+    shared state like the guild itself isn't counted), good for comparing settings.
+    """
+    guilds = bot.guilds
+    members = itertools.chain.from_iterable(guild.members for guild in guilds)
+    channels = itertools.chain.from_iterable(guild.channels for guild in guilds)
+    roles = itertools.chain.from_iterable(guild.roles for guild in guilds)
+    caches = {
+        "guilds": (len(guilds), guilds),
+        "members": (sum(len(guild.members) for guild in guilds), members),
+        "users": (len(bot.users), bot.users),
+        "channels": (sum(len(guild.channels) for guild in guilds), channels),
+        "roles": (sum(len(guild.roles) for guild in guilds), roles),
+        "emojis": (len(bot.emojis), bot.emojis),
+        "messages": (len(bot.cached_messages), bot.cached_messages),
+    }
+    report = {}
+    for name, (count, objects) in caches.items():
+        sample = list(itertools.islice(objects, sample_size))
+        # A guild holds every other cache, only count its own fields
+        depth = 1 if name == "guilds" else 3
+        per_object = sum(_approx_sizeof(obj, depth) for obj in sample) / len(sample) if sample else 0
+        report[name] = {"count": count, "approx_bytes": int(per_object * count)}
+    return report
+
+
+def current_rss_bytes() -> Optional[int]:
+    """
+    Resident memory of this process, None where /proc isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+# Types we never descend into while sizing, they're shared by everything in a cache
+_SHARED_TYPES = (discord.Guild, discord.Client, discord.abc.GuildChannel, type)
+
+
+def _approx_sizeof(obj, depth: int = 3, seen: Optional[set] = None) -> int:
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or depth < 0:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(_approx_sizeof(k, depth - 1, seen) + _approx_sizeof(v, depth - 1, seen)
+                          for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(_approx_sizeof(item, depth - 1, seen) for item in obj)
+    for cls in type(obj).__mro__:
+        slots = getattr(cls, "__slots__", ())
+        for slot in (slots,) if isinstance(slots, str) else slots:
+            value = getattr(obj, slot, None)
+            if value is not None and not isinstance(value, _SHARED_TYPES) and not slot.startswith("_state"):
+                size += _approx_sizeof(value, depth - 1, seen)
+    if hasattr(obj, "__dict__"):
+        size += _approx_sizeof(vars(obj), depth - 1, seen)
+    return size
+
+
+def _set_flag(flags, name: str, value: bool) -> None:
+    if name not in type(flags).VALID_FLAGS:
+        print(f"[CONFIG] Unknown flag {name!r} for {type(flags).__name__}, ignoring it")
+        return
+    setattr(flags, name, value)
+
+
+def _env_list(name: str) -> list:
+    value = get_env_str(name, "")
+    return [item.strip() for item in value.split(",") if item.strip()]
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional, Tuple
+
+import asyncpg
+
+import utilities.database_utils as database_utils
+
+LOAD_CACHED_REPLY = database_utils.QUERIES.register("load_cached_reply", """
+    SELECT response, expires_at FROM agent_cache WHERE key = $1 AND expires_at > NOW()
+""")
+
+SAVE_CACHED_REPLY = database_utils.QUERIES.register("save_cached_reply", """
+    INSERT INTO agent_cache (key, response, expires_at)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (key)
+    DO UPDATE SET response = EXCLUDED.response, expires_at = EXCLUDED.expires_at
+""")
+
+PRUNE_CACHED_REPLIES = database_utils.QUERIES.register("prune_cached_replies", """
+    DELETE FROM agent_cache WHERE expires_at <= NOW()
+""")
+
+
+class ResponseCache:
+    """
+    A TTL + LRU cache for agent replies with single-flight request coalescing.
+    Entries are keyed on the normalized query and show_thoughts. Memory is bounded by both
+    entry count and approximate size. When a db_pool is given, entries are also written
+    through to Postgres (the agent_cache table from the schema migrations) so they
+    survive restarts and are shared between processes.
+    - ttl: Seconds an answer stays valid.
+    - max_entries: Max answers held in memory.
+    - max_bytes: Approximate cap on the total size of answers held in memory.
+    - db_pool: Optional asyncpg Pool used as a second tier.
+    """
+
+    def __init__(
+            self,
+            ttl: float = 300.0,
+            max_entries: int = 1024,
+            max_bytes: int = 4 * 1024 * 1024,
+            db_pool: Optional[asyncpg.Pool] = None):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.db_pool = db_pool
+        self.size_bytes = 0
+        # Counters for tuning the cache
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (expires_at, value, size), oldest first
+        self._inflight = {} # key -> Future shared by everyone waiting on the same question
+        self._pruned_at = 0.0
+
+    @staticmethod
+    def make_key(query: str, show_thoughts: bool = False, context: str = "") -> str:
+        """
+        Normalizes a query so trivially different phrasings share an entry
+        (case, repeated whitespace and trailing punctuation are ignored).
+        'context' is a digest of the conversation the question was asked in, the same
+        question means something else after a different conversation.
+        """
+        normalized = " ".join(query.casefold().split()).rstrip("?!.,; ")
+        if context:
+            return f"{int(bool(show_thoughts))}:{context}:{normalized}"
+        return f"{int(bool(show_thoughts))}:{normalized}"
+
+    async def get_or_fetch(
+            self,
+            query: str,
+            show_thoughts: bool,
+            fetch: Callable[[], Awaitable[dict]],
+            context: str = "") -> Tuple[dict, str]:
+        """
+        Returns (reply, source) where source is 'hit', 'coalesced' or 'miss'.
+        On a miss 'fetch' is awaited exactly once, concurrent callers asking the same
+        question wait on that call instead of making their own. If that call raises,
+        the waiters don't inherit the exception, the next one in becomes the new owner.
+        """
+        key = self.make_key(query, show_thoughts, context)
+        cached = await self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached, "hit"
+
+        inflight = self._inflight.get(key)
+        while inflight is not None:
+            try:
+                # Shield so a cancelled waiter doesn't cancel the shared call
+                value = await asyncio.shield(inflight)
+            except (Exception, asyncio.CancelledError):
+                if not inflight.done() or asyncio.current_task().cancelling():
+                    # We were cancelled ourselves, not the shared call
+                    raise
+                # The shared call failed or was cancelled, errors aren't shared so try again ourselves
+                inflight = self._inflight.get(key)
+                continue
+            self.coalesced += 1
+            return value, "coalesced"
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            if self._is_cacheable(value):
+                await self.set(key, value)
+            return value, "miss"
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get(self, key: str) -> Optional[dict]:
+        """
+        Looks a key up in memory, then in the database tier.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value, size = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                return value
+            self._remove(key)
+
+        if self.db_pool is not None:
+            row = await self._db_get(key)
+            if row is not None:
+                value, ttl_left = row
+                self._store(key, value, ttl_left)
+                return value
+        return None
+
+    async def set(self, key: str, value: dict) -> None:
+        self._store(key, value)
+        if self.db_pool is not None:
+            await self._db_set(key, value)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _is_cacheable(value) -> bool:
+        # Never cache errors, the next ask should get a fresh attempt
+        return isinstance(value, dict) and "response" in value and "error" not in value
+
+    def _store(self, key: str, value: dict, ttl: Optional[float] = None) -> None:
+        if key in self._entries:
+            self._remove(key)
+        size = len(key) + len(str(value.get("response", "")))
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value, size)
+        self.size_bytes += size
+        # Evict least recently used answers until we're back under both limits
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[2]
+
+    async def _db_get(self, key: str) -> Optional[Tuple[dict, float]]:
+        try:
+            row = await database_utils.fetch_one_named(self.db_pool, LOAD_CACHED_REPLY, key)
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"[CACHE] Database lookup failed. Error: {e}")
+            return None
+        if row is None:
+            return None
+        ttl_left = (row["expires_at"] - datetime.now(timezone.utc)).total_seconds()
+        return json.loads(row["response"]), ttl_left
+
+    async def _db_set(self, key: str, value: dict) -> None:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        try:
+            await database_utils.execute_named(self.db_pool, SAVE_CACHED_REPLY, key, json.dumps(value), expires_at)
+            # Expired answers are never read again, cleared out once an hour
+            now = time.monotonic()
+            if now - self._pruned_at > 3600:
+                self._pruned_at = now
+                await database_utils.execute_named(self.db_pool, PRUNE_CACHED_REPLIES)
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"[CACHE] Database write failed. Error: {e}")
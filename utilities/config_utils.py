@@ -0,0 +1,53 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def get_env_str(name: str, default: str = None) -> str:
+    """
+    Returns an environment variable, or the default if it is unset or empty.
+    """
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip()
+
+
+def get_env_int(name: str, default: int) -> int:
+    """
+    Returns an environment variable parsed as an int, falling back to the default
+    (with a warning) when it is missing or malformed.
+    """
+    value = get_env_str(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"[CONFIG] Invalid integer for {name}: {value!r}, using {default}")
+        return default
+
+
+def get_env_float(name: str, default: float) -> float:
+    """
+    Returns an environment variable parsed as a float, falling back to the default
+    (with a warning) when it is missing or malformed.
+    """
+    value = get_env_str(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"[CONFIG] Invalid number for {name}: {value!r}, using {default}")
+        return default
+
+
+def get_env_bool(name: str, default: bool) -> bool:
+    """
+    Returns an environment variable parsed as a bool ("1", "true", "yes", "on" are truthy).
+    """
+    value = get_env_str(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
@@ -0,0 +1,254 @@
+import collections
+import hashlib
+import json
+import time
+from typing import Awaitable, Callable, Optional
+
+import asyncpg
+
+import utilities.database_utils as database_utils
+
+# Rough size of a token for the models behind the agent API, close enough for budgeting
+CHARS_PER_TOKEN = 4
+
+# Turns are (role, text, tokens), role being one of these
+USER = "user"
+ASSISTANT = "assistant"
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def context_digest(context: str) -> str:
+    """
+    Short fingerprint of a conversation context, for cache keys. Empty for no context,
+    so questions asked without any history keep sharing cache entries.
+    """
+    if not context:
+        return ""
+    return hashlib.blake2b(context.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class Conversation:
+    """
+    One user's recent turns in one channel, oldest first, and a summary of older ones.
+    """
+    __slots__ = ("turns", "tokens", "summary", "pending", "summarizing", "last_used")
+
+    def __init__(self, turns=(), summary: str = ""):
+        self.turns = collections.deque(turns)
+        self.tokens = sum(turn[2] for turn in self.turns)
+        self.summary = summary
+        self.pending = [] # Turns pushed out of the budget, waiting to be summarized
+        self.summarizing = False
+        self.last_used = time.monotonic()
+
+
+# Summarizer hook: (previous summary, turns pushed out of the budget) -> new summary
+Summarizer = Callable[[str, list], Awaitable[str]]
+
+LOAD_CONVERSATION = database_utils.QUERIES.register("load_conversation", """
+    SELECT summary, turns FROM agent_conversations
+    WHERE key = $1 AND updated_at > NOW() - make_interval(secs => $2)
+""")
+
+SAVE_CONVERSATION = database_utils.QUERIES.register("save_conversation", """
+    INSERT INTO agent_conversations (key, summary, turns, updated_at)
+    VALUES ($1, $2, $3::JSONB, NOW())
+    ON CONFLICT (key)
+    DO UPDATE SET summary = EXCLUDED.summary, turns = EXCLUDED.turns, updated_at = EXCLUDED.updated_at
+""")
+
+DELETE_CONVERSATION = database_utils.QUERIES.register("delete_conversation", """
+    DELETE FROM agent_conversations WHERE key = $1
+""")
+
+PRUNE_CONVERSATIONS = database_utils.QUERIES.register("prune_conversations", """
+    DELETE FROM agent_conversations WHERE updated_at < NOW() - make_interval(secs => $1)
+""")
+
+
+class ConversationStore:
+    """
+    Short term memory for the agent, one Conversation per key (user and channel).
+    Each conversation keeps only as many recent turns as fit in 'max_tokens' (approximate),
+    so prompts stay small no matter how long people chat. Turns that no longer fit are
+    dropped, or folded into a running summary when a summarizer is given.
+    Conversations idle for 'idle_ttl' seconds are forgotten, and past 'max_conversations'
+    the least recently used one is evicted. With a db_pool, conversations are also saved
+    to Postgres (the agent_conversations table from the schema migrations), so they survive
+    restarts and follow the user between processes.
+    - max_tokens: Budget for the summary and turns together.
+    - max_turns: Cap on turns kept, whatever their size.
+    - max_conversations: Conversations held in memory.
+    - idle_ttl: Seconds of inactivity after which a conversation is forgotten.
+    - summarizer: Optional async hook turning (summary, dropped turns) into a new summary.
+    - db_pool: Optional asyncpg Pool for persistence.
+    """
+
+    def __init__(
+            self,
+            max_tokens: int = 1500,
+            max_turns: int = 20,
+            max_conversations: int = 1000,
+            idle_ttl: float = 3600.0,
+            summarizer: Optional[Summarizer] = None,
+            db_pool: Optional[asyncpg.Pool] = None):
+        self.max_tokens = max_tokens
+        self.max_turns = max(2, max_turns)
+        self.max_conversations = max(1, max_conversations)
+        self.idle_ttl = idle_ttl
+        self.summarizer = summarizer
+        self.db_pool = db_pool
+        # Counters for !ask_stats
+        self.evictions = 0
+        self.dropped_turns = 0
+        self.summaries = 0
+        self._conversations = collections.OrderedDict() # key -> Conversation, least recently used first
+        self._pruned_at = 0.0
+
+    @staticmethod
+    def make_key(user_id: int, channel_id: int) -> str:
+        return f"{user_id}:{channel_id}"
+
+    async def get(self, key: str) -> Conversation:
+        """
+        Returns the conversation for a key, from memory, then the database, else a new one.
+        """
+        conversation = self._conversations.get(key)
+        now = time.monotonic()
+        if conversation is not None and now - conversation.last_used > self.idle_ttl:
+            del self._conversations[key]
+            conversation = None
+        if conversation is None:
+            conversation = await self._db_load(key) if self.db_pool is not None else None
+            if conversation is None:
+                conversation = Conversation()
+            self._conversations[key] = conversation
+            self._evict()
+        else:
+            self._conversations.move_to_end(key)
+        conversation.last_used = now
+        return conversation
+
+    async def add_exchange(self, key: str, question: str, answer: str) -> None:
+        """
+        Records a question and its answer, trimming the conversation back under budget.
+        """
+        conversation = await self.get(key)
+        # A single huge answer shouldn't push out everything else
+        turn_limit = self.max_tokens * CHARS_PER_TOKEN // 2
+        for role, text in ((USER, question), (ASSISTANT, answer)):
+            text = text[:turn_limit]
+            tokens = estimate_tokens(text)
+            conversation.turns.append((role, text, tokens))
+            conversation.tokens += tokens
+        self._trim(conversation)
+        if self.summarizer is not None and conversation.pending and not conversation.summarizing:
+            await self._summarize(conversation)
+        if self.db_pool is not None:
+            await self._db_save(key, conversation)
+
+    async def reset(self, key: str) -> None:
+        """
+        Forgets a conversation, in memory and in the database.
+        """
+        self._conversations.pop(key, None)
+        if self.db_pool is not None:
+            try:
+                await database_utils.execute_named(self.db_pool, DELETE_CONVERSATION, key)
+            except (OSError, asyncpg.PostgresError) as e:
+                print(f"[CONVERSATION] Database delete failed. Error: {e}")
+
+    @staticmethod
+    def render(conversation: Conversation) -> str:
+        """
+        The conversation as prompt text, empty when there's nothing to remember.
+        """
+        lines = []
+        if conversation.summary:
+            lines.append(f"Summary of the earlier conversation: {conversation.summary}")
+        for role, text, _ in conversation.turns:
+            lines.append(f"{'User' if role == USER else 'Assistant'}: {text}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def build_prompt(context: str, question: str) -> str:
+        """
+        Prepends the rendered conversation to a new question.
+        """
+        if not context:
+            return question
+        return f"Conversation so far:\n{context}\n\nNew question: {question}"
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._conversations),
+            "evictions": self.evictions,
+            "dropped_turns": self.dropped_turns,
+            "summaries": self.summaries,
+        }
+
+    def _trim(self, conversation: Conversation) -> None:
+        budget = self.max_tokens - estimate_tokens(conversation.summary)
+        # Always keep the latest exchange
+        while len(conversation.turns) > 2 and (conversation.tokens > budget or len(conversation.turns) > self.max_turns):
+            turn = conversation.turns.popleft()
+            conversation.tokens -= turn[2]
+            self.dropped_turns += 1
+            if self.summarizer is not None:
+                conversation.pending.append(turn[:2])
+
+    async def _summarize(self, conversation: Conversation) -> None:
+        # Exchanges that finish while the summarizer runs add to 'pending', picked up by the same loop
+        conversation.summarizing = True
+        try:
+            while conversation.pending:
+                dropped, conversation.pending = conversation.pending, []
+                summary = await self.summarizer(conversation.summary, dropped)
+                # The summary shares the budget, keep it to a third of it
+                conversation.summary = summary[:self.max_tokens * CHARS_PER_TOKEN // 3]
+                self.summaries += 1
+        except Exception as e:
+            # Keep the old summary, the dropped turns are lost
+            conversation.pending.clear()
+            print(f"[CONVERSATION] Summarizer failed. Error: {e}")
+        finally:
+            conversation.summarizing = False
+        self._trim(conversation)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+            self.evictions += 1
+        # Idle ones at the old end go too, they'd be dropped on their next get anyway
+        while self._conversations:
+            key, conversation = next(iter(self._conversations.items()))
+            if now - conversation.last_used <= self.idle_ttl:
+                break
+            del self._conversations[key]
+
+    async def _db_load(self, key: str) -> Optional[Conversation]:
+        try:
+            row = await database_utils.fetch_one_named(self.db_pool, LOAD_CONVERSATION, key, self.idle_ttl)
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"[CONVERSATION] Database lookup failed. Error: {e}")
+            return None
+        if row is None:
+            return None
+        turns = [(role, text, estimate_tokens(text)) for role, text in json.loads(row["turns"])]
+        return Conversation(turns, row["summary"])
+
+    async def _db_save(self, key: str, conversation: Conversation) -> None:
+        turns = json.dumps([turn[:2] for turn in conversation.turns])
+        try:
+            await database_utils.execute_named(self.db_pool, SAVE_CONVERSATION, key, conversation.summary, turns)
+            # Rows nobody will load again, cleared out once an hour
+            now = time.monotonic()
+            if now - self._pruned_at > 3600:
+                self._pruned_at = now
+                await database_utils.execute_named(self.db_pool, PRUNE_CONVERSATIONS, self.idle_ttl)
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"[CONVERSATION] Database write failed. Error: {e}")
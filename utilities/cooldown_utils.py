@@ -0,0 +1,188 @@
+import asyncio
+import time
+from typing import Optional
+
+import asyncpg
+from discord.ext import commands
+
+import utilities.database_utils as database_utils
+
+
+def _gcra(tat: Optional[float], now: float, rate: int, per: float):
+    """
+    One step of the generic cell rate algorithm, the whole state of a limit is a single
+    "theoretical arrival time" (TAT). 'rate' uses per 'per' seconds are spread out one
+    every per/rate seconds, and up to 'rate' may come in a burst.
+    Returns (new TAT or None if denied, seconds until the next use is allowed).
+    """
+    interval = per / rate
+    tat = now if tat is None or tat < now else tat
+    # How far ahead of schedule the caller may run, a full burst minus the use being made
+    allowed_at = tat - (per - interval)
+    if allowed_at > now:
+        return None, allowed_at - now
+    return tat + interval, 0.0
+
+
+class MemoryCooldownStore:
+    """
+    Cooldowns for this process only. Each key holds one float (its TAT), so a check is a
+    dict lookup and a few additions. Keys whose TAT has passed are back at a full burst
+    and carry no information, they're swept out once the store has doubled in size since
+    the last sweep, which keeps cleanup amortized O(1) per check.
+    """
+
+    def __init__(self, min_sweep: int = 1024):
+        self.min_sweep = min_sweep
+        self._tats = {} # key -> theoretical arrival time (time.monotonic based)
+        self._sweep_at = min_sweep
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+    async def hit(self, key: str, rate: int, per: float) -> float:
+        """
+        Uses one of 'rate' uses per 'per' seconds for 'key'.
+        Returns 0.0 if allowed, otherwise the seconds until it would be.
+        """
+        return self.hit_now(key, rate, per)
+
+    def hit_now(self, key: str, rate: int, per: float) -> float:
+        # Synchronous core of hit(), also used as the DB store's fallback
+        now = time.monotonic()
+        tat, retry_after = _gcra(self._tats.get(key), now, rate, per)
+        if tat is not None:
+            self._tats[key] = tat
+            if len(self._tats) >= self._sweep_at:
+                self._sweep(now)
+        return retry_after
+
+    async def reset(self, key: str) -> None:
+        self._tats.pop(key, None)
+
+    def _sweep(self, now: float) -> None:
+        for key in [key for key, tat in self._tats.items() if tat <= now]:
+            del self._tats[key]
+        self._sweep_at = max(self.min_sweep, len(self._tats) * 2)
+
+
+# One statement per check: the limit is applied with the database's clock inside the
+# upsert, so every shard and process sees the same state and races resolve on the row lock.
+# $1 key, $2 interval (per / rate), $3 tolerance (per - interval).
+# Returns 0 when allowed, otherwise the seconds to wait.
+COOLDOWN_HIT = database_utils.QUERIES.register("cooldown_hit", """
+    WITH clock AS (
+        SELECT EXTRACT(EPOCH FROM clock_timestamp())::DOUBLE PRECISION AS now
+    ), hit AS (
+        INSERT INTO cooldowns AS c (key, tat)
+        SELECT $1, clock.now + $2 FROM clock
+        ON CONFLICT (key) DO UPDATE
+            SET tat = GREATEST(c.tat, EXCLUDED.tat - $2) + $2
+            WHERE GREATEST(c.tat, EXCLUDED.tat - $2) - $3 <= EXCLUDED.tat - $2
+        RETURNING 0::DOUBLE PRECISION AS retry_after
+    )
+    SELECT retry_after FROM hit
+    UNION ALL
+    SELECT GREATEST(c.tat - $3 - clock.now, 0)
+    FROM cooldowns c, clock
+    WHERE c.key = $1 AND NOT EXISTS (SELECT 1 FROM hit)
+""")
+
+DELETE_COOLDOWN = database_utils.QUERIES.register("delete_cooldown", """
+    DELETE FROM cooldowns WHERE key = $1
+""")
+
+PRUNE_COOLDOWNS = database_utils.QUERIES.register("prune_cooldowns", """
+    DELETE FROM cooldowns WHERE tat < EXTRACT(EPOCH FROM clock_timestamp())
+""")
+
+
+class PostgresCooldownStore:
+    """
+    Cooldowns kept in Postgres (the cooldowns table from the schema migrations), shared by
+    every shard and cluster worker and kept across restarts. A check is one round trip
+    with a prepared statement. When the database can't be reached the check falls back
+    to an in-memory store, so limits still hold per process instead of failing commands.
+    - db_pool: The bot's asyncpg Pool.
+    - prune_interval: Seconds between deleting expired rows (they'd be ignored anyway).
+    """
+
+    def __init__(self, db_pool: asyncpg.Pool, prune_interval: float = 3600.0):
+        self.db_pool = db_pool
+        self.prune_interval = prune_interval
+        self.fallback = MemoryCooldownStore()
+        self._pruned_at = time.monotonic()
+        self._prune_task: Optional[asyncio.Task] = None
+
+    async def hit(self, key: str, rate: int, per: float) -> float:
+        """
+        Uses one of 'rate' uses per 'per' seconds for 'key'.
+        Returns 0.0 if allowed, otherwise the seconds until it would be.
+        """
+        interval = per / rate
+        try:
+            retry_after = await database_utils.fetch_val_named(self.db_pool, COOLDOWN_HIT,
+                                                               key, interval, per - interval)
+        except (asyncpg.PostgresError, OSError) as e:
+            print(f"[COOLDOWN] Database check failed, using in-memory cooldowns. Error: {e}")
+            return self.fallback.hit_now(key, rate, per)
+        self._maybe_prune()
+        # No row: another process inserted it after our snapshot and it denied us, wait one interval
+        return interval if retry_after is None else retry_after
+
+    async def reset(self, key: str) -> None:
+        await database_utils.execute_named(self.db_pool, DELETE_COOLDOWN, key)
+        await self.fallback.reset(key)
+
+    def _maybe_prune(self) -> None:
+        now = time.monotonic()
+        if now - self._pruned_at < self.prune_interval or (self._prune_task and not self._prune_task.done()):
+            return
+        self._pruned_at = now
+        self._prune_task = asyncio.create_task(self._prune())
+
+    async def _prune(self) -> None:
+        try:
+            await database_utils.execute_named(self.db_pool, PRUNE_COOLDOWNS)
+        except (asyncpg.PostgresError, OSError) as e:
+            print(f"[COOLDOWN] Failed to prune expired cooldowns. Error: {e}")
+
+
+# Used when the bot doesn't carry a store of its own
+_DEFAULT_STORE = MemoryCooldownStore()
+
+
+def cooldown_key(name: str, bucket: commands.BucketType, ctx) -> str:
+    """
+    Builds the store key for a command and the bucket the invocation falls in,
+    e.g. 'coinflip:user:1234'. BucketType.default gives one key for everybody.
+    """
+    bucket_id = bucket.get_key(ctx)
+    if isinstance(bucket_id, tuple):
+        bucket_id = ":".join(str(part) for part in bucket_id)
+    return f"{name}:{bucket.name}:{bucket_id if bucket_id is not None else 'global'}"
+
+
+def cooldown(rate: int, per: float, bucket: commands.BucketType = commands.BucketType.user):
+    """
+    Drop-in for commands.cooldown() backed by the bot's cooldown store ('bot.cooldown_store'),
+    so with a database the limit holds across shards, processes and restarts.
+    Raises commands.CommandOnCooldown like the built-in one.
+
+    Example:
+        @commands.command(name="coinflip")
+        @cooldown(1, 5, commands.BucketType.user)
+        async def coinflip(self, ctx): ...
+    """
+    async def predicate(ctx) -> bool:
+        # help also runs every command's checks (can_run swaps ctx.command in), only spend a use
+        # when the command is the one actually invoked
+        if ctx.command is None or ctx.invoked_with not in (ctx.command.name, *ctx.command.aliases):
+            return True
+        store = getattr(ctx.bot, "cooldown_store", None) or _DEFAULT_STORE
+        retry_after = await store.hit(cooldown_key(ctx.command.qualified_name, bucket, ctx), rate, per)
+        if retry_after > 0:
+            raise commands.CommandOnCooldown(commands.Cooldown(rate, per), retry_after, bucket)
+        return True
+
+    return commands.check(predicate)
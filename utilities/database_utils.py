@@ -1,34 +1,360 @@
 import asyncpg
+import contextlib
+from datetime import date, datetime, time, timedelta, timezone
+from time import perf_counter
+from typing import Union
 
+from utilities.metrics_utils import DB_ACQUIRE_WAIT, DB_POOL_SIZE, DB_QUERY_DURATION
 
-async def init_db_tables(db_pool: asyncpg.Pool) -> None:
+
+
+class QueryRegistry:
     """
-    Initializes or migrates necessary tables in the database.
+    Named SQL statements that are declared once and invoked by name. Every call for a name
+    sends the same SQL text, so asyncpg's per-connection statement cache prepares it on the
+    connection's first use and skips the parse and plan step on every call after that.
+    create_db_pool sizes that cache to hold every registered statement.
     """
-    async with db_pool.acquire() as conn:
-        # Example: Create a 'users' table if it doesn't exist
-        create_users_table_query = """
-            CREATE TABLE IF NOT EXISTS users (
-                id         SERIAL PRIMARY KEY,
-                discord_id BIGINT UNIQUE NOT NULL,
-                username   TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT NOW()
-            );
+
+    def __init__(self):
+        self._queries = {}
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def register(self, name: str, sql: str) -> str:
         """
-        await conn.execute(create_users_table_query)
-
-        # Example: Create a 'logs' table if it doesn't exist
-        create_logs_table_query = """
-            CREATE TABLE IF NOT EXISTS logs (
-                log_id     SERIAL PRIMARY KEY,
-                user_id    BIGINT NOT NULL,
-                command    TEXT,
-                timestamp  TIMESTAMP DEFAULT NOW()
-            );
+        Declares a named statement and returns its name.
         """
-        await conn.execute(create_logs_table_query)
+        if name in self._queries and self._queries[name] != sql:
+            raise ValueError(f"Query {name!r} is already registered with different SQL.")
+        self._queries[name] = sql
+        return name
+
+    def sql(self, name: str) -> str:
+        return self._queries[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._queries
+
+
+# Every named statement the bot uses
+QUERIES = QueryRegistry()
+
+UPSERT_USER = QUERIES.register("upsert_user", """
+    INSERT INTO users (discord_id, username)
+    VALUES ($1, $2)
+    ON CONFLICT (discord_id)
+    DO UPDATE SET username = EXCLUDED.username
+""")
+
+DELETE_USERS = QUERIES.register("delete_users", """
+    DELETE FROM users
+    WHERE discord_id = ANY($1::BIGINT[])
+""")
+
+
+async def create_db_pool(dsn: str, **kwargs) -> asyncpg.Pool:
+    """
+    Creates the bot's asyncpg Pool, with a statement cache big enough that ad-hoc
+    queries never push a registered statement out.
+    """
+    # Registered at import time, every module with named queries is imported by now
+    kwargs.setdefault("statement_cache_size", max(100, 2 * len(QUERIES)))
+    pool = await asyncpg.create_pool(dsn=dsn, **kwargs)
+    DB_POOL_SIZE.labels("open").set_function(pool.get_size)
+    DB_POOL_SIZE.labels("idle").set_function(pool.get_idle_size)
+    return pool
+
+
+# Series for the hot helpers, looked up once here instead of on every call
+_ACQUIRE_WAIT = DB_ACQUIRE_WAIT.labels()
+_FETCH_ONE_TIME = DB_QUERY_DURATION.labels("fetch_one")
+_FETCH_ALL_TIME = DB_QUERY_DURATION.labels("fetch_all")
+_FETCH_VAL_TIME = DB_QUERY_DURATION.labels("fetch_val")
+_EXECUTE_TIME = DB_QUERY_DURATION.labels("execute")
+_COPY_TIME = DB_QUERY_DURATION.labels("copy_records")
+
+
+@contextlib.asynccontextmanager
+async def _acquire(db: Union[asyncpg.Pool, asyncpg.Connection]):
+    """
+    Lets every helper take either the pool or an already acquired connection,
+    so several calls can share one connection (and one transaction).
+    """
+    if isinstance(db, asyncpg.Pool):
+        started = perf_counter()
+        async with db.acquire() as conn:
+            _ACQUIRE_WAIT.observe(perf_counter() - started)
+            yield conn
+    else:
+        yield db
+
+
+# ----------------------------------------------------------------------------
+# Schema migrations
+# ----------------------------------------------------------------------------
+
+# Ordered (version, description, sql). Never edit a migration that has shipped, add a new one.
+MIGRATIONS = [
+    (1, "users and legacy logs tables", """
+        CREATE TABLE IF NOT EXISTS users (
+            id         SERIAL PRIMARY KEY,
+            discord_id BIGINT UNIQUE NOT NULL,
+            username   TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS logs (
+            log_id     SERIAL PRIMARY KEY,
+            user_id    BIGINT NOT NULL,
+            command    TEXT,
+            timestamp  TIMESTAMP DEFAULT NOW()
+        );
+    """),
+    (2, "day-partitioned logs table", """
+        -- Keep whatever unpartitioned logs table existed around as logs_legacy
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_class c
+                       JOIN pg_namespace n ON n.oid = c.relnamespace
+                       WHERE c.relname = 'logs' AND c.relkind = 'r' AND n.nspname = current_schema()) THEN
+                ALTER TABLE logs RENAME TO logs_legacy;
+                ALTER INDEX IF EXISTS logs_pkey RENAME TO logs_legacy_pkey;
+            END IF;
+        END $$;
+        CREATE TABLE logs (
+            log_id     BIGSERIAL,
+            timestamp  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            logger     TEXT,
+            level      TEXT,
+            message    TEXT,
+            user_id    BIGINT,
+            PRIMARY KEY (log_id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+        -- Catches rows outside every daily partition so inserts never fail
+        CREATE TABLE logs_default PARTITION OF logs DEFAULT;
+        CREATE INDEX logs_timestamp_idx ON logs (timestamp);
+        CREATE INDEX logs_level_timestamp_idx ON logs (level, timestamp);
+        CREATE INDEX logs_user_id_idx ON logs (user_id) WHERE user_id IS NOT NULL;
+    """),
+    (3, "agent response cache table", """
+        CREATE TABLE IF NOT EXISTS agent_cache (
+            key        TEXT PRIMARY KEY,
+            response   TEXT NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+    """),
+    (4, "dm cleanup checkpoints table", """
+        CREATE TABLE IF NOT EXISTS dm_cleanup_checkpoints (
+            channel_id BIGINT PRIMARY KEY,
+            start_id   BIGINT NOT NULL,
+            cursor_id  BIGINT,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """),
+    (5, "structured log fields", """
+        -- Added on the partitioned parent, so every existing and future partition gets them
+        ALTER TABLE logs
+            ADD COLUMN IF NOT EXISTS guild_id   BIGINT,
+            ADD COLUMN IF NOT EXISTS channel_id BIGINT,
+            ADD COLUMN IF NOT EXISTS event      TEXT;
+        CREATE INDEX IF NOT EXISTS logs_guild_timestamp_idx ON logs (guild_id, timestamp) WHERE guild_id IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS logs_event_timestamp_idx ON logs (event, timestamp) WHERE event IS NOT NULL;
+    """),
+    (6, "command cooldowns table", """
+        -- One row per command/bucket key, 'tat' is the GCRA theoretical arrival time in epoch seconds
+        CREATE TABLE IF NOT EXISTS cooldowns (
+            key TEXT PRIMARY KEY,
+            tat DOUBLE PRECISION NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cooldowns_tat_idx ON cooldowns (tat);
+    """),
+    (7, "agent conversations table", """
+        -- One row per user and channel, 'turns' is a JSON array of [role, text] pairs
+        CREATE TABLE IF NOT EXISTS agent_conversations (
+            key        TEXT PRIMARY KEY,
+            summary    TEXT NOT NULL DEFAULT '',
+            turns      JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS agent_conversations_updated_at_idx ON agent_conversations (updated_at);
+    """),
+    (8, "searchable message archive", """
+        CREATE TABLE IF NOT EXISTS message_archive (
+            message_id  BIGINT PRIMARY KEY,
+            guild_id    BIGINT NOT NULL,
+            channel_id  BIGINT NOT NULL,
+            author_id   BIGINT NOT NULL,
+            author_name TEXT NOT NULL,
+            created_at  TIMESTAMPTZ NOT NULL,
+            content     TEXT NOT NULL,
+            -- 'simple' doesn't stem or drop stop words, chat isn't all English
+            content_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+        );
+        CREATE INDEX IF NOT EXISTS message_archive_tsv_idx ON message_archive USING GIN (content_tsv);
+        -- Newest first per guild, and within a channel or author when searches are narrowed to one
+        CREATE INDEX IF NOT EXISTS message_archive_guild_idx ON message_archive (guild_id, message_id DESC);
+        CREATE INDEX IF NOT EXISTS message_archive_channel_idx ON message_archive (channel_id, message_id DESC);
+        CREATE INDEX IF NOT EXISTS message_archive_author_idx ON message_archive (author_id, message_id DESC);
+    """),
+    (9, "activity rollups table", """
+        -- One row per time bucket, guild, series and key (channel/user id or command name, '' for guild totals)
+        CREATE TABLE IF NOT EXISTS activity_rollups (
+            bucket_start TIMESTAMPTZ NOT NULL,
+            guild_id     BIGINT NOT NULL,
+            series       TEXT NOT NULL,
+            key          TEXT NOT NULL,
+            count        BIGINT NOT NULL,
+            PRIMARY KEY (bucket_start, guild_id, series, key)
+        );
+        CREATE INDEX IF NOT EXISTS activity_rollups_guild_idx ON activity_rollups (guild_id, series, bucket_start);
+    """),
+    (10, "agent cache expiry index", """
+        -- For the hourly prune of expired answers
+        CREATE INDEX IF NOT EXISTS agent_cache_expires_at_idx ON agent_cache (expires_at);
+    """),
+    (11, "users created_at index", """
+        -- For the exporter, which reads users a day at a time
+        CREATE INDEX IF NOT EXISTS users_created_at_idx ON users (created_at);
+    """),
+]
+
+# Arbitrary key for pg_advisory_lock, so only one process migrates at a time
+MIGRATION_LOCK_ID = 7_401_392
+
+
+async def migrate(db_pool: asyncpg.Pool) -> list:
+    """
+    Applies every migration newer than the database's schema version, each in its own
+    transaction. Safe to run from several processes at once. Returns the versions applied.
+    """
+    applied = []
+    async with _acquire(db_pool) as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version     INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+        """)
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            for version, description, sql in MIGRATIONS:
+                if version <= current:
+                    continue
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                        version, description
+                    )
+                applied.append(version)
+                print(f"[DB] Applied migration {version}: {description}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    return applied
+
+
+async def init_db_tables(db_pool: asyncpg.Pool, partitions_ahead: int = 3) -> None:
+    """
+    Initializes or migrates necessary tables in the database.
+    """
+    await migrate(db_pool)
+    await ensure_log_partitions(db_pool, days_ahead=partitions_ahead)
+    print("[DB] Tables verified or created successfully.")
+
+
+# ----------------------------------------------------------------------------
+# Log partitions
+# ----------------------------------------------------------------------------
+
+def _log_partition_name(table_name: str, day: date) -> str:
+    return f"{table_name}_p{day:%Y%m%d}"
+
+
+async def ensure_log_partitions(db_pool: asyncpg.Pool, days_ahead: int = 3, table_name: str = "logs") -> list:
+    """
+    Creates the daily partitions (UTC) for today and the next 'days_ahead' days if missing.
+    Rows that already landed in the default partition for those days are moved over.
+    Returns the names of partitions created.
+    """
+    created = []
+    today = datetime.now(timezone.utc).date()
+    async with _acquire(db_pool) as conn:
+        existing = await _list_log_partitions(conn, table_name)
+        for offset in range(days_ahead + 1):
+            day = today + timedelta(days=offset)
+            name = _log_partition_name(table_name, day)
+            if name in existing:
+                continue
+            start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+            end = start + timedelta(days=1)
+            # Build it standalone, move any matching rows out of the default partition, then attach.
+            # A plain CREATE ... PARTITION OF fails if the default partition holds rows for the day.
+            async with conn.transaction():
+                await conn.execute(f"CREATE TABLE {name} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+                await conn.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM {table_name}_default
+                        WHERE timestamp >= $1 AND timestamp < $2
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved
+                """, start, end)
+                await conn.execute(f"""
+                    ALTER TABLE {table_name} ATTACH PARTITION {name}
+                    FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+                """)
+            created.append(name)
+    if created:
+        print(f"[DB] Created log partitions: {', '.join(created)}")
+    return created
+
+
+async def drop_expired_log_partitions(db_pool: asyncpg.Pool, retention_days: int, table_name: str = "logs") -> list:
+    """
+    Drops daily partitions that end more than 'retention_days' ago, and purges expired
+    rows from the default partition. Dropping a partition is instant, unlike a big DELETE.
+    Returns the names of partitions dropped.
+    """
+    dropped = []
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+    async with _acquire(db_pool) as conn:
+        for name in await _list_log_partitions(conn, table_name):
+            try:
+                day = datetime.strptime(name[len(table_name) + 2:], "%Y%m%d").date()
+            except ValueError:
+                continue # Not one of ours (e.g. the default partition)
+            if day < cutoff:
+                await conn.execute(f"DROP TABLE IF EXISTS {name}")
+                dropped.append(name)
+        await conn.execute(
+            f"DELETE FROM {table_name}_default WHERE timestamp < $1",
+            datetime.combine(cutoff, time.min, tzinfo=timezone.utc)
+        )
+    if dropped:
+        print(f"[DB] Dropped expired log partitions: {', '.join(dropped)}")
+    return dropped
 
-        print("[DB] Tables verified or created successfully.")
+
+async def maintain_log_partitions(db_pool: asyncpg.Pool, days_ahead: int = 3, retention_days: int = 30) -> None:
+    """
+    Creates upcoming partitions and drops expired ones. Run this periodically.
+    """
+    await ensure_log_partitions(db_pool, days_ahead=days_ahead)
+    await drop_expired_log_partitions(db_pool, retention_days)
+
+
+async def _list_log_partitions(conn, table_name: str) -> set:
+    rows = await conn.fetch("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = $1
+    """, table_name)
+    return {row["relname"] for row in rows}
 
 
 async def list_tables_and_columns(db_pool: asyncpg.Pool) -> None:
@@ -75,10 +401,11 @@ async def list_tables_and_columns(db_pool: asyncpg.Pool) -> None:
                     print(f"    {row}")
 
 
-async def bulk_update_users(db_pool: asyncpg.Pool, user_data: list) -> None:
+async def bulk_update_users(db_pool: asyncpg.Pool, user_data, chunk_size: int = 50000) -> dict:
     """
     Performs a bulk update or insert of user data.
-    'user_data' should be a list of dictionaries or tuples with the necessary fields.
+    'user_data' can be any iterable of dictionaries or (discord_id, username) tuples,
+    a generator works too so large member lists never have to be built up front.
 
     Example structure of user_data (list of dict):
         [
@@ -86,37 +413,73 @@ async def bulk_update_users(db_pool: asyncpg.Pool, user_data: list) -> None:
             {"discord_id": 987654321, "username": "ExampleUser2"},
             ...
         ]
+
+    Rows are streamed into a temp staging table with COPY, then merged into 'users' with a
+    single INSERT ... ON CONFLICT per chunk, so a chunk costs a couple of round trips
+    instead of one per user. Returns counts of inserted, updated and unchanged rows.
     """
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
     async with db_pool.acquire() as conn:
-        # Example upsert operation to handle existing & new users
-        upsert_query = """
-            INSERT INTO users (discord_id, username)
-            VALUES ($1, $2)
-            ON CONFLICT (discord_id) 
-            DO UPDATE SET username = EXCLUDED.username
+        # Lives for this connection's session, ON COMMIT DELETE ROWS empties it after each chunk
+        await conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS users_staging (
+                discord_id BIGINT NOT NULL,
+                username   TEXT NOT NULL
+            ) ON COMMIT DELETE ROWS;
+        """)
+        # Only touch rows whose username actually changed, and report which rows were new
+        merge_query = """
+            WITH merged AS (
+                INSERT INTO users (discord_id, username)
+                SELECT discord_id, username FROM users_staging
+                ON CONFLICT (discord_id)
+                DO UPDATE SET username = EXCLUDED.username
+                WHERE users.username IS DISTINCT FROM EXCLUDED.username
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT COUNT(*) FILTER (WHERE inserted)     AS inserted,
+                   COUNT(*) FILTER (WHERE NOT inserted) AS updated
+            FROM merged;
         """
-        async with conn.transaction():
-            for record in user_data:
-                await conn.execute(
-                    upsert_query,
-                    record["discord_id"],
-                    record["username"]
-                )
-    print("[DB] Bulk user update completed.")
+        for chunk in _chunk_user_records(user_data, chunk_size):
+            async with conn.transaction():
+                await conn.copy_records_to_table("users_staging",
+                                                 records=chunk,
+                                                 columns=["discord_id", "username"])
+                result = await conn.fetchrow(merge_query)
+            counts["inserted"] += result["inserted"]
+            counts["updated"] += result["updated"]
+            counts["unchanged"] += len(chunk) - result["inserted"] - result["updated"]
+    print(f"[DB] Bulk user update completed. {counts['inserted']} inserted, "
+          f"{counts['updated']} updated, {counts['unchanged']} unchanged.")
+    return counts
+
+
+def _chunk_user_records(user_data, chunk_size: int):
+    """
+    Yields lists of (discord_id, username) tuples, at most chunk_size long.
+    Duplicate ids inside a chunk are collapsed (last one wins) since ON CONFLICT
+    can't touch the same row twice in one statement.
+    """
+    chunk = {}
+    for record in user_data:
+        if isinstance(record, dict):
+            discord_id, username = record["discord_id"], record["username"]
+        else:
+            discord_id, username = record
+        chunk[discord_id] = username
+        if len(chunk) >= chunk_size:
+            yield list(chunk.items())
+            chunk = {}
+    if chunk:
+        yield list(chunk.items())
 
 
 async def update_single_user(db_pool: asyncpg.Pool, discord_id: int, username: str) -> None:
     """
     Updates a single user's record (or inserts if not present).
     """
-    async with db_pool.acquire() as conn:
-        upsert_query = """
-            INSERT INTO users (discord_id, username)
-            VALUES ($1, $2)
-            ON CONFLICT (discord_id) 
-            DO UPDATE SET username = EXCLUDED.username
-        """
-        await conn.execute(upsert_query, discord_id, username)
+    await execute_named(db_pool, UPSERT_USER, discord_id, username)
     print(f"[DB] User {discord_id} updated/inserted successfully.")
 
 
@@ -124,29 +487,109 @@ async def fetch_one(db_pool: asyncpg.Pool, query: str, *args):
     """
     Fetches a single row from the database.
     """
-    async with db_pool.acquire() as conn:
-        return await conn.fetchrow(query, *args)
+    async with _acquire(db_pool) as conn:
+        with _FETCH_ONE_TIME.time():
+            return await conn.fetchrow(query, *args)
 
 
 async def fetch_all(db_pool: asyncpg.Pool, query: str, *args):
     """
     Fetches all rows matching the query.
     """
-    async with db_pool.acquire() as conn:
-        return await conn.fetch(query, *args)
+    async with _acquire(db_pool) as conn:
+        with _FETCH_ALL_TIME.time():
+            return await conn.fetch(query, *args)
 
 
 async def fetch_val(db_pool: asyncpg.Pool, query: str, *args):
     """
     Fetches a single value (the first column of the first row) from the database.
     """
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval(query, *args)
+    async with _acquire(db_pool) as conn:
+        with _FETCH_VAL_TIME.time():
+            return await conn.fetchval(query, *args)
 
 
 async def execute(db_pool: asyncpg.Pool, query: str, *args) -> None:
     """
     Executes a generic statement in the database (INSERT, UPDATE, DELETE, etc.).
     """
-    async with db_pool.acquire() as conn:
-        await conn.execute(query, *args)
+    async with _acquire(db_pool) as conn:
+        with _EXECUTE_TIME.time():
+            await conn.execute(query, *args)
+
+
+async def copy_records(db_pool: asyncpg.Pool, table_name: str, columns: list, records: list) -> None:
+    """
+    Bulk-loads a batch of records into a table with a single COPY.
+    'records' should be a list of tuples ordered the same as 'columns'.
+    """
+    async with _acquire(db_pool) as conn:
+        with _COPY_TIME.time():
+            await conn.copy_records_to_table(table_name, records=records, columns=columns)
+
+
+# ----------------------------------------------------------------------------
+# Named queries
+# ----------------------------------------------------------------------------
+
+async def _run_named(db, name: str, method: str, *args):
+    # Always the same SQL text for a name, so after the first call asyncpg serves it from its statement cache
+    async with _acquire(db) as conn:
+        # Named queries get their own series, labelled with the registered name
+        with DB_QUERY_DURATION.labels(name).time():
+            return await getattr(conn, method)(QUERIES.sql(name), *args)
+
+
+async def fetch_one_named(db_pool: asyncpg.Pool, name: str, *args):
+    """
+    Fetches a single row using a registered query.
+    """
+    return await _run_named(db_pool, name, "fetchrow", *args)
+
+
+async def fetch_all_named(db_pool: asyncpg.Pool, name: str, *args):
+    """
+    Fetches all rows using a registered query.
+    """
+    return await _run_named(db_pool, name, "fetch", *args)
+
+
+async def fetch_val_named(db_pool: asyncpg.Pool, name: str, *args):
+    """
+    Fetches a single value using a registered query.
+    """
+    return await _run_named(db_pool, name, "fetchval", *args)
+
+
+async def execute_named(db_pool: asyncpg.Pool, name: str, *args) -> None:
+    """
+    Executes a registered statement (INSERT, UPDATE, DELETE, etc.).
+    """
+    await _run_named(db_pool, name, "execute", *args)
+
+
+async def execute_many_named(db_pool: asyncpg.Pool, name: str, args_list: list) -> None:
+    """
+    Executes a registered statement once per argument tuple in a single round trip.
+    """
+    await _run_named(db_pool, name, "executemany", args_list)
+
+
+async def run_named_batch(db_pool: asyncpg.Pool, statements: list) -> list:
+    """
+    Runs several registered statements on one connection inside one transaction.
+    'statements' is a list of (name, args) tuples, returns each statement's rows in order.
+
+    Example:
+        await run_named_batch(db_pool, [
+            (UPSERT_USER, (123456789, "ExampleUser1")),
+            (UPSERT_USER, (987654321, "ExampleUser2")),
+        ])
+    """
+    results = []
+    async with _acquire(db_pool) as conn:
+        async with conn.transaction():
+            for name, args in statements:
+                results.append(await _run_named(conn, name, "fetch", *args))
+    return results
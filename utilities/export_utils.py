@@ -0,0 +1,316 @@
+"""
+Exports the bot's tables to compressed NDJSON or CSV files, one directory per day, for
+shipping to cold storage. Rows are streamed from Postgres (a server-side cursor for NDJSON,
+COPY for CSV), so memory stays flat however big the table is. Each finished day is
+recorded in a state file, a later run picks up after the last exported day.
+
+Only whole days before --until (default: today, UTC) are exported, so a daily run never
+writes a day that's still filling up.
+
+Run from the repo root (DB_URL comes from .env):
+    python -m utilities.export_utils --table logs
+    python -m utilities.export_utils --table logs --table message_archive --format csv --compression zstd
+    python -m utilities.export_utils --table logs --since 2026-01-01 --until 2026-04-01 --out /mnt/cold
+"""
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import shutil
+import time
+from typing import NamedTuple, Optional
+
+import asyncpg
+import discord
+from dotenv import load_dotenv
+load_dotenv()
+
+from utilities.config_utils import get_env_int, get_env_str
+
+try:
+    import zstandard
+except ImportError: # Optional, only needed for --compression zstd
+    zstandard = None
+
+FORMATS = ("ndjson", "csv")
+COMPRESSIONS = ("gzip", "zstd")
+ONE_DAY = datetime.timedelta(days=1)
+
+
+class ExportTable(NamedTuple):
+    """
+    A table the exporter knows: the columns written out, and the timestamp column that
+    puts a row on a day. Tables keyed by a snowflake range over that column instead,
+    its index finds a day's rows without one on the timestamp. A 'naive_utc' time column
+    is a TIMESTAMP holding UTC, it's compared against bounds without a zone so its own
+    index is used.
+    """
+    columns: tuple
+    time_column: str
+    snowflake_column: Optional[str] = None
+    naive_utc: bool = False
+
+
+EXPORT_TABLES = {
+    "logs": ExportTable(("log_id", "timestamp", "logger", "level", "event", "message",
+                         "user_id", "guild_id", "channel_id"), "timestamp"),
+    # created_at has no zone, it's read as UTC. Rows are exported on the day they were
+    # created, later username changes aren't picked up again.
+    "users": ExportTable(("id", "discord_id", "username", "created_at"), "created_at", naive_utc=True),
+    "message_archive": ExportTable(("message_id", "guild_id", "channel_id", "author_id", "author_name",
+                                    "created_at", "content"), "created_at", snowflake_column="message_id"),
+}
+
+
+def open_compressed(path: str, compression: str, level: Optional[int] = None):
+    """
+    Opens 'path' for writing through the compressor, returns a binary file object.
+    """
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=level or 6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package (pip install zstandard).")
+        return zstandard.ZstdCompressor(level=level or 3).stream_writer(open(path, "wb"), closefd=True)
+    raise ValueError(f"Unknown compression {compression!r}, use one of: {', '.join(COMPRESSIONS)}")
+
+
+def load_state(path: str) -> dict:
+    """
+    Reads the state file: table name -> UTC datetime everything before which is exported.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {table: datetime.datetime.fromisoformat(until) for table, until in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path: str, state: dict) -> None:
+    # Written aside and renamed over, a crash never leaves a half-written state file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({table: until.isoformat() for table, until in state.items()}, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+class TableExporter:
+    """
+    Exports one table day by day into '<out_dir>/<table>/<YYYY-MM-DD>/'. A day is written
+    into a '.part' directory and renamed into place once complete, so every day directory
+    on disk is whole. An interrupted day is simply exported again on the next run.
+    - conn: An asyncpg Connection with its time zone set to UTC.
+    - file_format: 'ndjson' or 'csv'.
+    - compression: 'gzip' or 'zstd'.
+    - rows_per_file: NDJSON rows per file before a day rolls over to its next file.
+      CSV comes out of COPY as one file per day.
+    - batch_size: Rows fetched from the cursor per round trip, the only rows held in memory.
+    """
+
+    def __init__(
+            self,
+            conn: asyncpg.Connection,
+            table: str,
+            out_dir: str,
+            file_format: str = "ndjson",
+            compression: str = "gzip",
+            level: Optional[int] = None,
+            rows_per_file: int = 1_000_000,
+            batch_size: int = 5000):
+        self.conn = conn
+        self.table = table
+        self.spec = EXPORT_TABLES[table]
+        self.out_dir = os.path.join(out_dir, table)
+        self.file_format = file_format
+        self.compression = compression
+        self.level = level
+        self.rows_per_file = max(1, rows_per_file)
+        self.batch_size = max(1, batch_size)
+        self._extension = f"{file_format}.{'gz' if compression == 'gzip' else 'zst'}"
+        columns = ", ".join(self.spec.columns)
+        range_column = self.spec.snowflake_column or self.spec.time_column
+        self._day_query = (f"SELECT {columns} FROM {table} "
+                           f"WHERE {range_column} >= $1 AND {range_column} < $2 ORDER BY {range_column}")
+        self._next_query = f"SELECT min({range_column}) FROM {table} WHERE {range_column} >= $1 AND {range_column} < $2"
+
+    async def export(self, since: datetime.datetime, until: datetime.datetime, on_day=None) -> datetime.datetime:
+        """
+        Exports every day with rows from 'since' up to 'until' (both UTC midnights), skipping
+        empty days. Calls on_day(next_since) after each finished day, for saving state.
+        Returns the day after the last one exported.
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        day = await self._next_day(since, until)
+        while day is not None:
+            started = time.perf_counter()
+            rows, files, size = await self._export_day(day)
+            print(f"[EXPORT] {self.table} {day:%Y-%m-%d}: {rows} rows in {files} file(s), "
+                  f"{size / 1024 / 1024:.1f} MiB, {time.perf_counter() - started:.1f}s")
+            since = day + ONE_DAY
+            if on_day is not None:
+                on_day(since)
+            day = await self._next_day(since, until)
+        return since
+
+    async def _next_day(self, since: datetime.datetime, until: datetime.datetime) -> Optional[datetime.datetime]:
+        # Jumps over gaps with one indexed lookup instead of querying every empty day
+        if since >= until:
+            return None
+        first = await self.conn.fetchval(self._next_query, self._bound(since), self._bound(until))
+        if first is None:
+            return None
+        if self.spec.snowflake_column is not None:
+            first = discord.utils.snowflake_time(first)
+        elif self.spec.naive_utc:
+            first = first.replace(tzinfo=datetime.timezone.utc)
+        return datetime.datetime.combine(first.astimezone(datetime.timezone.utc).date(), datetime.time(),
+                                         tzinfo=datetime.timezone.utc)
+
+    def _bound(self, moment: datetime.datetime):
+        if self.spec.snowflake_column is not None:
+            return discord.utils.time_snowflake(moment)
+        if self.spec.naive_utc:
+            return moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return moment
+
+    async def _export_day(self, day: datetime.datetime):
+        final_dir = os.path.join(self.out_dir, f"{day:%Y-%m-%d}")
+        part_dir = f"{final_dir}.part"
+        # Left over from an interrupted run
+        shutil.rmtree(part_dir, ignore_errors=True)
+        os.makedirs(part_dir)
+        args = (self._bound(day), self._bound(day + ONE_DAY))
+        # One snapshot per day, a cursor only lives inside a transaction
+        async with self.conn.transaction(isolation="repeatable_read", readonly=True):
+            if self.file_format == "csv":
+                rows, files = await self._copy_csv(part_dir, day, args)
+            else:
+                rows, files = await self._stream_ndjson(part_dir, day, args)
+        size = sum(entry.stat().st_size for entry in os.scandir(part_dir))
+        # The state file lagging behind means this day was renamed into place but not recorded
+        if os.path.isdir(final_dir):
+            shutil.rmtree(final_dir)
+        os.rename(part_dir, final_dir)
+        return rows, files, size
+
+    def _file_path(self, part_dir: str, day: datetime.datetime, part: int) -> str:
+        return os.path.join(part_dir, f"{self.table}-{day:%Y-%m-%d}-{part:04d}.{self._extension}")
+
+    async def _copy_csv(self, part_dir: str, day: datetime.datetime, args: tuple):
+        # Postgres formats the rows, asyncpg hands each chunk of COPY output straight to the file
+        f = open_compressed(self._file_path(part_dir, day, 0), self.compression, self.level)
+        try:
+            status = await self.conn.copy_from_query(self._day_query, *args, output=f, format="csv", header=True)
+        finally:
+            f.close()
+        # Status is 'COPY <rows>'
+        return int(status.split()[-1]), 1
+
+    async def _stream_ndjson(self, part_dir: str, day: datetime.datetime, args: tuple):
+        cursor = await self.conn.cursor(self._day_query, *args)
+        rows = files = rows_in_file = 0
+        f = None
+        try:
+            while True:
+                batch = await cursor.fetch(self.batch_size)
+                if not batch:
+                    break
+                if f is None or rows_in_file >= self.rows_per_file:
+                    if f is not None:
+                        f.close()
+                    f = open_compressed(self._file_path(part_dir, day, files), self.compression, self.level)
+                    files += 1
+                    rows_in_file = 0
+                # One write per batch, the compressor works on bigger blocks that way
+                f.write("".join(json.dumps(dict(record), default=_json_default, ensure_ascii=False) + "\n"
+                                for record in batch).encode("utf-8"))
+                rows += len(batch)
+                rows_in_file += len(batch)
+        finally:
+            if f is not None:
+                f.close()
+        return rows, files
+
+
+def _parse_day(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+
+
+async def run_export(
+        dsn: str,
+        tables: list,
+        out_dir: str,
+        state_path: str,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        **exporter_kwargs) -> None:
+    """
+    Exports each table from where the state file left off (or 'since', or its first row)
+    up to 'until', saving progress after every day.
+    """
+    if until is None:
+        until = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    state = load_state(state_path)
+    # One connection is enough, the export is bound by disk and compression
+    conn = await asyncpg.connect(dsn, server_settings={"timezone": "UTC", "application_name": "discordbot-export"})
+    try:
+        for table in tables:
+            start = since or state.get(table) or datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+            exporter = TableExporter(conn, table, out_dir, **exporter_kwargs)
+
+            def record(next_since, table=table):
+                state[table] = next_since
+                save_state(state_path, state)
+
+            print(f"[EXPORT] {table}: exporting {start:%Y-%m-%d} up to {until:%Y-%m-%d}")
+            await exporter.export(start, until, on_day=record)
+            print(f"[EXPORT] {table}: done.")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", action="append", choices=list(EXPORT_TABLES), dest="tables",
+                        help="Table to export, repeat for several (default: logs)")
+    parser.add_argument("--out", default=get_env_str("EXPORT_DIR", "exports"),
+                        help="Directory the files go in")
+    parser.add_argument("--state", default=None,
+                        help="State file recording exported days (default: <out>/export_state.json)")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson", dest="file_format")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="gzip")
+    parser.add_argument("--level", type=int, default=None, help="Compression level (default: gzip 6, zstd 3)")
+    parser.add_argument("--since", type=_parse_day, default=None,
+                        help="First day to export, YYYY-MM-DD (default: after the last exported day)")
+    parser.add_argument("--until", type=_parse_day, default=None,
+                        help="Export days before this one, YYYY-MM-DD (default: today)")
+    parser.add_argument("--rows-per-file", type=int, default=get_env_int("EXPORT_ROWS_PER_FILE", 1_000_000))
+    parser.add_argument("--batch-size", type=int, default=get_env_int("EXPORT_BATCH_SIZE", 5000),
+                        help="Rows fetched per cursor round trip")
+    args = parser.parse_args()
+
+    db_url = os.getenv("DB_URL")
+    if not db_url:
+        parser.error("DB_URL isn't set.")
+    if args.compression == "zstd" and zstandard is None:
+        parser.error("zstd compression needs the zstandard package (pip install zstandard).")
+    os.makedirs(args.out, exist_ok=True)
+    asyncio.run(run_export(db_url,
+                           args.tables or ["logs"],
+                           args.out,
+                           args.state or os.path.join(args.out, "export_state.json"),
+                           since=args.since,
+                           until=args.until,
+                           file_format=args.file_format,
+                           compression=args.compression,
+                           level=args.level,
+                           rows_per_file=args.rows_per_file,
+                           batch_size=args.batch_size))
@@ -1,23 +1,72 @@
 import logging
 import asyncio
-from datetime import datetime
+import json
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Optional
 
 import utilities.database_utils as database_utils
+from utilities.batch_utils import BatchQueue
+from utilities.metrics_utils import QUEUE_DEPTH, QUEUE_ITEMS
+
+# Columns written by DatabaseLogHandler, in the order of each queued row
+LOG_COLUMNS = ["timestamp", "logger", "level", "message", "user_id", "guild_id", "channel_id", "event"]
+# Structured fields a record can carry (pass them through extra=, see log_fields)
+LOG_FIELDS = ("event", "guild_id", "channel_id", "user_id")
+LOG_FORMAT = "[%(asctime)s] [%(levelname)s] %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def log_fields(event: str, user=None, guild=None, channel=None) -> dict:
+    """
+    Builds the extra= dict for a structured log record. Only ids are kept, so nothing
+    from the Discord objects is read once the record leaves the event loop.
+    """
+    return {
+        "event": event,
+        "user_id": user.id if user is not None else None,
+        "guild_id": guild.id if guild is not None else None,
+        "channel_id": channel.id if channel is not None else None,
+    }
+
 
 def setup_logging(
         db_pool,
         loop: asyncio.AbstractEventLoop,
         logger_name: Optional[str] = None,
         level: int = logging.INFO,
-        table_name: str = "logs"):
+        table_name: str = "logs",
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+        overflow: str = "drop_oldest",
+        console: bool = True,
+        file_path: Optional[str] = None,
+        file_format: str = "text",
+        file_max_bytes: int = 10 * 1024 * 1024,
+        file_backups: int = 5,
+        record_queue_size: int = 10000):
     """
-    Configures and returns a Python logger that uses the DatabaseLogHandler.
-    - db_pool: The asyncpg Pool for database interactions.
+    Configures and returns a Python logger whose only handler is a queue put.
+    Records are handed to a QueueListener thread which formats them and fans them out
+    to the sinks (console, rotating file, database), so the event loop never formats
+    a string or touches a file or socket for a log line.
+    - db_pool: The asyncpg Pool for database interactions, None for no database sink.
     - loop: The event loop used for scheduling async DB calls.
     - logger_name: Optional name for the logger (defaults to root logger if None).
     - level: Logging level (DEBUG, INFO, etc.).
     - table_name: Which DB table to store logs in (default 'logs').
+    - batch_size: How many log rows are written per COPY.
+    - flush_interval: Max seconds a log row waits before being written.
+    - max_queue_size: How many log rows can wait for the database before the overflow policy applies.
+    - overflow: What to do when that queue is full ('drop_oldest', 'drop_newest' or 'block').
+    - console: Print records to stdout.
+    - file_path: Optional file to log to, rotated at 'file_max_bytes' keeping 'file_backups' old files.
+    - file_format: 'text' (same lines as the console) or 'json' (one object per line).
+    - record_queue_size: How many records can wait for the listener thread, newer ones are dropped past that.
     """
     if logger_name:
         logger = logging.getLogger(logger_name)
@@ -27,76 +76,186 @@ def setup_logging(
     # Set level of logs broadcasted (ex. logging.INFO in our level parameter)
     logger.setLevel(level)
 
-    # Create and add our custom handler
-    db_handler = DatabaseLogHandler(db_pool=db_pool, loop=loop, table_name=table_name)
-    # You could also attach additional formatters here:
-    formatter = logging.Formatter(
-        fmt="[%(asctime)s] [%(levelname)s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
-    # Set our formatter we made and attach it to our handler
-    db_handler.setFormatter(formatter)
-    # Add handler to our logger
-    logger.addHandler(db_handler)
+    sinks = []
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(StructuredFormatter(LOG_FORMAT, LOG_DATE_FORMAT))
+        sinks.append(console_handler)
+    if file_path:
+        if os.path.dirname(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        file_handler = RotatingFileHandler(file_path, maxBytes=file_max_bytes, backupCount=file_backups,
+                                           encoding="utf-8", delay=True)
+        if file_format == "json":
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(StructuredFormatter(LOG_FORMAT, LOG_DATE_FORMAT))
+        sinks.append(file_handler)
+    if db_pool is not None:
+        db_handler = DatabaseLogHandler(db_pool=db_pool,
+                                        loop=loop,
+                                        table_name=table_name,
+                                        batch_size=batch_size,
+                                        flush_interval=flush_interval,
+                                        max_queue_size=max_queue_size,
+                                        overflow=overflow)
+        db_handler.setFormatter(logging.Formatter(fmt=LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+        sinks.append(db_handler)
+
+    # The only handler on the logger, everything else happens on the listener's thread
+    queue_handler = LoopQueueHandler(queue.Queue(record_queue_size), name=logger.name)
+    queue_handler.listener = QueueListener(queue_handler.queue, *sinks, respect_handler_level=True)
+    queue_handler.listener.start()
+    logger.addHandler(queue_handler)
 
     return logger
 
 
+class LoopQueueHandler(QueueHandler):
+    """
+    A QueueHandler that hands records over untouched. The stock prepare() formats the
+    message on the calling thread (for pickling), we stay in-process so the listener
+    thread does all of that. When the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, record_queue: queue.Queue, name: str = "logging"):
+        super().__init__(record_queue)
+        self.listener: Optional[QueueListener] = None
+        self.dropped = 0
+        QUEUE_DEPTH.labels(f"{name} records").set_function(record_queue.qsize)
+        QUEUE_ITEMS.labels(f"{name} records", "dropped").set_function(lambda: self.dropped)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    The usual text line, followed by the record's structured fields as key=value pairs.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = [f"{name}={value}" for name in LOG_FIELDS if (value := getattr(record, name, None)) is not None]
+        return f"{line} {' '.join(fields)}" if fields else line
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, structured fields as their own keys.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in LOG_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
 class DatabaseLogHandler(logging.Handler):
     """
     A custom logging handler that stores log records in the database via database_utils.
-    Since Python's logging is synchronous by default but our DB functions are async,
-    we use run_coroutine_threadsafe to push work into the event loop.
+    Python's logging is synchronous but our DB functions are async, so emit only appends
+    the row to a bounded BatchQueue. A background task on the event loop drains it and
+    writes each batch with a single COPY, so a busy guild costs one pool acquire per batch
+    instead of one per log line. setup_logging runs it on the QueueListener's thread.
     """
 
-    def __init__(self, db_pool, loop: asyncio.AbstractEventLoop, table_name: str = "logs"):
+    def __init__(
+            self,
+            db_pool,
+            loop: asyncio.AbstractEventLoop,
+            table_name: str = "logs",
+            batch_size: int = 500,
+            flush_interval: float = 1.0,
+            max_queue_size: int = 10000,
+            overflow: str = "drop_oldest"):
         super().__init__()
         self.db_pool = db_pool
         self.loop = loop
-        self.table_name = table_name # Unsure if I'll need this once db is configured, maybe just hardcode
+        self.table_name = table_name
+        self.queue = None
+        # Without a database there is nothing to drain into, we only print
+        if db_pool is not None:
+            self.queue = BatchQueue(self._write_logs_to_db,
+                                    loop,
+                                    max_size=max_queue_size,
+                                    batch_size=batch_size,
+                                    flush_interval=flush_interval,
+                                    overflow=overflow,
+                                    name="DB LOG")
+            self.queue.start()
 
 
     def emit(self, record: logging.LogRecord) -> None:
         """
         Called automatically when a log event occurs. Formats the log message
-        and submits a database write through an async method.
-        """
-
-        print(self.format(record))
-
+        and queues it for the next database batch.
         """
         try:
-            msg = self.format(record)
-            # For consistent timestamps, we can convert the 'created' field (float) into a datetime
-            log_time = datetime.fromtimestamp(record.created)
-            # Schedule the async DB call on the provided event loop
-            asyncio.run_coroutine_threadsafe(
-                self._write_log_to_db(
-                    log_time,
-                    record.name,
-                    record.levelname,
-                    msg
-                ),
-                self.loop
-            )
+            if self.queue is not None:
+                msg = self.format(record)
+                # For consistent timestamps, we can convert the 'created' field (float) into a UTC datetime
+                log_time = datetime.fromtimestamp(record.created, tz=timezone.utc)
+                # Structured fields from extra= get their own columns, so logs can be looked up by them
+                self.queue.put((log_time, record.name, record.levelname, msg,
+                                getattr(record, "user_id", None),
+                                getattr(record, "guild_id", None),
+                                getattr(record, "channel_id", None),
+                                getattr(record, "event", None)))
         except Exception:
             self.handleError(record)
-        """
 
 
-    async def _write_log_to_db(self, log_time: datetime, logger_name: str, level: str, message: str):
+    async def aclose(self) -> None:
+        """
+        Flushes every queued log row and stops the background writer.
         """
-        An async helper method for writing a single log entry to the database.
+        if self.queue is not None:
+            await self.queue.close()
+
+
+    async def _write_logs_to_db(self, rows: list) -> None:
         """
-        insert_query = f"""
-            INSERT INTO {self.table_name} (timestamp, logger, level, message)
-            VALUES ($1, $2, $3, $4)
+        An async helper method for writing a batch of log rows to the database.
         """
-        await database_utils.execute(
-            self.db_pool,
-            insert_query,
-            log_time.isoformat(),
-            logger_name,
-            level,
-            message
-        )
\ No newline at end of file
+        await database_utils.copy_records(self.db_pool, self.table_name, LOG_COLUMNS, rows)
+
+
+async def close_logging(logger: Optional[logging.Logger]) -> None:
+    """
+    Drains the record queue, then flushes and stops the database sink.
+    Call this before closing the db_pool so the last batch isn't lost.
+    Console and file sinks are attached to the logger directly afterwards,
+    so messages logged during the rest of shutdown still show up.
+    """
+    if logger is None:
+        return
+    for handler in list(logger.handlers):
+        if isinstance(handler, LoopQueueHandler):
+            logger.removeHandler(handler)
+            if handler.listener is not None:
+                # stop() joins the listener thread once the queue is drained
+                await asyncio.to_thread(handler.listener.stop)
+                for sink in handler.listener.handlers:
+                    if isinstance(sink, DatabaseLogHandler):
+                        await sink.aclose()
+                    else:
+                        logger.addHandler(sink)
+        elif isinstance(handler, DatabaseLogHandler):
+            await handler.aclose()
@@ -0,0 +1,140 @@
+import asyncio
+from typing import Iterable, Optional
+
+import asyncpg
+import discord
+
+import utilities.database_utils as database_utils
+
+
+class MemberSync:
+    """
+    Keeps the 'users' table in step with the members the bot can see.
+    Gateway events only mark a member as dirty, the latest state per discord_id is kept
+    in memory and written out every 'flush_interval' seconds, so ten nickname changes
+    in a row still cost one upsert. Whole guilds are scanned in chunks when the bot
+    starts or joins a guild.
+    - db_pool: The asyncpg Pool to write to.
+    - flush_interval: Seconds between writes of pending changes.
+    - chunk_size: How many members are written per COPY when scanning a guild.
+    - delete_departed: Delete the rows of members who left their last shared guild. Only
+      right when the member cache holds every member of every guild the bot is in,
+      otherwise someone still in an uncached guild would lose their row, so they're kept.
+    """
+
+    def __init__(
+            self,
+            db_pool: asyncpg.Pool,
+            flush_interval: float = 5.0,
+            chunk_size: int = 5000,
+            delete_departed: bool = True):
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        self.delete_departed = delete_departed
+        self._pending = {} # discord_id -> username, or None to delete the row
+        self._task: Optional[asyncio.Task] = None
+        self._scanned = set() # Guild ids we've already done a full scan of
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="member-sync")
+
+    def upsert(self, member: discord.abc.User) -> None:
+        """
+        Marks a member as joined or changed, only the latest state is written.
+        """
+        self._pending[member.id] = member.name
+
+    def remove(self, member: discord.Member) -> None:
+        """
+        Marks a member as gone. The row is only deleted once the bot shares no guild with them.
+        """
+        # mutual_guilds only knows about cached members
+        if self.delete_departed and not member.mutual_guilds:
+            self._pending[member.id] = None
+
+    async def scan_guilds(self, guilds: Iterable[discord.Guild]) -> None:
+        """
+        Writes every member of every guild not scanned yet, one guild at a time.
+        """
+        for guild in guilds:
+            if guild.id in self._scanned:
+                continue
+            try:
+                counts = await self.scan_guild(guild)
+                self._scanned.add(guild.id)
+                print(f"[DB] Synced members of {guild.name}: {counts}")
+            except (OSError, asyncpg.PostgresError, discord.HTTPException) as e:
+                print(f"[DB] Failed to sync members of {guild.name}. Error: {e}")
+
+    async def scan_guild(self, guild: discord.Guild) -> dict:
+        """
+        Upserts every member of a guild in chunks.
+        Chunked guilds are read straight from the member cache through a generator,
+        others are paged in over HTTP, so the member list is never copied in full.
+        """
+        if guild.chunked:
+            members = ((member.id, member.name) for member in guild.members)
+            return await database_utils.bulk_update_users(self.db_pool, members, chunk_size=self.chunk_size)
+
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        chunk = []
+        async for member in guild.fetch_members(limit=None):
+            chunk.append((member.id, member.name))
+            if len(chunk) >= self.chunk_size:
+                self._add_counts(counts, await database_utils.bulk_update_users(self.db_pool, chunk))
+                chunk = []
+        if chunk:
+            self._add_counts(counts, await database_utils.bulk_update_users(self.db_pool, chunk))
+        return counts
+
+    async def flush(self) -> None:
+        """
+        Writes every pending change in one bulk upsert and one delete.
+        """
+        if not self._pending:
+            return
+        # Swap the dict out so events arriving mid-write land in the next batch
+        pending, self._pending = self._pending, {}
+        upserts = ((discord_id, username) for discord_id, username in pending.items() if username is not None)
+        removed = [discord_id for discord_id, username in pending.items() if username is None]
+        try:
+            await database_utils.bulk_update_users(self.db_pool, upserts, chunk_size=self.chunk_size)
+            if removed:
+                await database_utils.execute_named(self.db_pool, database_utils.DELETE_USERS, removed)
+        except (OSError, asyncpg.PostgresError) as e:
+            # Put the batch back unless newer changes for the same ids arrived meanwhile
+            for discord_id, username in pending.items():
+                self._pending.setdefault(discord_id, username)
+            print(f"[DB] Member sync flush failed, will retry. Error: {e}")
+
+    async def close(self) -> None:
+        """
+        Stops the background writer and writes whatever is still pending.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # Never let an unexpected error stop the sync, that batch is lost but later changes still go out
+                print(f"[DB] Member sync flush failed. Error: {e}")
+
+    @staticmethod
+    def _add_counts(total: dict, counts: dict) -> None:
+        for key, value in counts.items():
+            total[key] += value
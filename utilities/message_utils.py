@@ -0,0 +1,255 @@
+import asyncio
+import io
+import time
+from typing import Optional
+
+import discord
+
+# Discord rejects message content longer than this
+MESSAGE_LIMIT = 2000
+# Markdown code fence, closed at the end of a message and reopened at the start of the next
+FENCE = "```"
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Splits text into messages of at most 'limit' characters, preferring to break between
+    paragraphs, then lines, then words. A code block that has to be split is closed at
+    the end of one message and reopened (same language) at the start of the next.
+    """
+    chunks = []
+    fence = None
+    while text:
+        chunk, used, fence = take_chunk(text, limit, fence)
+        text = text[used:]
+        if chunk.strip():
+            chunks.append(chunk)
+    return chunks
+
+
+def take_chunk(text: str, limit: int = MESSAGE_LIMIT, fence: Optional[str] = None):
+    """
+    Takes the next message off the front of 'text'.
+    - fence: Opening line of the code block 'text' starts inside (e.g. '```py'), None if outside one.
+    Returns (message content, characters of 'text' it used, code block still open after them or None).
+    """
+    prefix = f"{fence}\n" if fence else ""
+    if len(prefix) > limit // 2:
+        # A fence line that long is hardly markdown, don't let it eat the message
+        prefix, fence = "", None
+    if len(prefix) + len(text) <= limit:
+        return prefix + text, len(text), _fence_after(text, fence)
+
+    room = limit - len(prefix) # Cut outside a code block
+    room_in_fence = room - len(FENCE) - 1 # Cut inside one, leaving space to close it
+    paragraph = line = line_in_fence = None
+    position, open_fence = 0, fence
+    for text_line in text.splitlines(keepends=True):
+        position += len(text_line)
+        if position > room:
+            break
+        if text_line.lstrip().startswith(FENCE):
+            open_fence = None if open_fence else text_line.strip()
+        if not text_line.endswith("\n"):
+            continue
+        if open_fence is None:
+            line = (position, None)
+            if not text_line.strip():
+                paragraph = line
+        elif position <= room_in_fence:
+            line_in_fence = (position, open_fence)
+
+    # Don't settle for a cut that leaves the message mostly empty
+    for candidate in (paragraph, line, line_in_fence):
+        if candidate is not None and candidate[0] > room // 2:
+            cut, open_fence = candidate
+            break
+    else:
+        # One long line, break it on a space, or hard if it has none
+        window = text[:room_in_fence]
+        space = window.rfind(" ")
+        cut = space + 1 if space > len(window) // 2 else len(window)
+        open_fence = _fence_after(text[:cut], fence)
+
+    chunk = prefix + text[:cut]
+    if open_fence is not None:
+        chunk = chunk.rstrip("\n") + "\n" + FENCE
+    return chunk, cut, open_fence
+
+
+def _fence_after(text: str, fence: Optional[str]) -> Optional[str]:
+    # Which code block, if any, is still open at the end of 'text'
+    for text_line in text.splitlines():
+        if text_line.lstrip().startswith(FENCE):
+            fence = None if fence else text_line.strip()
+    return fence
+
+
+async def send_long_message(
+        destination: discord.abc.Messageable,
+        text: str,
+        limit: int = MESSAGE_LIMIT,
+        file_threshold: int = 6000,
+        filename: str = "reply.md") -> list:
+    """
+    Sends text of any length: split into ordered messages (see split_message), or as a
+    file attachment when it's longer than 'file_threshold' characters. If a message is
+    rejected partway, whatever is left is attached as a file instead, so the text is
+    never lost and never has to be generated again. Returns the messages sent.
+    - destination: Anything we can .send() to (ctx, channel, user).
+    """
+    if len(text) > file_threshold:
+        return [await _send_as_file(destination, text, filename, "The reply is long, so here it is as a file.")]
+    sent = []
+    chunks = split_message(text, limit)
+    for index, chunk in enumerate(chunks):
+        try:
+            # One at a time, Discord only keeps the order of sends that don't overlap
+            sent.append(await destination.send(chunk))
+        except discord.HTTPException:
+            rest = "".join(chunks[index:])
+            sent.append(await _send_as_file(destination, rest, filename,
+                                            "Couldn't send the rest of the reply as messages, here it is as a file."))
+            break
+    return sent
+
+
+async def _send_as_file(destination: discord.abc.Messageable, text: str, filename: str, note: str):
+    return await destination.send(note, file=discord.File(io.BytesIO(text.encode("utf-8")), filename=filename))
+
+
+class StreamingMessage:
+    """
+    Progressively edits a Discord message as streamed text arrives.
+    Edits are coalesced so we send at most one every 'min_interval' seconds no matter
+    how fast tokens come in, which keeps us well under Discord's per-channel edit limits.
+    When the text outgrows one message, the full part is frozen and a new message is started.
+    - destination: Anything we can .send() to (ctx, channel, user).
+    - min_interval: Minimum seconds between two edits of the live message.
+    - limit: Max characters per message.
+    """
+
+    def __init__(self, destination: discord.abc.Messageable, min_interval: float = 1.0, limit: int = MESSAGE_LIMIT):
+        self.destination = destination
+        self.min_interval = min_interval
+        self.limit = limit
+        self.messages = [] # Every message we've sent so far, in order
+        self.text = "" # Everything received so far
+        self._offset = 0 # Where the live message starts inside self.text
+        self._fence = None # Code block the live message reopens, when the last full one ended inside it
+        self._shown = "" # What the live message currently displays
+        self._dirty = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._editor: Optional[asyncio.Task] = None
+        self._last_edit = 0.0
+
+    @property
+    def started(self) -> bool:
+        return bool(self.messages)
+
+    async def append(self, delta: str) -> None:
+        """
+        Adds streamed text. The first chunk is sent right away (time to first token),
+        later chunks are picked up by the background editor.
+        """
+        if not delta:
+            return
+        self.text += delta
+        if not self.messages:
+            await self._render()
+            self._editor = asyncio.create_task(self._edit_loop())
+        else:
+            self._dirty.set()
+
+    async def finish(self) -> None:
+        """
+        Stops the background editor and makes sure the final text is shown.
+        """
+        if self._editor is not None:
+            self._editor.cancel()
+            try:
+                await self._editor
+            except asyncio.CancelledError:
+                pass
+            self._editor = None
+        await self._render()
+
+    async def _edit_loop(self) -> None:
+        while True:
+            await self._dirty.wait()
+            # Wait out the rest of the interval so every token that lands meanwhile shares one edit
+            wait = self.min_interval - (time.monotonic() - self._last_edit)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._dirty.clear()
+            await self._render()
+
+    async def _render(self) -> None:
+        async with self._lock:
+            # Freeze full messages and roll over until the remainder fits in one message
+            while True:
+                content, used, fence = take_chunk(self.text[self._offset:], self.limit, self._fence)
+                if used == len(self.text) - self._offset:
+                    break
+                await self._show(content)
+                self._offset += used
+                self._fence = fence
+                self.messages.append(None) # Placeholder, the next _show sends a new message
+            if self._offset < len(self.text):
+                await self._show(content)
+
+    async def _show(self, content: str) -> None:
+        if not content.strip():
+            return
+        if not self.messages or self.messages[-1] is None:
+            if self.messages:
+                self.messages.pop()
+            self.messages.append(await self.destination.send(content))
+            self._shown = content
+        elif content != self._shown:
+            await self.messages[-1].edit(content=content)
+            self._shown = content
+        self._last_edit = time.monotonic()
+
+
+class QueuePositionMessage:
+    """
+    Keeps a user informed of their place in a queue with a single message.
+    update() is safe to call from sync code, stale positions are skipped.
+    """
+
+    def __init__(self, destination: discord.abc.Messageable, template: str = "You're **#{position}** in line, hang tight."):
+        self.destination = destination
+        self.template = template
+        self.message: Optional[discord.Message] = None
+        self.position: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    def update(self, position: int) -> None:
+        self.position = position
+        asyncio.create_task(self._render(position))
+
+    async def _render(self, position: int) -> None:
+        async with self._lock:
+            # A newer position arrived while we waited on the lock
+            if position != self.position:
+                return
+            try:
+                if position == 0:
+                    # Our turn, the notice has done its job
+                    if self.message is not None:
+                        await self.message.delete()
+                        self.message = None
+                elif self.message is None:
+                    self.message = await self.destination.send(self.template.format(position=position))
+                else:
+                    await self.message.edit(content=self.template.format(position=position))
+            except discord.HTTPException:
+                pass
+
+    async def close(self) -> None:
+        """
+        Removes the notice if it's still showing.
+        """
+        self.position = 0
+        await self._render(0)
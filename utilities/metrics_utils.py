@@ -0,0 +1,265 @@
+import bisect
+import math
+import time
+from typing import Callable, Optional, Sequence
+
+from aiohttp import web
+
+# Seconds, from a fast cache hit up to a slow LLM generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _Child:
+    """
+    One labelled series of a metric. Callers on a hot path should keep the child
+    returned by labels() around instead of looking it up on every call.
+    """
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Reads the value from 'function' at scrape time instead, for things we can
+        already count elsewhere (queue lengths, pool sizes, bot.latency).
+        """
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return math.nan
+        return self.value
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds: tuple):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        # Counts are stored per bucket, made cumulative only when rendered
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        """
+        Context manager that observes how long its block took.
+        """
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {} # label values tuple -> child
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values):
+        """
+        Returns the series for these label values, created on first use.
+        Values are kept as given (ints, enums, ...) and only turned into text when scraped.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return _Child()
+
+    def _label_text(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{self._label_text(values)} {_format_value(child.get())}")
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up. Without labels, inc() can be called on the metric itself.
+    """
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, set directly or read from a function at scrape time.
+    """
+    type_name = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+
+class Histogram(_Metric):
+    """
+    Counts observations (usually seconds) into fixed buckets, plus their sum and count.
+    """
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry=None):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (math.inf,), child.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._label_text(values, f'le={_format_bound(bound)}')} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds every metric and renders them in the Prometheus text exposition format.
+    Metrics are meant to be updated from the event loop thread, where no locking is needed.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name!r} is already registered.")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (math.inf, -math.inf):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_bound(bound: float) -> str:
+    return '"+Inf"' if bound == math.inf else f'"{bound}"'
+
+
+REGISTRY = MetricsRegistry()
+
+# ----------------------------------------------------------------------------
+# The bot's metrics
+# ----------------------------------------------------------------------------
+
+COMMAND_LATENCY = Histogram("discord_command_duration_seconds",
+                            "Time from invoking a command until it returned.", ("cog", "command"))
+COMMANDS = Counter("discord_commands_total", "Commands invoked, by outcome.", ("cog", "command", "status"))
+EVENT_DURATION = Histogram("discord_event_handler_duration_seconds",
+                           "Time spent in each gateway event handler.", ("event", "handler"))
+EXTENSION_LOAD_TIME = Gauge("discord_extension_load_seconds", "How long each cog took to load or reload.", ("extension",))
+GATEWAY_LATENCY = Gauge("discord_gateway_latency_seconds", "Heartbeat latency to the Discord gateway.", ("shard",))
+
+DB_ACQUIRE_WAIT = Histogram("db_pool_acquire_seconds", "Time spent waiting for a pooled DB connection.")
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "Time spent running DB queries.", ("query",))
+DB_POOL_SIZE = Gauge("db_pool_connections", "Open DB pool connections, by state.", ("state",))
+
+API_REQUEST_DURATION = Histogram("agent_api_request_duration_seconds",
+                                 "Time for a whole agent API request, streamed ones included.", ("mode",))
+API_FIRST_TOKEN = Histogram("agent_api_first_token_seconds", "Time until a streamed reply's first token.")
+API_RESPONSES = Counter("agent_api_responses_total",
+                        "Agent API responses by HTTP status ('error' when no response came).", ("mode", "status"))
+API_RETRIES = Counter("agent_api_retries_total", "Agent API attempts retried after a failure.")
+API_CIRCUIT_STATE = Gauge("agent_api_circuit_state", "Agent API circuit breaker: 0 closed, 1 half open, 2 open.")
+
+QUEUE_DEPTH = Gauge("batch_queue_depth", "Items waiting in a batch queue.", ("queue",))
+QUEUE_ITEMS = Counter("batch_queue_items_total", "Items leaving a batch queue, by outcome.", ("queue", "outcome"))
+LOG_SUPPRESSED = Counter("log_events_suppressed_total",
+                         "Events not logged by the sampler, by why ('sampled', 'user', 'channel').", ("event", "reason"))
+
+
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9108,
+                               registry: MetricsRegistry = REGISTRY) -> web.AppRunner:
+    """
+    Serves the registry on http://host:port/metrics and returns the runner (call cleanup() to stop it).
+    Binds to localhost by default, put a scraper or proxy next to the bot rather than exposing it.
+    """
+
+    async def metrics(request):
+        return web.Response(body=registry.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"[METRICS] Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,330 @@
+import asyncio
+import datetime
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+import discord
+
+import utilities.database_utils as database_utils
+
+# Discord only bulk deletes messages younger than 14 days, keep a margin for slow scans
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=10)
+# Discord caps one bulk delete at 100 messages
+BULK_DELETE_BATCH = 100
+
+
+class PurgeJob:
+    """
+    Deletes messages from a channel as a cancellable background job.
+    History is scanned newest first. Messages younger than 14 days are removed with bulk
+    deletes of up to 100, older ones are deleted one by one (Discord has no bulk path for
+    them) at a steady pace. Each request goes through discord.py's HTTP client, which waits
+    out the per-route rate limit buckets for us, so the job never hammers into 429s.
+    - channel: The text channel to purge.
+    - check: Optional predicate, only messages it returns True for are deleted.
+    - before / after: Optional bounds passed straight to channel.history.
+    - limit: Max messages to scan, None for the whole history.
+    - skip_ids: Message ids to never delete (e.g. our own status message).
+    - keep_pinned: Leave pinned messages alone.
+    - old_delay: Extra seconds to wait between single deletes of old messages.
+    - progress: Optional async callback, called with the job every 'report_interval' seconds.
+    """
+
+    def __init__(
+            self,
+            channel: discord.TextChannel,
+            check: Optional[Callable[[discord.Message], bool]] = None,
+            before=None,
+            after=None,
+            limit: Optional[int] = None,
+            skip_ids: Iterable[int] = (),
+            keep_pinned: bool = False,
+            old_delay: float = 0.0,
+            progress: Optional[Callable[["PurgeJob"], Awaitable[None]]] = None,
+            report_interval: float = 5.0):
+        self.channel = channel
+        self.check = check
+        self.before = before
+        self.after = after
+        self.limit = limit
+        self.skip_ids = set(skip_ids)
+        self.keep_pinned = keep_pinned
+        self.old_delay = old_delay
+        self.progress = progress
+        self.report_interval = report_interval
+        self.scanned = 0
+        self.deleted_bulk = 0
+        self.deleted_old = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+        self.task: Optional[asyncio.Task] = None
+        self._last_report = 0.0
+
+    @property
+    def deleted(self) -> int:
+        return self.deleted_bulk + self.deleted_old
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run(), name=f"purge-{self.channel.id}")
+        return self.task
+
+    def cancel(self) -> None:
+        if self.running:
+            self.task.cancel()
+
+    def summary(self) -> str:
+        return (f"Scanned {self.scanned} messages, deleted {self.deleted} "
+                f"({self.deleted_bulk} in bulk, {self.deleted_old} older than 14 days)"
+                f"{f', {self.failed} failed' if self.failed else ''} in {self.elapsed:.0f}s.")
+
+    async def run(self) -> None:
+        self.started_at = time.monotonic()
+        bulk = []
+        try:
+            # discord.py flips to oldest first whenever 'after' is set, the age split below needs newest first
+            async for message in self.channel.history(limit=self.limit, before=self.before, after=self.after,
+                                                      oldest_first=False):
+                self.scanned += 1
+                if message.id in self.skip_ids or (self.keep_pinned and message.pinned):
+                    continue
+                if self.check is not None and not self.check(message):
+                    continue
+                if not bulk:
+                    # Taken again for every batch, on a long purge messages age past 14 days while we scan
+                    cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+                if message.created_at > cutoff:
+                    bulk.append(message)
+                    if len(bulk) >= BULK_DELETE_BATCH:
+                        await self._delete_bulk(bulk)
+                        bulk = []
+                else:
+                    # History is newest first, so everything from here on is too old to bulk delete
+                    if bulk:
+                        await self._delete_bulk(bulk)
+                        bulk = []
+                    await self._delete_old(message)
+                await self._report()
+            if bulk:
+                await self._delete_bulk(bulk)
+        finally:
+            self.finished_at = time.monotonic()
+
+    async def _delete_bulk(self, messages: list) -> None:
+        try:
+            await self.channel.delete_messages(messages)
+            self.deleted_bulk += len(messages)
+        except discord.NotFound:
+            # Someone else deleted one of them first, fall back to one by one for this batch
+            for message in messages:
+                await self._delete_old(message, delay=0.0)
+        except discord.HTTPException as e:
+            if e.status != 400:
+                self.failed += len(messages)
+                return
+            # Rejected as a whole, usually because one of them aged past 14 days, so go one by one
+            for message in messages:
+                await self._delete_old(message)
+
+    async def _delete_old(self, message: discord.Message, delay: Optional[float] = None) -> None:
+        try:
+            await message.delete()
+            self.deleted_old += 1
+        except discord.NotFound:
+            pass
+        except discord.HTTPException:
+            self.failed += 1
+        delay = self.old_delay if delay is None else delay
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def _report(self) -> None:
+        now = time.monotonic()
+        if self.progress is not None and now - self._last_report >= self.report_interval:
+            self._last_report = now
+            try:
+                await self.progress(self)
+            except discord.HTTPException:
+                pass
+
+
+async def clone_and_delete(channel: discord.TextChannel, reason: Optional[str] = None) -> discord.TextChannel:
+    """
+    Wipes a channel completely by recreating it with the same settings and deleting the original.
+    Two API calls instead of one per message, but pins, webhooks and the channel id are lost.
+    """
+    new_channel = await channel.clone(reason=reason)
+    await new_channel.edit(position=channel.position, reason=reason)
+    await channel.delete(reason=reason)
+    return new_channel
+
+
+LOAD_CHECKPOINT = database_utils.QUERIES.register("load_dm_cleanup_checkpoint", """
+    SELECT start_id, cursor_id FROM dm_cleanup_checkpoints WHERE channel_id = $1
+""")
+
+SAVE_CHECKPOINT = database_utils.QUERIES.register("save_dm_cleanup_checkpoint", """
+    INSERT INTO dm_cleanup_checkpoints (channel_id, start_id, cursor_id, updated_at)
+    VALUES ($1, $2, $3, NOW())
+    ON CONFLICT (channel_id)
+    DO UPDATE SET start_id = EXCLUDED.start_id, cursor_id = EXCLUDED.cursor_id, updated_at = NOW()
+""")
+
+DELETE_CHECKPOINT = database_utils.QUERIES.register("delete_dm_cleanup_checkpoint", """
+    DELETE FROM dm_cleanup_checkpoints WHERE channel_id = $1
+""")
+
+CHECKPOINTED_CHANNELS = database_utils.QUERIES.register("dm_cleanup_checkpoint_channels", """
+    SELECT channel_id FROM dm_cleanup_checkpoints
+""")
+
+
+class CheckpointStore:
+    """
+    Remembers how far a cleanup job got in each channel, so a restart can pick it back up.
+    Uses the dm_cleanup_checkpoints table when a db_pool is given, memory otherwise.
+    """
+
+    def __init__(self, db_pool=None):
+        self.db_pool = db_pool
+        self._memory = {} # channel id -> (start_id, cursor_id)
+
+    async def get(self, channel_id: int) -> Optional[tuple]:
+        if self.db_pool is None:
+            return self._memory.get(channel_id)
+        row = await database_utils.fetch_one_named(self.db_pool, LOAD_CHECKPOINT, channel_id)
+        return (row["start_id"], row["cursor_id"]) if row else None
+
+    async def set(self, channel_id: int, start_id: int, cursor_id: Optional[int]) -> None:
+        if self.db_pool is None:
+            self._memory[channel_id] = (start_id, cursor_id)
+            return
+        await database_utils.execute_named(self.db_pool, SAVE_CHECKPOINT, channel_id, start_id, cursor_id)
+
+    async def delete(self, channel_id: int) -> None:
+        if self.db_pool is None:
+            self._memory.pop(channel_id, None)
+            return
+        await database_utils.execute_named(self.db_pool, DELETE_CHECKPOINT, channel_id)
+
+    async def channel_ids(self) -> list:
+        if self.db_pool is None:
+            return list(self._memory)
+        rows = await database_utils.fetch_all_named(self.db_pool, CHECKPOINTED_CHANNELS)
+        return [row["channel_id"] for row in rows]
+
+
+class DMCleanupJob:
+    """
+    Deletes the bot's own messages from a DM channel as a resumable background job.
+    History is fetched a page at a time, only bot-authored messages are deleted, with up to
+    'concurrency' deletes in flight so we keep the per-channel delete bucket busy without
+    tripping 429s (discord.py waits out the bucket when it runs dry). After every page the
+    position is saved to the CheckpointStore, a restarted job resumes from there.
+    - channel: The DM channel to clean.
+    - bot_user: The bot's user, only its messages are deleted.
+    - checkpoints: Where progress is saved.
+    - concurrency: Max deletes in flight at once.
+    - page_size: Messages fetched per history request (Discord caps this at 100).
+    """
+
+    def __init__(
+            self,
+            channel: discord.DMChannel,
+            bot_user: discord.ClientUser,
+            checkpoints: CheckpointStore,
+            concurrency: int = 3,
+            page_size: int = 100):
+        self.channel = channel
+        self.bot_user = bot_user
+        self.checkpoints = checkpoints
+        self.concurrency = max(1, concurrency)
+        self.page_size = max(1, min(page_size, 100))
+        self.scanned = 0
+        self.deleted = 0
+        self.failed = 0
+        self.resumed = False
+        self.started_at = None
+        self.finished_at = None
+        self.task: Optional[asyncio.Task] = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run(), name=f"dm-cleanup-{self.channel.id}")
+        return self.task
+
+    def cancel(self) -> None:
+        if self.running:
+            self.task.cancel()
+
+    def summary(self) -> str:
+        return (f"Scanned {self.scanned} messages, deleted {self.deleted}"
+                f"{f', {self.failed} failed' if self.failed else ''} in {self.elapsed:.0f}s"
+                f"{' (resumed)' if self.resumed else ''}.")
+
+    async def run(self) -> None:
+        self.started_at = time.monotonic()
+        try:
+            checkpoint = await self.checkpoints.get(self.channel.id)
+            if checkpoint is not None:
+                self.resumed = True
+                start_id, cursor_id = checkpoint
+                # Anything sent since the interrupted run started, then carry on below the cursor
+                await self._clean(after=discord.Object(id=start_id))
+            else:
+                newest = [message async for message in self.channel.history(limit=1)]
+                if not newest:
+                    return
+                start_id, cursor_id = newest[0].id, newest[0].id + 1
+                await self.checkpoints.set(self.channel.id, start_id, cursor_id)
+            await self._clean(before=discord.Object(id=cursor_id), start_id=start_id)
+            await self.checkpoints.delete(self.channel.id)
+        finally:
+            self.finished_at = time.monotonic()
+
+    async def _clean(self, before=None, after=None, start_id: Optional[int] = None) -> None:
+        while True:
+            page = [message async for message in self.channel.history(
+                limit=self.page_size, before=before, after=after, oldest_first=after is not None)]
+            if not page:
+                return
+            self.scanned += len(page)
+            await asyncio.gather(*(self._delete(message) for message in page
+                                   if message.author.id == self.bot_user.id))
+            if after is not None:
+                after = page[-1]
+            else:
+                before = page[-1]
+                await self.checkpoints.set(self.channel.id, start_id, before.id)
+            if len(page) < self.page_size:
+                return
+
+    async def _delete(self, message: discord.Message) -> None:
+        async with self._semaphore:
+            try:
+                await message.delete()
+                self.deleted += 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                self.failed += 1
@@ -0,0 +1,303 @@
+import asyncio
+import math
+import random
+import time
+from typing import Awaitable, Callable, Optional, Tuple, Type
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendUnavailable(Exception):
+    """
+    Raised by a request attempt when the backend answered in a way worth retrying
+    (5xx, overloaded), counted as a failure by the circuit breaker.
+    - result: What to hand back to the caller if no retry succeeds.
+    """
+
+    def __init__(self, message: str, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a backend the circuit breaker considers down.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable, try again in {math.ceil(retry_after) or 1}s.")
+        self.retry_after = retry_after
+
+
+class RetryBudget:
+    """
+    Caps retries across every caller to a fraction of recent requests, so when a backend
+    struggles we add at most 'ratio' extra load instead of multiplying it.
+    Counts are kept per second in a ring of 'window' slots, no per-request state.
+    - ratio: Retries allowed per request made in the window.
+    - min_per_second: Retries always allowed, so a quiet bot can still retry.
+    - window: Seconds of history the budget looks at.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 0.5, window: int = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = max(1, window)
+        self._seconds = [0] * self.window # Which second each slot holds
+        self._requests = [0] * self.window
+        self._retries = [0] * self.window
+        self.exhausted = 0 # Retries refused, for the health report
+
+    def record_request(self) -> None:
+        self._requests[self._slot()] += 1
+
+    def try_spend(self) -> bool:
+        """
+        Takes one retry from the budget, False if it's used up.
+        """
+        slot = self._slot()
+        requests, retries = self._totals()
+        if retries >= self.min_per_second * self.window + self.ratio * requests:
+            self.exhausted += 1
+            return False
+        self._retries[slot] += 1
+        return True
+
+    def stats(self) -> dict:
+        requests, retries = self._totals()
+        return {"requests": requests, "retries": retries, "refused": self.exhausted}
+
+    def _slot(self) -> int:
+        second = int(time.monotonic())
+        slot = second % self.window
+        if self._seconds[slot] != second:
+            # Slot last used a full window ago, start it over
+            self._seconds[slot] = second
+            self._requests[slot] = 0
+            self._retries[slot] = 0
+        return slot
+
+    def _totals(self) -> Tuple[int, int]:
+        oldest = int(time.monotonic()) - self.window
+        requests = retries = 0
+        for second, request_count, retry_count in zip(self._seconds, self._requests, self._retries):
+            if second > oldest:
+                requests += request_count
+                retries += retry_count
+        return requests, retries
+
+
+class CircuitBreaker:
+    """
+    Stops calling a backend after 'failure_threshold' failures in a row. While open every
+    call fails straight away, and a background task probes the backend (every 'reset_timeout'
+    seconds, doubling up to 'max_reset_timeout') until it answers, which closes the circuit.
+    Without a probe, the circuit goes half open after the timeout and lets one real request
+    through as the test.
+    - probe: Optional async callable returning True when the backend looks healthy.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = 5,
+            reset_timeout: float = 15.0,
+            max_reset_timeout: float = 300.0,
+            probe: Optional[Callable[[], Awaitable[bool]]] = None):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0 # In a row
+        self.last_error: Optional[str] = None
+        self.opened_at: Optional[float] = None
+        self.last_probe: Optional[Tuple[float, bool]] = None # (monotonic time, healthy)
+        self._timeout = reset_timeout # Current wait before the next probe or trial
+        self._trial_running = False
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def check(self) -> None:
+        """
+        Raises CircuitOpenError if calls shouldn't go through right now.
+        """
+        if self.state == CLOSED:
+            return
+        waited = time.monotonic() - self.opened_at
+        if self.state == OPEN and self.probe is None and waited >= self._timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._trial_running:
+            # Let exactly one request find out whether the backend is back
+            self._trial_running = True
+            return
+        raise CircuitOpenError(self.name, max(0.0, self._timeout - waited))
+
+    @property
+    def retry_after(self) -> Optional[float]:
+        """
+        Seconds until calls may go through again, None if they would now.
+        For callers that want to skip queueing for a backend that's down.
+        """
+        if self.state != OPEN:
+            return None
+        remaining = self._timeout - (time.monotonic() - self.opened_at)
+        if self.probe is None and remaining <= 0:
+            # check() would let a trial through
+            return None
+        return max(0.0, remaining)
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._trial_running = False
+        if self.state != CLOSED:
+            self._close()
+
+    def record_failure(self, error: str) -> None:
+        self.failures += 1
+        self.last_error = error
+        self._trial_running = False
+        if self.state == HALF_OPEN:
+            # The trial failed, wait longer before the next one
+            self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+            self._open()
+        elif self.state == CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def release_trial(self) -> None:
+        """
+        For a trial request that ended without telling us anything (cancelled, or an error
+        that isn't the backend's), so the next request can be the trial instead.
+        """
+        self._trial_running = False
+
+    def status(self) -> dict:
+        status = {"state": self.state, "failures_in_a_row": self.failures, "last_error": self.last_error}
+        if self.state != CLOSED:
+            status["open_for_s"] = round(time.monotonic() - self.opened_at, 1)
+        if self.last_probe is not None:
+            probed_at, healthy = self.last_probe
+            status["last_probe"] = f"{'healthy' if healthy else 'down'} {time.monotonic() - probed_at:.0f}s ago"
+        return status
+
+    def close(self) -> None:
+        """
+        Stops the background probe, for shutdown.
+        """
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    def _open(self) -> None:
+        if self.state != OPEN:
+            print(f"[CIRCUIT] {self.name} is failing ({self.last_error}), failing fast for now.")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        if self.probe is not None and (self._probe_task is None or self._probe_task.done()):
+            self._probe_task = asyncio.create_task(self._probe_loop(), name=f"{self.name}-probe")
+
+    def _close(self) -> None:
+        print(f"[CIRCUIT] {self.name} is healthy again.")
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._timeout = self.reset_timeout
+
+    async def _probe_loop(self) -> None:
+        while self.state != CLOSED:
+            # Jittered, so several processes don't probe in lockstep
+            await asyncio.sleep(self._timeout * random.uniform(0.8, 1.2))
+            try:
+                healthy = bool(await self.probe())
+            except Exception:
+                healthy = False
+            self.last_probe = (time.monotonic(), healthy)
+            if healthy:
+                self._close()
+                return
+            self.opened_at = time.monotonic()
+            self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+
+
+class ResilientBackend:
+    """
+    Wraps calls to a remote backend with a deadline, jittered retries drawn from a shared
+    RetryBudget, and a CircuitBreaker. One instance per backend, shared by every caller.
+    - deadline: Seconds a call may take in total, retries and backoff included.
+    - max_attempts: Attempts per call, the first one included.
+    - backoff: Base delay, attempt n waits a random time up to backoff * 2**n ("full jitter").
+    - max_backoff: Cap on a single wait.
+    - retry_on: Exception types worth another attempt (BackendUnavailable always is).
+    """
+
+    def __init__(
+            self,
+            name: str,
+            breaker: CircuitBreaker,
+            budget: RetryBudget,
+            deadline: float = 120.0,
+            max_attempts: int = 3,
+            backoff: float = 0.5,
+            max_backoff: float = 5.0,
+            retry_on: Tuple[Type[BaseException], ...] = (OSError, asyncio.TimeoutError)):
+        self.name = name
+        self.breaker = breaker
+        self.budget = budget
+        self.deadline = deadline
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = (BackendUnavailable,) + tuple(retry_on)
+        self.retries = 0
+
+    async def call(self, attempt: Callable[[], Awaitable], deadline: Optional[float] = None):
+        """
+        Runs 'attempt' until it returns, retrying failures listed in 'retry_on' while the
+        deadline, the attempt limit and the retry budget allow.
+        Raises CircuitOpenError when the breaker is open, TimeoutError past the deadline (not
+        counted as a breaker failure), otherwise the last attempt's exception.
+        """
+        self.breaker.check()
+        self.budget.record_request()
+        deadline = self.deadline if deadline is None else deadline
+        expires_at = time.monotonic() + deadline
+        attempt_number = 0
+        while True:
+            deadline_timeout = asyncio.timeout(max(0.0, expires_at - time.monotonic()))
+            try:
+                async with deadline_timeout:
+                    result = await attempt()
+            except self.retry_on as e:
+                if deadline_timeout.expired():
+                    # Our own deadline ran out, the backend is slow rather than down and there's no time to retry
+                    self.breaker.release_trial()
+                    raise
+                self.breaker.record_failure(_describe(e))
+                attempt_number += 1
+                wait = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt_number))
+                if (attempt_number >= self.max_attempts
+                        or time.monotonic() + wait >= expires_at
+                        or self.breaker.state != CLOSED
+                        or not self.budget.try_spend()):
+                    raise
+                self.retries += 1
+                await asyncio.sleep(wait)
+                continue
+            except BaseException:
+                self.breaker.release_trial()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def status(self) -> dict:
+        return {**self.breaker.status(), "retries": self.retries, "budget": self.budget.stats(),
+                "deadline_s": self.deadline}
+
+
+def _describe(error: BaseException) -> str:
+    if isinstance(error, asyncio.TimeoutError):
+        return "timed out"
+    return str(error) or type(error).__name__
@@ -0,0 +1,148 @@
+import random
+import time
+from typing import Optional
+
+from utilities.metrics_utils import LOG_SUPPRESSED
+
+# Settings LogSampler.configure() accepts besides per event sample rates
+LIMIT_SETTINGS = ("user_rate", "user_burst", "channel_rate", "channel_burst", "summary_interval")
+
+
+def parse_sample_rates(text: Optional[str]) -> dict:
+    """
+    Parses "message=0.5,reaction_add=0.1" into {"message": 0.5, "reaction_add": 0.1}.
+    Malformed pairs are reported and skipped.
+    """
+    rates = {}
+    for pair in (text or "").split(","):
+        if not pair.strip():
+            continue
+        event, _, value = pair.partition("=")
+        try:
+            rates[event.strip()] = min(1.0, max(0.0, float(value)))
+        except ValueError:
+            print(f"[CONFIG] Invalid sample rate {pair.strip()!r}, expected event=0..1")
+    return rates
+
+
+class LogSampler:
+    """
+    Decides which high volume events get logged, so a raid or spam wave can't flood
+    the logs and the database. An event is logged when:
+      1. it passes its sample rate (1.0 = every event, 0.1 = one in ten, 0 = none), and
+      2. its user and its channel both still have a token in their bucket. Buckets hold
+         up to 'burst' tokens and refill at 'rate' tokens per second (0 = no limit).
+    Events stopped by a bucket are counted per user/channel and handed out by
+    drain_summaries(), so the logs still say "N messages from X suppressed".
+    Everything runs on the event loop and costs a couple of dict lookups per event.
+    - sample_rates: Event name -> fraction of events to keep, unlisted events keep all.
+    - user_rate / user_burst: Token bucket per user id.
+    - channel_rate / channel_burst: Token bucket per channel id.
+    - summary_interval: Seconds between suppression summaries.
+    """
+
+    def __init__(
+            self,
+            sample_rates: Optional[dict] = None,
+            user_rate: float = 2.0,
+            user_burst: float = 10.0,
+            channel_rate: float = 20.0,
+            channel_burst: float = 50.0,
+            summary_interval: float = 10.0):
+        self.sample_rates = dict(sample_rates or {})
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.summary_interval = summary_interval
+        self._user_buckets = {} # user id -> [tokens, last refill]
+        self._channel_buckets = {} # channel id -> [tokens, last refill]
+        self._suppressed = {} # (event, "user"/"channel", id) -> events dropped since the last summary
+        self._sampled_out = {} # event -> events dropped by the sample rate since the last summary
+
+    def allow(self, event: str, user_id: Optional[int] = None, channel_id: Optional[int] = None) -> bool:
+        """
+        Returns True if this event should be logged, counting it as suppressed otherwise.
+        """
+        rate = self.sample_rates.get(event, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self._sampled_out[event] = self._sampled_out.get(event, 0) + 1
+            LOG_SUPPRESSED.labels(event, "sampled").inc()
+            return False
+        now = time.monotonic()
+        # Check both before taking from either, a user limited in one channel shouldn't drain it
+        user_ok = user_id is None or self._has_token(self._user_buckets, user_id, self.user_rate,
+                                                     self.user_burst, now)
+        channel_ok = channel_id is None or self._has_token(self._channel_buckets, channel_id, self.channel_rate,
+                                                           self.channel_burst, now)
+        if user_ok and channel_ok:
+            if user_id is not None and self.user_rate > 0:
+                self._user_buckets[user_id][0] -= 1.0
+            if channel_id is not None and self.channel_rate > 0:
+                self._channel_buckets[channel_id][0] -= 1.0
+            return True
+        key = (event, "user", user_id) if not user_ok else (event, "channel", channel_id)
+        self._suppressed[key] = self._suppressed.get(key, 0) + 1
+        LOG_SUPPRESSED.labels(event, key[1]).inc()
+        return False
+
+    def drain_summaries(self) -> list:
+        """
+        Returns what was suppressed since the last call as (event, scope, id, count) tuples,
+        scope being 'user', 'channel' or 'sampled' (id None), and resets the counts.
+        Also forgets buckets that have refilled, so idle users don't pile up in memory.
+        """
+        summaries = [(event, scope, key_id, count) for (event, scope, key_id), count in self._suppressed.items()]
+        summaries.extend((event, "sampled", None, count) for event, count in self._sampled_out.items())
+        self._suppressed.clear()
+        self._sampled_out.clear()
+        now = time.monotonic()
+        self._prune(self._user_buckets, self.user_rate, self.user_burst, now)
+        self._prune(self._channel_buckets, self.channel_rate, self.channel_burst, now)
+        return summaries
+
+    def configure(self, name: str, value: float) -> None:
+        """
+        Changes one setting at runtime: a LIMIT_SETTINGS name, or an event name to set its sample rate.
+        Raises ValueError for values out of range.
+        """
+        if name in LIMIT_SETTINGS:
+            if value < 0 or (name == "summary_interval" and value < 1):
+                raise ValueError(f"{name} can't be {value}.")
+            setattr(self, name, value)
+            # Tokens above the new burst would let one last flood through
+            if name == "user_burst":
+                self._user_buckets.clear()
+            elif name == "channel_burst":
+                self._channel_buckets.clear()
+        else:
+            if not 0.0 <= value <= 1.0:
+                raise ValueError("Sample rates go from 0 to 1.")
+            self.sample_rates[name] = value
+
+    def settings(self) -> dict:
+        """
+        The current settings, sample rates included, e.g. for an admin command to show.
+        """
+        return {**{name: getattr(self, name) for name in LIMIT_SETTINGS}, "sample_rates": dict(self.sample_rates)}
+
+    @staticmethod
+    def _has_token(buckets: dict, key: int, rate: float, burst: float, now: float) -> bool:
+        if rate <= 0:
+            return True
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [burst, now]
+        else:
+            # Refill lazily for the time since the last event, no timers per bucket
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket[0] >= 1.0
+
+    @staticmethod
+    def _prune(buckets: dict, rate: float, burst: float, now: float) -> None:
+        if rate <= 0:
+            buckets.clear()
+            return
+        for key in [key for key, (tokens, updated) in buckets.items() if tokens + (now - updated) * rate >= burst]:
+            del buckets[key]
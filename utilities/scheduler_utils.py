@@ -0,0 +1,221 @@
+import asyncio
+import collections
+import time
+from typing import Awaitable, Callable, Hashable, Optional
+
+
+class SchedulerError(Exception):
+    """
+    Base class for jobs the scheduler refused or gave up on.
+    """
+
+
+class ShedError(SchedulerError):
+    """
+    Raised when a job is dropped because the queue is full or it waited past its deadline.
+    """
+
+
+class SupersededError(SchedulerError):
+    """
+    Raised for a user's earlier job when they submit a new one.
+    """
+
+
+class _Job:
+    __slots__ = ("guild_key", "user_key", "factory", "future", "deadline",
+                 "on_position", "position", "task", "timer")
+
+    def __init__(self, guild_key, user_key, factory, future, deadline, on_position):
+        self.guild_key = guild_key
+        self.user_key = user_key
+        self.factory = factory
+        self.future = future
+        self.deadline = deadline
+        self.on_position = on_position
+        self.position = None
+        self.task = None
+        self.timer = None
+
+
+class FairScheduler:
+    """
+    Runs at most 'max_in_flight' jobs at once and queues the rest fairly.
+    Guilds take turns, and inside a guild users take turns, so one busy server or one
+    spammy user can't starve everyone else. Each user has at most one live job: submitting
+    again supersedes (cancels) the previous one, queued or running.
+    - max_in_flight: How many jobs may run upstream at the same time.
+    - max_wait: Seconds a job may wait in the queue before it is shed.
+    - max_queue: How many jobs may wait before new ones are shed immediately.
+    """
+
+    def __init__(self, max_in_flight: int = 2, max_wait: float = 120.0, max_queue: int = 100):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.running = 0
+        self.queued = 0
+        # Counters for anyone who wants to keep an eye on the queue
+        self.completed = 0
+        self.shed = 0
+        self.superseded = 0
+        # guild -> (user -> deque of jobs), both in round robin order
+        self._queues = collections.OrderedDict()
+        self._live = {} # (guild, user) -> that user's current job
+
+    async def submit(
+            self,
+            user_key: Hashable,
+            guild_key: Hashable,
+            factory: Callable[[], Awaitable],
+            on_position: Optional[Callable[[int], None]] = None):
+        """
+        Queues 'factory' and returns its result once it has run.
+        'on_position' is called with the job's place in line whenever it changes,
+        0 means it has started running.
+        """
+        previous = self._live.get((guild_key, user_key))
+        if previous is not None:
+            self._supersede(previous)
+
+        if self.queued >= self.max_queue and self.running >= self.max_in_flight:
+            self.shed += 1
+            raise ShedError("The queue is full.")
+
+        loop = asyncio.get_running_loop()
+        job = _Job(guild_key, user_key, factory, loop.create_future(),
+                   time.monotonic() + self.max_wait, on_position)
+        self._live[(guild_key, user_key)] = job
+        self._queues.setdefault(guild_key, collections.OrderedDict()) \
+            .setdefault(user_key, collections.deque()).append(job)
+        self.queued += 1
+        job.timer = loop.call_later(self.max_wait, self._expire, job)
+        self._dispatch()
+
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            # The caller went away, don't keep its job around
+            if not job.future.done():
+                self._supersede(job)
+            raise
+
+    def positions(self) -> list:
+        """
+        Returns the queued jobs in the order they'll be started.
+        """
+        # Copy the round robin state and play it forward without touching the real queues
+        guilds = collections.deque(
+            collections.deque(collections.deque(job for job in jobs if not job.future.done())
+                              for jobs in users.values())
+            for users in self._queues.values()
+        )
+        order = []
+        while guilds:
+            users = guilds.popleft()
+            jobs = users.popleft()
+            if jobs:
+                order.append(jobs.popleft())
+            if jobs:
+                users.append(jobs)
+            if users:
+                guilds.append(users)
+        return order
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "completed": self.completed,
+            "shed": self.shed,
+            "superseded": self.superseded,
+        }
+
+    def _next_job(self) -> Optional[_Job]:
+        while self._queues:
+            guild_key, users = next(iter(self._queues.items()))
+            user_key, jobs = next(iter(users.items()))
+            job = jobs.popleft()
+            # Rotate so the next pick comes from another user, then another guild
+            if jobs:
+                users.move_to_end(user_key)
+            else:
+                del users[user_key]
+            if users:
+                self._queues.move_to_end(guild_key)
+            else:
+                del self._queues[guild_key]
+            # Skip jobs that were superseded or shed while queued
+            if not job.future.done():
+                return job
+        return None
+
+    def _dispatch(self) -> None:
+        while self.running < self.max_in_flight:
+            job = self._next_job()
+            if job is None:
+                break
+            self.queued -= 1
+            job.timer.cancel()
+            if time.monotonic() > job.deadline:
+                self._fail(job, ShedError("Waited too long in the queue."))
+                self.shed += 1
+                continue
+            self.running += 1
+            self._notify(job, 0)
+            job.task = asyncio.create_task(self._run(job))
+        for position, job in enumerate(self.positions(), start=1):
+            self._notify(job, position)
+
+    async def _run(self, job: _Job) -> None:
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            self._fail(job, SupersededError("Replaced by a newer request."))
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+            self.completed += 1
+        finally:
+            self.running -= 1
+            self._forget(job)
+            self._dispatch()
+
+    def _supersede(self, job: _Job) -> None:
+        self.superseded += 1
+        if job.task is not None:
+            # Already running, cancelling the task frees its slot in _run
+            job.task.cancel()
+            return
+        self.queued -= 1
+        job.timer.cancel()
+        self._fail(job, SupersededError("Replaced by a newer request."))
+        self._forget(job)
+
+    def _expire(self, job: _Job) -> None:
+        # Deadline hit while still queued, shed it now rather than when its turn comes
+        if job.task is None and not job.future.done():
+            self.queued -= 1
+            self.shed += 1
+            self._fail(job, ShedError("Waited too long in the queue."))
+            self._forget(job)
+
+    def _forget(self, job: _Job) -> None:
+        if self._live.get((job.guild_key, job.user_key)) is job:
+            del self._live[(job.guild_key, job.user_key)]
+
+    @staticmethod
+    def _fail(job: _Job, error: Exception) -> None:
+        if not job.future.done():
+            job.future.set_exception(error)
+            # Mark it retrieved, the submitter may already be gone
+            job.future.exception()
+
+    @staticmethod
+    def _notify(job: _Job, position: int) -> None:
+        if job.on_position is not None and job.position != position:
+            job.position = position
+            job.on_position(position)